@@ -1,90 +1,844 @@
-import os
-import json
-from safetensors import safe_open
-from typing import Dict, List
-
-def extract_safetensors_metadata(file_path: str) -> Dict or None:
-    """
-    安全地从 .safetensors 文件中提取元数据。
-    """
-    try:
-        # 使用 safe_open 安全地打开 safetensors 文件
-        # 我们只读取元数据，不需要加载张量本身
-        with safe_open(file_path, framework="numpy") as f:
-            metadata = f.metadata()
-            return metadata
-    except Exception as e:
-        # 捕获任何读取错误，例如文件损坏或格式不正确
-        print(f"  [❌ 错误] 读取文件时发生错误 {os.path.basename(file_path)}: {e}")
-        return None
-
-def write_metadata_to_file(metadata: Dict or None, output_path: str, lora_file_name: str):
-    """
-    将元数据写入指定的文本文件。
-    """
-    try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(f"--- LoRA 文件名：{lora_file_name} ---\n\n")
-            
-            if metadata is None:
-                f.write("未找到或无法提取嵌入元数据。\n")
-                return
-
-            f.write("### 原始元数据 (Raw Metadata):\n")
-            # 使用 JSON 格式打印完整的原始元数据，确保清晰可读
-            f.write(json.dumps(metadata, indent=4, ensure_ascii=False))
-            
-            # --- 关键信息分析 ---
-            f.write("\n\n" + "="*50 + "\n")
-            f.write("### 关键信息猜测:\n")
-            
-            # 常见激活词/触发词的键名列表
-            trigger_keys = ['_i2i.trigger_words', 'ss_tag_frequency', 'ss_additional_metadata', 'activation_text', 'trigger_words', 'ss_word']
-            
-            trigger_found = False
-            for key in trigger_keys:
-                if key in metadata:
-                    value = metadata[key]
-                    f.write(f"**潜在激活词键 [{key}]**: {value}\n")
-                    trigger_found = True
-            
-            if not trigger_found:
-                f.write("未在常见键中找到明确的激活词。\n请仔细检查 '原始元数据' 部分。\n")
-            
-        print(f"  [✅ 成功] 元数据已保存到: {os.path.basename(output_path)}")
-
-    except Exception as e:
-        print(f"  [❌ 错误] 写入文件时发生错误: {e}")
-
-def main():
-    # 获取脚本所在的目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # 查找所有 .safetensors 文件
-    lora_files: List[str] = [
-        f for f in os.listdir(script_dir) 
-        if f.lower().endswith(".safetensors")
-    ]
-
-    if not lora_files:
-        print(f"警告：在当前文件夹 ({script_dir}) 中未找到任何 .safetensors 文件。")
-        print("请将此脚本与您的 LoRA 文件放在同一目录下运行。")
-        return
-
-    print(f"找到 {len(lora_files)} 个 .safetensors 文件，开始提取元数据...\n")
-    
-    for lora_file in lora_files:
-        print(f"处理文件: {lora_file}")
-        lora_path = os.path.join(script_dir, lora_file)
-        base_name = os.path.splitext(lora_file)[0]
-        output_file = os.path.join(script_dir, f"{base_name}_metadata.txt")
-        
-        # 提取并写入
-        metadata_dict = extract_safetensors_metadata(lora_path)
-        write_metadata_to_file(metadata_dict, output_file, lora_file)
-        print("-" * 30)
-
-    print("\n所有文件处理完毕。")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import os
+import sys
+import json
+import mmap
+import importlib.util
+import math
+import struct
+import sqlite3
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# safetensors 格式: 8 字节小端 u64 头部长度 + JSON 头部 + 张量数据。
+# 元数据在 JSON 头部的 "__metadata__" 中，只需读取头部，不需要 safetensors/numpy，也不读张量。
+SAFETENSORS_EXTENSION = ".safetensors"
+MAX_HEADER_BYTES = 100 * 1024 * 1024  # safetensors 自身对头部大小的上限
+
+# 常见激活词/触发词的键名列表
+TRIGGER_KEYS = ['_i2i.trigger_words', 'ss_tag_frequency', 'ss_additional_metadata', 'activation_text', 'trigger_words', 'ss_word']
+# 由作者直接给出 (逗号分隔) 的触发词键；ss_tag_frequency 为训练集标签统计
+EXPLICIT_TRIGGER_KEYS = ['_i2i.trigger_words', 'activation_text', 'trigger_words', 'ss_word']
+# 依次尝试的底模键
+BASE_MODEL_KEYS = ['ss_base_model_version', 'modelspec.architecture', 'ss_sd_model_name']
+
+_print_lock = threading.Lock()
+
+
+def log(message: str):
+    """多线程下整行输出，避免不同文件的提示交错。"""
+    with _print_lock:
+        print(message, flush=True)
+
+
+def read_safetensors_header(file_path: str) -> Dict:
+    """
+    只读取 .safetensors 文件的 JSON 头部 (张量名 -> dtype/shape/偏移，以及 "__metadata__")。
+    读取量为 8 字节 + 头部长度，与文件大小无关。格式不正确时抛出 ValueError。
+    """
+    return _read_header(file_path)[0]
+
+
+def _read_header(file_path: str):
+    """(头部字典, 张量数据起始偏移)；张量的 data_offsets 相对于数据起始偏移。"""
+    with open(file_path, 'rb') as f:
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            raise ValueError("文件太小，不是有效的 safetensors 文件")
+        (header_len,) = struct.unpack('<Q', prefix)
+        file_size = os.fstat(f.fileno()).st_size
+        if header_len > MAX_HEADER_BYTES or 8 + header_len > file_size:
+            raise ValueError(f"头部长度异常 ({header_len} 字节)")
+        header_bytes = f.read(header_len)
+    try:
+        header = json.loads(header_bytes)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"头部不是有效的 JSON: {e}") from e
+    if not isinstance(header, dict):
+        raise ValueError("头部不是 JSON 对象")
+    return header, 8 + header_len
+
+
+# --- 张量统计：mmap 映射文件，按块在 NumPy 视图上计算，不复制张量，峰值内存与文件大小无关 ---
+
+# 每块处理的元素数；临时数组最多为 块大小 × 8 字节
+STATS_CHUNK_ELEMENTS = 1 << 20
+
+# safetensors dtype -> NumPy dtype 名称 (BF16 按 uint16 读取后转换；F8 等 NumPy 没有的类型只统计形状)
+_NUMPY_DTYPES = {
+    'F64': '<f8', 'F32': '<f4', 'F16': '<f2', 'BF16': '<u2',
+    'I64': '<i8', 'I32': '<i4', 'I16': '<i2', 'I8': 'i1', 'U64': '<u8', 'U32': '<u4', 'U16': '<u2', 'U8': 'u1',
+    'BOOL': 'u1',
+}
+
+# LoRA 权重键: (后缀, rank 所在维度)
+_LORA_RANK_SUFFIXES = (('lora_down.weight', 0), ('lora_up.weight', 1), ('lora_A.weight', 0), ('lora_B.weight', 1))
+
+
+def _chunk_as_float(np, chunk, dtype: str):
+    if dtype == 'BF16':
+        # bfloat16 即 float32 的高 16 位
+        return (chunk.astype(np.uint32) << 16).view(np.float32)
+    if dtype in ('F32', 'F64'):
+        return chunk
+    return chunk.astype(np.float32)
+
+
+def _release_pages(mm, start: int, end: int):
+    """处理完的映射页从进程内存中释放 (文件页仍在系统缓存中)，让常驻内存不随文件大小增长。"""
+    if not hasattr(mm, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start -= start % mmap.PAGESIZE
+    if end > start:
+        try:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+        except (OSError, ValueError):
+            pass
+
+
+def _tensor_stats(np, mm, dtype: str, start: int, numel: int) -> Dict:
+    """一个张量的 L2 范数、均值、标准差、最大绝对值和 NaN/Inf 个数 (NaN/Inf 不计入其它统计)。"""
+    view = np.frombuffer(mm, dtype=np.dtype(_NUMPY_DTYPES[dtype]), count=numel, offset=start)
+    total = total_sq = 0.0
+    abs_max = 0.0
+    finite = nan = inf = 0
+    is_float = dtype in ('F64', 'F32', 'F16', 'BF16')
+    for i in range(0, numel, STATS_CHUNK_ELEMENTS):
+        x = _chunk_as_float(np, view[i:i + STATS_CHUNK_ELEMENTS], dtype)
+        if is_float:
+            bad = ~np.isfinite(x)
+            if bad.any():
+                n_nan = int(np.isnan(x).sum())
+                nan += n_nan
+                inf += int(bad.sum()) - n_nan
+                x = x[~bad]
+        if x.size:
+            finite += x.size
+            total += float(x.sum(dtype=np.float64))
+            total_sq += float(np.square(x, dtype=np.float64).sum())
+            abs_max = max(abs_max, float(np.abs(x).max()))
+        _release_pages(mm, start + i * view.itemsize, start + min(numel, i + STATS_CHUNK_ELEMENTS) * view.itemsize)
+    mean = total / finite if finite else 0.0
+    return {
+        'norm': math.sqrt(total_sq), 'mean': mean,
+        'std': math.sqrt(max(0.0, total_sq / finite - mean * mean)) if finite else 0.0,
+        'abs_max': abs_max, 'nan': nan, 'inf': inf,
+    }
+
+
+def compute_tensor_stats(file_path: str) -> Dict:
+    """
+    张量统计: 形状、dtype、总参数量、LoRA rank/alpha、逐层 L2 范数/均值/标准差/最大绝对值、NaN/Inf。
+    文件以只读 mmap 映射，每个张量是映射缓冲区上的 NumPy 视图，按 STATS_CHUNK_ELEMENTS 分块归约，
+    处理过的页面随即释放，因此峰值内存与文件大小无关。需要 numpy；格式错误时抛出 ValueError。
+    """
+    import numpy as np  # 仅统计模式需要，普通元数据提取不导入 numpy
+
+    started = time.monotonic()
+    header, data_start = _read_header(file_path)
+    tensors = sorted((name, info) for name, info in header.items() if name != '__metadata__')
+    stats = {'tensors': [], 'params': 0, 'bytes': 0, 'dtypes': {}, 'ranks': {}, 'alphas': {}, 'unsupported': []}
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size > 0 else None
+        try:
+            for name, info in tensors:
+                dtype, shape = info.get('dtype'), list(info.get('shape') or [])
+                begin, end = info.get('data_offsets') or (0, 0)
+                numel = math.prod(shape)
+                if data_start + end > file_size or begin > end:
+                    raise ValueError(f"张量 {name} 的数据偏移超出文件范围")
+                entry = {'name': name, 'dtype': dtype, 'shape': shape, 'numel': numel}
+                stats['params'] += numel
+                stats['bytes'] += end - begin
+                stats['dtypes'][dtype] = stats['dtypes'].get(dtype, 0) + 1
+                for suffix, axis in _LORA_RANK_SUFFIXES:
+                    if name.endswith(suffix) and len(shape) > axis:
+                        stats['ranks'][shape[axis]] = stats['ranks'].get(shape[axis], 0) + 1
+                        break
+                np_dtype = _NUMPY_DTYPES.get(dtype)
+                if np_dtype is None or numel * np.dtype(np_dtype).itemsize != end - begin:
+                    stats['unsupported'].append(name)
+                elif numel:
+                    entry.update(_tensor_stats(np, mm, dtype, data_start + begin, numel))
+                    if name.endswith('.alpha') and numel == 1:
+                        alpha = round(entry['mean'], 4)
+                        stats['alphas'][alpha] = stats['alphas'].get(alpha, 0) + 1
+                stats['tensors'].append(entry)
+        finally:
+            if mm is not None:
+                mm.close()
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def extract_safetensors_metadata(file_path: str, with_stats: bool = False):
+    """
+    安全地从 .safetensors 文件中提取元数据 (只读取文件头部)。
+    with_stats=True 时同时计算张量统计，返回 (元数据, 统计)；统计失败时为 None。
+    """
+    try:
+        metadata = read_safetensors_header(file_path).get('__metadata__')
+    except (OSError, ValueError) as e:
+        # 捕获任何读取错误，例如文件损坏或格式不正确
+        log(f"  [❌ 错误] 读取文件时发生错误 {os.path.basename(file_path)}: {e}")
+        return (None, None) if with_stats else None
+    if not with_stats:
+        return metadata
+    try:
+        stats = compute_tensor_stats(file_path)
+    except (OSError, ValueError) as e:
+        log(f"  [❌ 错误] 计算张量统计时发生错误 {os.path.basename(file_path)}: {e}")
+        stats = None
+    return metadata, stats
+
+
+def _format_count(value: int) -> str:
+    for unit, size in (('B', 10**9), ('M', 10**6), ('K', 10**3)):
+        if value >= size:
+            return f"{value:,} ({value / size:.2f}{unit})"
+    return f"{value:,}"
+
+
+def format_tensor_stats(stats: Dict) -> str:
+    """张量统计的报告文本 (写入 _metadata.txt)。"""
+    tensors = stats['tensors']
+    lines = [f"张量数: {len(tensors)}, 总参数量: {_format_count(stats['params'])}, "
+             f"数据大小: {stats['bytes'] / 1024 / 1024:.1f} MB (统计耗时 {stats['seconds']:.1f}s)",
+             "数据类型: " + ", ".join(f"{dtype} × {n}" for dtype, n in sorted(stats['dtypes'].items()))]
+    if stats['ranks']:
+        ranks = sorted(stats['ranks'].items(), key=lambda item: -item[1])
+        lines.append("LoRA rank: " + ", ".join(f"{rank} ({n} 个 down/up 权重)" for rank, n in ranks))
+    if stats['alphas']:
+        lines.append("alpha: " + ", ".join(f"{alpha:g} × {n}" for alpha, n in sorted(stats['alphas'].items())))
+    broken = [t for t in tensors if t.get('nan') or t.get('inf')]
+    if broken:
+        lines.append(f"⚠️ {len(broken)} 个张量含 NaN/Inf:")
+        lines.extend(f"  {t['name']}: NaN {t['nan']}, Inf {t['inf']}" for t in broken)
+    else:
+        lines.append("NaN/Inf: 无")
+    if stats['unsupported']:
+        lines.append(f"未统计数值的张量 (NumPy 不支持的 dtype 或大小不符): {len(stats['unsupported'])} 个")
+    lines.append("")
+    lines.append("逐层统计:")
+    lines.append(f"  {'L2范数':>12} {'均值':>12} {'标准差':>12} {'最大绝对值':>12}  {'dtype':<5} {'形状':<16} 名称")
+    for t in tensors:
+        shape = 'x'.join(str(d) for d in t['shape']) or '标量'
+        if 'norm' in t:
+            lines.append(f"  {t['norm']:>12.5g} {t['mean']:>12.4g} {t['std']:>12.4g} {t['abs_max']:>12.4g}  "
+                         f"{t['dtype']:<5} {shape:<16} {t['name']}")
+        else:
+            lines.append(f"  {'-':>12} {'-':>12} {'-':>12} {'-':>12}  {t['dtype']:<5} {shape:<16} {t['name']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metadata_to_file(metadata: Dict or None, output_path: str, lora_file_name: str, stats: Dict or None = None):
+    """
+    将元数据 (以及可选的张量统计) 写入指定的文本文件。
+    """
+    try:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(f"--- LoRA 文件名：{lora_file_name} ---\n\n")
+            
+            if metadata is None:
+                f.write("未找到或无法提取嵌入元数据。\n")
+            else:
+                _write_metadata_sections(f, metadata)
+
+            if stats is not None:
+                f.write("\n" + "="*50 + "\n")
+                f.write("### 张量统计 (Tensor Statistics):\n")
+                f.write(format_tensor_stats(stats))
+
+        log(f"  [✅ 成功] 元数据已保存到: {output_path}")
+
+    except Exception as e:
+        log(f"  [❌ 错误] 写入文件时发生错误 {output_path}: {e}")
+
+
+def _write_metadata_sections(f, metadata: Dict):
+    """原始元数据与潜在激活词两部分。"""
+    f.write("### 原始元数据 (Raw Metadata):\n")
+    # 使用 JSON 格式打印完整的原始元数据，确保清晰可读
+    f.write(json.dumps(metadata, indent=4, ensure_ascii=False))
+    
+    # --- 关键信息分析 ---
+    f.write("\n\n" + "="*50 + "\n")
+    f.write("### 关键信息猜测:\n")
+    
+    trigger_found = False
+    for key in TRIGGER_KEYS:
+        if key in metadata:
+            value = metadata[key]
+            f.write(f"**潜在激活词键 [{key}]**: {value}\n")
+            trigger_found = True
+    
+    if not trigger_found:
+        f.write("未在常见键中找到明确的激活词。\n请仔细检查 '原始元数据' 部分。\n")
+
+
+def find_safetensors_files(paths: List[str], recursive: bool = True, unreadable: List[str] = None) -> List[str]:
+    """
+    收集给定文件/目录下的所有 .safetensors 文件 (默认递归子目录，跳过以 . 开头的目录)。
+    返回排序后的绝对路径列表；给出 unreadable 时把无法读取的目录追加进去。
+    """
+    found = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            if path.lower().endswith(SAFETENSORS_EXTENSION):
+                found.append(path)
+            continue
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                log(f"  [⚠️ 跳过] 无法读取目录 {directory}: {e}")
+                if unreadable is not None:
+                    unreadable.append(directory)
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not entry.name.startswith('.'):
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(SAFETENSORS_EXTENSION) and entry.is_file():
+                    found.append(entry.path)
+    return sorted(set(found))
+
+
+def process_file(lora_path: str, with_stats: bool = False) -> bool:
+    """提取一个文件的元数据 (可选张量统计) 并写入同目录下的 <文件名>_metadata.txt，返回是否读取成功。"""
+    lora_file = os.path.basename(lora_path)
+    base_name = os.path.splitext(lora_path)[0]
+    stats = None
+    if with_stats:
+        metadata_dict, stats = extract_safetensors_metadata(lora_path, with_stats=True)
+    else:
+        metadata_dict = extract_safetensors_metadata(lora_path)
+    write_metadata_to_file(metadata_dict, f"{base_name}_metadata.txt", lora_file, stats)
+    return metadata_dict is not None and (stats is not None or not with_stats)
+
+
+def default_workers() -> int:
+    # 每个文件只读几 KB 头部，耗时主要在磁盘/网络延迟上，线程数可以比 CPU 核数多
+    return min(32, (os.cpu_count() or 4) * 4)
+
+
+def run_extract(args):
+    recursive = not args.no_recursive
+    lora_files = find_safetensors_files(args.paths, recursive=recursive)
+
+    if not lora_files:
+        print(f"警告：在 {', '.join(args.paths)} 中未找到任何 .safetensors 文件。")
+        print("请将此脚本与您的 LoRA 文件放在同一目录下运行，或在命令行中指定模型目录。")
+        return 1
+
+    if args.stats:
+        if importlib.util.find_spec('numpy') is None:
+            print("张量统计需要 numpy，请先运行: pip install numpy")
+            return 1
+        # 统计受 CPU 与磁盘带宽限制，线程数不必超过 CPU 核数 (NumPy 运算时会释放 GIL)
+        workers = max(1, args.workers or (os.cpu_count() or 4))
+    else:
+        workers = max(1, args.workers or default_workers())
+    print(f"找到 {len(lora_files)} 个 .safetensors 文件{'（含子目录）' if recursive else ''}，"
+          f"使用 {workers} 个线程提取元数据{'与张量统计' if args.stats else ''}...\n")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda path: process_file(path, args.stats), lora_files))
+
+    failed = results.count(False)
+    print(f"\n所有文件处理完毕: 成功 {len(results) - failed}, 失败 {failed}, 耗时 {time.monotonic() - started:.1f}s。")
+    return 0 if failed == 0 else 1
+
+
+# --- 元数据索引：SQLite 按 路径/大小/修改时间 记录，重复运行只解析新增或变化的文件 ---
+
+INDEX_FILENAME = "lora_metadata_index.db"
+# 标签存储格式变化时加一；旧版本的索引在打开时清空，下次 index 全部重建
+INDEX_VERSION = 2
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    base_model  TEXT,
+    metadata    TEXT,
+    error       TEXT,
+    indexed_at  REAL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    path    TEXT NOT NULL,
+    tag     TEXT NOT NULL,
+    count   INTEGER NOT NULL,
+    source  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags (tag COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_tags_path ON tags (path);
+CREATE INDEX IF NOT EXISTS idx_files_base ON files (base_model);
+CREATE INDEX IF NOT EXISTS idx_files_name ON files (name);
+"""
+
+
+def parse_tag_frequency(metadata: Dict) -> Dict[str, int]:
+    """
+    ss_tag_frequency ({数据集目录: {标签: 次数}} 的 JSON 字符串) 合并为 {小写标签: 总次数}。
+    大小写不同的同一标签合并计数；无法解析时返回空字典。
+    """
+    raw = (metadata or {}).get('ss_tag_frequency')
+    if not raw:
+        return {}
+    try:
+        folders = json.loads(raw) if isinstance(raw, str) else raw
+    except json.JSONDecodeError:
+        return {}
+    counts = {}
+    if not isinstance(folders, dict):
+        return counts
+    for folder_tags in folders.values():
+        if not isinstance(folder_tags, dict):
+            continue
+        for tag, count in folder_tags.items():
+            tag = str(tag).strip().lower()
+            if tag:
+                try:
+                    counts[tag] = counts.get(tag, 0) + int(count)
+                except (TypeError, ValueError):
+                    continue
+    return counts
+
+
+def parse_trigger_words(value) -> List[str]:
+    """作者填写的触发词 (逗号分隔的字符串或 JSON 列表) 拆成小写、去重后的列表。"""
+    if isinstance(value, str):
+        try:
+            decoded = json.loads(value)
+            if isinstance(decoded, list):
+                value = decoded
+        except json.JSONDecodeError:
+            pass
+    parts = value if isinstance(value, list) else str(value).split(',')
+    return list(dict.fromkeys(str(part).strip().lower() for part in parts if str(part).strip()))
+
+
+def base_model_of(metadata: Dict) -> str or None:
+    for key in BASE_MODEL_KEYS:
+        value = (metadata or {}).get(key)
+        if value:
+            return str(value)
+    return None
+
+
+class MetadataIndex:
+    """
+    LoRA 元数据索引 (SQLite, WAL)。每个文件一行 (路径、大小、修改时间、底模、原始元数据)，
+    标签与触发词拆到 tags 表并按标签建索引，查询不需要再读取任何模型文件。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_INDEX_SCHEMA)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self.conn.execute("DELETE FROM tags")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            self.conn.commit()
+
+    def known_files(self) -> Dict[str, tuple]:
+        return {path: (size, mtime_ns) for path, size, mtime_ns in
+                self.conn.execute("SELECT path, size, mtime_ns FROM files")}
+
+    def store(self, path: str, size: int, mtime_ns: int, metadata: Dict or None, error: str or None):
+        """写入 (或替换) 一个文件的记录；调用方负责 commit。"""
+        self.conn.execute("DELETE FROM tags WHERE path = ?", (path,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, name, size, mtime_ns, base_model, metadata, error, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, os.path.basename(path), size, mtime_ns, base_model_of(metadata),
+             json.dumps(metadata, ensure_ascii=False) if metadata is not None else None, error, time.time()))
+        rows = [(path, tag, count, 'ss_tag_frequency') for tag, count in parse_tag_frequency(metadata).items()]
+        for key in EXPLICIT_TRIGGER_KEYS:
+            if metadata and metadata.get(key):
+                rows.extend((path, word, 0, key) for word in parse_trigger_words(metadata[key]))
+        self.conn.executemany("INSERT INTO tags (path, tag, count, source) VALUES (?, ?, ?, ?)", rows)
+
+    def remove(self, paths: List[str]):
+        for path in paths:
+            self.conn.execute("DELETE FROM tags WHERE path = ?", (path,))
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def find_file(self, name: str) -> List[str]:
+        """按完整路径、文件名或文件名前缀 (不含扩展名) 查找已索引的文件路径。"""
+        rows = self.conn.execute("SELECT path FROM files WHERE path = ? OR name = ? OR name = ? ORDER BY path",
+                                 (os.path.abspath(name), name, name + SAFETENSORS_EXTENSION)).fetchall()
+        if not rows:
+            rows = self.conn.execute("SELECT path FROM files WHERE name LIKE ? ESCAPE '\\' ORDER BY path",
+                                     (name.replace('%', r'\%').replace('_', r'\_') + '%',)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def default_index_path() -> str:
+    """index 与 query 共用的默认索引位置: 脚本所在目录 (索引可以覆盖多个模型目录)。"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), INDEX_FILENAME)
+
+
+def scanned_by(path: str, roots: List[str], recursive: bool, unreadable: List[str]) -> bool:
+    """path 是否落在这次扫描实际能看到的范围内 (与 find_safetensors_files 的遍历规则一致)。"""
+    if any(path == d or path.startswith(os.path.join(d, '')) for d in unreadable):
+        return False
+    for root in roots:
+        if path == root:
+            return True
+        if not path.startswith(os.path.join(root, '')):
+            continue
+        subdirs = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+        if subdirs == ['.'] or (recursive and not any(part.startswith('.') for part in subdirs)):
+            return True
+    return False
+
+
+def read_for_index(item):
+    path, size, mtime_ns = item
+    try:
+        return path, size, mtime_ns, read_safetensors_header(path).get('__metadata__'), None
+    except (OSError, ValueError) as e:
+        return path, size, mtime_ns, None, str(e)
+
+
+def run_index(args):
+    db_path = args.db or default_index_path()
+    started = time.monotonic()
+    unreadable = []
+    lora_files = find_safetensors_files(args.paths, recursive=not args.no_recursive, unreadable=unreadable)
+    index = MetadataIndex(db_path)
+    try:
+        known = index.known_files()
+        todo = []
+        for path in lora_files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (st.st_size, st.st_mtime_ns):
+                todo.append((path, st.st_size, st.st_mtime_ns))
+
+        # 只清理本次扫描能看到却没找到的文件；未扫描的子目录 (--no-recursive、. 开头、无法读取) 和其它目录的记录保留
+        roots = [os.path.abspath(p) for p in args.paths]
+        present = set(lora_files)
+        removed = [path for path in known if path not in present
+                   and scanned_by(path, roots, not args.no_recursive, unreadable)]
+
+        workers = max(1, args.workers or default_workers())
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, size, mtime_ns, metadata, error in executor.map(read_for_index, todo):
+                if error:
+                    failed += 1
+                    log(f"  [❌ 错误] 读取文件时发生错误 {path}: {error}")
+                index.store(path, size, mtime_ns, metadata, error)
+        index.remove(removed)
+        index.conn.commit()
+        total = index.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    finally:
+        index.close()
+    print(f"索引已更新: {db_path}\n扫描 {len(lora_files)} 个文件, 新增/变化 {len(todo)} 个 (失败 {failed}), "
+          f"删除 {len(removed)} 个, 未变化 {len(lora_files) - len(todo)} 个; 索引共 {total} 个文件, 耗时 {time.monotonic() - started:.1f}s。")
+    return 0
+
+
+def run_query(args):
+    db_path = args.db or default_index_path()
+    if not os.path.exists(db_path):
+        print(f"索引不存在: {db_path}\n请先运行: index <模型目录> [--db 索引文件]")
+        return 1
+    index = MetadataIndex(db_path)
+    try:
+        return args.query_func(index, args)
+    finally:
+        index.close()
+
+
+def query_tag(index: MetadataIndex, args) -> int:
+    """哪些 LoRA 提到了某个标签 (训练集标签或作者触发词)。"""
+    if args.like:
+        condition, value = "t.tag LIKE ?", '%' + args.tag + '%'
+    else:
+        condition, value = "t.tag = ? COLLATE NOCASE", args.tag
+    rows = index.conn.execute(
+        f"SELECT f.path, f.base_model, SUM(t.count), GROUP_CONCAT(DISTINCT t.source), GROUP_CONCAT(DISTINCT t.tag) "
+        f"FROM tags t JOIN files f ON f.path = t.path WHERE {condition} "
+        f"GROUP BY f.path ORDER BY SUM(t.count) DESC, f.path LIMIT ?", (value, args.limit)).fetchall()
+    if not rows:
+        print(f"没有 LoRA 提到标签: {args.tag}")
+        return 1
+    print(f"提到标签 '{args.tag}' 的 LoRA ({len(rows)} 个):")
+    for path, base_model, count, sources, matched in rows:
+        explicit = " [作者触发词]" if any(source != 'ss_tag_frequency' for source in sources.split(',')) else ""
+        print(f"  {count:>6}  {base_model or '-':<24} {path}{explicit}" + (f"  ({matched})" if args.like else ""))
+    return 0
+
+
+def query_top(index: MetadataIndex, args) -> int:
+    """某个文件的主要触发词: 作者触发词在前，其后按训练集标签次数排序。"""
+    paths = index.find_file(args.file)
+    if not paths:
+        print(f"索引中没有文件: {args.file}")
+        return 1
+    for path in paths:
+        row = index.conn.execute("SELECT base_model, error FROM files WHERE path = ?", (path,)).fetchone()
+        print(f"--- {path} (底模: {row[0] or '-'}) ---")
+        if row[1]:
+            print(f"  读取失败: {row[1]}")
+            continue
+        rows = index.conn.execute(
+            "SELECT tag, MAX(count), GROUP_CONCAT(DISTINCT source) FROM tags WHERE path = ? GROUP BY tag "
+            "ORDER BY MIN(source = 'ss_tag_frequency'), MAX(count) DESC, tag LIMIT ?", (path, args.limit)).fetchall()
+        if not rows:
+            print("  未在常见键中找到激活词或标签。")
+        for tag, count, sources in rows:
+            explicit = [source for source in sources.split(',') if source != 'ss_tag_frequency']
+            print(f"  {count:>6}  {tag}" + (f"  [{', '.join(explicit)}]" if explicit else ""))
+    return 0
+
+
+def query_base(index: MetadataIndex, args) -> int:
+    """按底模列出 LoRA；不带参数时列出各底模的文件数。"""
+    if not args.base_model:
+        rows = index.conn.execute("SELECT COALESCE(base_model, '(未知)'), COUNT(*) FROM files "
+                                  "GROUP BY base_model ORDER BY COUNT(*) DESC").fetchall()
+        for base_model, count in rows:
+            print(f"  {count:>6}  {base_model}")
+        return 0
+    rows = index.conn.execute("SELECT path, base_model FROM files WHERE base_model LIKE ? ORDER BY base_model, path LIMIT ?",
+                              ('%' + args.base_model + '%', args.limit)).fetchall()
+    if not rows:
+        print(f"没有底模匹配 '{args.base_model}' 的 LoRA")
+        return 1
+    for path, base_model in rows:
+        print(f"  {base_model:<24} {path}")
+    return 0
+
+
+# --- 标签统计：全库 ss_tag_frequency 汇总为稀疏计数矩阵 (CSR)，向量化计算合并次数、各模型高频标签与 TF-IDF 区分度 ---
+
+TAG_REPORT_FILENAME = "lora_tag_report.txt"
+TAG_PROMPTS_FILENAME = "lora_trigger_prompts.json"
+
+
+def read_for_tags(path: str):
+    """(路径, 底模, {小写标签: 次数}, 作者触发词, 错误)。"""
+    try:
+        metadata = read_safetensors_header(path).get('__metadata__') or {}
+    except (OSError, ValueError) as e:
+        return path, None, {}, [], str(e)
+    counts = parse_tag_frequency(metadata)
+    triggers = []
+    for key in EXPLICIT_TRIGGER_KEYS:
+        if metadata.get(key):
+            triggers.extend(parse_trigger_words(metadata[key]))
+    return path, base_model_of(metadata), counts, list(dict.fromkeys(triggers)), None
+
+
+def build_tag_matrix(np, file_tags: List[Dict[str, int]]):
+    """
+    每个文件的 {标签: 次数} 组成 CSR 稀疏矩阵 (文件 × 标签)。
+    返回 (indptr, indices, data, 标签列表)；indices/data 按文件依次排列。
+    """
+    vocabulary = {}
+    lengths = np.fromiter((len(tags) for tags in file_tags), dtype=np.int64, count=len(file_tags))
+    indptr = np.zeros(len(file_tags) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    nnz = int(indptr[-1])
+    indices = np.empty(nnz, dtype=np.int32)
+    data = np.empty(nnz, dtype=np.int64)
+    position = 0
+    for tags in file_tags:
+        n = len(tags)
+        indices[position:position + n] = [vocabulary.setdefault(tag, len(vocabulary)) for tag in tags]
+        data[position:position + n] = list(tags.values())
+        position += n
+    return indptr, indices, data, list(vocabulary)
+
+
+def top_k_per_row(np, indptr, scores, k: int):
+    """
+    每行 (文件) 按得分降序的前 k 个非零项在 CSR 数组中的位置，返回 (行号, 位置) 两个数组。
+    一次 lexsort 完成所有行的排序，不逐行循环。
+    """
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.lexsort((-scores, rows))
+    rank = np.arange(len(order)) - indptr[rows[order]]
+    keep = order[rank < k]
+    return rows[keep], keep
+
+
+def display_path(path: str, start: str) -> str:
+    """相对 start 的路径；Windows 上不在同一盘符时 relpath 会报错，改用绝对路径。"""
+    try:
+        return os.path.relpath(path, start)
+    except ValueError:
+        return os.path.abspath(path)
+
+
+def aggregate_tags(np, file_tags: List[Dict[str, int]], top: int):
+    """
+    标签统计的向量化部分。返回字典:
+      tags: 标签列表; total/df: 每个标签的总次数/出现在多少个文件中;
+      top_count / top_tfidf: 每个文件的 [(标签序号, 值)]，分别按次数和 TF-IDF 排序。
+    TF 为标签在该文件中的占比，IDF = ln((1 + 文件数) / (1 + df)) + 1。
+    """
+    indptr, indices, data, tags = build_tag_matrix(np, file_tags)
+    n_files, n_tags = len(file_tags), len(tags)
+    rows = np.repeat(np.arange(n_files), np.diff(indptr))
+    total = np.bincount(indices, weights=data, minlength=n_tags).astype(np.int64)
+    df = np.bincount(indices, minlength=n_tags)
+    row_total = np.bincount(rows, weights=data, minlength=n_files)
+    tf = data / np.maximum(row_total[rows], 1)
+    idf = np.log((1.0 + n_files) / (1.0 + df)) + 1.0
+    tfidf = tf * idf[indices]
+
+    result = {'tags': tags, 'total': total, 'df': df, 'nnz': len(indices),
+              'top_count': [[] for _ in range(n_files)], 'top_tfidf': [[] for _ in range(n_files)]}
+    for key, scores in (('top_count', data.astype(np.float64)), ('top_tfidf', tfidf)):
+        for row, position in zip(*top_k_per_row(np, indptr, scores, top)):
+            result[key][row].append((int(indices[position]), float(scores[position])))
+    return result
+
+
+def run_tags(args):
+    if importlib.util.find_spec('numpy') is None:
+        print("标签统计需要 numpy，请先运行: pip install numpy")
+        return 1
+    import numpy as np
+
+    started = time.monotonic()
+    lora_files = find_safetensors_files(args.paths, recursive=not args.no_recursive)
+    if not lora_files:
+        print(f"警告：在 {', '.join(args.paths)} 中未找到任何 .safetensors 文件。")
+        return 1
+    workers = max(1, args.workers or default_workers())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        entries = list(executor.map(read_for_tags, lora_files))
+    for path, _, _, _, error in entries:
+        if error:
+            log(f"  [❌ 错误] 读取文件时发生错误 {path}: {error}")
+    entries = [entry for entry in entries if entry[2] or entry[3]]
+    read_seconds = time.monotonic() - started
+    if not entries:
+        print(f"{len(lora_files)} 个文件中没有 ss_tag_frequency 或触发词元数据。")
+        return 1
+
+    stats = aggregate_tags(np, [entry[2] for entry in entries], args.top)
+    tags, total, df = stats['tags'], stats['total'], stats['df']
+    output_dir = args.output_dir or (os.path.abspath(args.paths[0]) if os.path.isdir(args.paths[0])
+                                     else os.path.dirname(os.path.abspath(args.paths[0])))
+
+    lines = ["=== LoRA 标签统计 ===",
+             f"文件: {len(lora_files)} 个 (有标签或触发词: {len(entries)} 个), 不同标签: {len(tags)}, "
+             f"非零项: {stats['nnz']}, 标签出现总次数: {int(total.sum())}",
+             "", f"--- 全库最常见标签 (前 {args.top_global}) ---", f"  {'总次数':>10} {'文件数':>8}  标签"]
+    for tag_id in np.argsort(-total, kind='stable')[:args.top_global]:
+        lines.append(f"  {total[tag_id]:>10} {df[tag_id]:>8}  {tags[tag_id]}")
+    lines += ["", f"--- 各 LoRA (高频标签 / 区分度标签按 TF-IDF 排序, 各前 {args.top}) ---"]
+
+    prompts = []
+    for (path, base_model, _, triggers, _), by_count, by_tfidf in zip(entries, stats['top_count'], stats['top_tfidf']):
+        lines.append(f"[{display_path(path, output_dir)}] 底模: {base_model or '-'}")
+        if triggers:
+            lines.append("  作者触发词: " + ", ".join(triggers))
+        if by_count:
+            lines.append("  高频标签: " + ", ".join(f"{tags[t]} ({int(v)})" for t, v in by_count))
+            lines.append("  区分度标签: " + ", ".join(f"{tags[t]} ({v:.3f})" for t, v in by_tfidf))
+        # 提示词: 作者触发词在前，其后是最能区分该 LoRA 的标签
+        words = list(dict.fromkeys(triggers + [tags[t] for t, _ in by_tfidf]))[:max(args.top, len(triggers))]
+        if words:
+            prompts.append(", ".join(words))
+
+    elapsed = time.monotonic() - started
+    lines += ["", f"读取 {read_seconds:.1f}s, 统计 {elapsed - read_seconds:.2f}s"]
+    report_path = os.path.join(output_dir, TAG_REPORT_FILENAME)
+    prompts_path = os.path.join(output_dir, TAG_PROMPTS_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    # 字符串数组，可直接作为批量上传脚本的提示词 JSON 使用
+    with open(prompts_path, 'w', encoding='utf-8') as f:
+        json.dump(prompts, f, ensure_ascii=False, indent=2)
+    print(f"标签统计完成: {len(entries)} 个文件, {len(tags)} 个不同标签, 耗时 {elapsed:.1f}s\n"
+          f"  报告: {report_path}\n  提示词 JSON ({len(prompts)} 条): {prompts_path}")
+    return 0
+
+
+def build_parser():
+    # 获取脚本所在的目录 (不带参数运行时处理该目录)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="只读取文件头部，批量提取 .safetensors (LoRA/模型) 的嵌入元数据")
+    subparsers = parser.add_subparsers(dest='command')
+
+    extract = subparsers.add_parser('extract', help="为每个 .safetensors 文件生成 <文件名>_metadata.txt (默认命令)")
+    extract.add_argument('paths', nargs='*', default=[script_dir], help="模型文件或目录 (默认脚本所在目录)")
+    extract.add_argument('--no-recursive', action='store_true', help="不扫描子目录")
+    extract.add_argument('--workers', type=int, default=0, help="并行线程数 (默认按 CPU 核数自动选择)")
+    extract.add_argument('--stats', action='store_true',
+                         help="同时计算张量统计 (rank、dtype、参数量、逐层范数、NaN/Inf)，需要 numpy")
+    extract.set_defaults(func=run_extract)
+
+    index = subparsers.add_parser('index', help="建立/增量更新 SQLite 元数据索引 (只解析新增或变化的文件)")
+    index.add_argument('paths', nargs='*', default=[script_dir], help="模型文件或目录 (默认脚本所在目录)")
+    index.add_argument('--db', help=f"索引文件 (默认脚本所在目录下的 {INDEX_FILENAME})")
+    index.add_argument('--no-recursive', action='store_true', help="不扫描子目录")
+    index.add_argument('--workers', type=int, default=0, help="并行线程数 (默认按 CPU 核数自动选择)")
+    index.set_defaults(func=run_index)
+
+    tags = subparsers.add_parser('tags', help="全库标签统计: 合并次数、各模型高频/区分度标签，并导出提示词 JSON (需要 numpy)")
+    tags.add_argument('paths', nargs='*', default=[script_dir], help="模型文件或目录 (默认脚本所在目录)")
+    tags.add_argument('--top', type=int, default=10, help="每个 LoRA 列出的标签数，也是每条提示词的标签数 (默认 10)")
+    tags.add_argument('--top-global', type=int, default=100, help="全库最常见标签列出多少个 (默认 100)")
+    tags.add_argument('--output-dir', help=f"{TAG_REPORT_FILENAME} / {TAG_PROMPTS_FILENAME} 的输出目录 (默认第一个目录)")
+    tags.add_argument('--no-recursive', action='store_true', help="不扫描子目录")
+    tags.add_argument('--workers', type=int, default=0, help="并行线程数 (默认按 CPU 核数自动选择)")
+    tags.set_defaults(func=run_tags)
+
+    query = subparsers.add_parser('query', help="查询元数据索引")
+    query.add_argument('--db', help=f"索引文件 (默认脚本所在目录下的 {INDEX_FILENAME})")
+    query.set_defaults(func=run_query)
+    # --db 写在 query 前后都可以；子命令里不给时不覆盖前面的值
+    query_options = argparse.ArgumentParser(add_help=False)
+    query_options.add_argument('--db', default=argparse.SUPPRESS, help=f"索引文件 (默认脚本所在目录下的 {INDEX_FILENAME})")
+    query_options.add_argument('--limit', type=int, default=50, help="最多显示多少行 (默认 50)")
+    queries = query.add_subparsers(dest='query', required=True)
+    by_tag = queries.add_parser('tag', parents=[query_options], help="哪些 LoRA 提到了某个标签/触发词")
+    by_tag.add_argument('tag')
+    by_tag.add_argument('--like', action='store_true', help="按包含匹配而不是完整匹配 (不区分大小写)")
+    by_tag.set_defaults(query_func=query_tag)
+    top = queries.add_parser('top', parents=[query_options], help="某个文件的主要触发词")
+    top.add_argument('file', help="文件名、路径或文件名前缀")
+    top.set_defaults(query_func=query_top)
+    base = queries.add_parser('base', parents=[query_options], help="按底模列出 LoRA (不带参数时统计各底模数量)")
+    base.add_argument('base_model', nargs='?', help="底模名称 (包含匹配)")
+    base.set_defaults(query_func=query_base)
+    return parser, extract
+
+
+def main(argv=None):
+    parser, extract = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # 直接双击运行时与以前一样处理脚本所在目录
+        args = extract.parse_args([])
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import RunMetrics
+from polling import AdaptivePollingPolicy
+from rate_limit import RateLimits, is_queue_full
+from run_journal import STATE_CREATED, STATE_FAILED, STATE_SUCCEEDED
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖: pip install aiohttp
+    aiohttp = None
+
+# --- asyncio 任务引擎：单事件循环内提交并轮询大量任务 ---
+
+OUTPUTS_URL = "https://www.runninghub.cn/task/openapi/outputs"
+
+
+def is_available():
+    return aiohttp is not None
+
+
+class AsyncTaskEngine:
+    """
+    Submits payloads to the configured create endpoint and polls /task/openapi/outputs
+    from a single event loop. Each in-flight task is a coroutine waiting on a timer
+    instead of a sleeping thread, so thousands of outstanding tasks cost little memory.
+
+    Success/failure semantics mirror APIRunnerApp._handle_single_task:
+    - create fails (HTTP error, code != 0 or no taskId)      -> failure
+    - outputs code == 0 with a non-empty data list           -> success
+    - outputs code == 0 with empty data                      -> failure
+    - outputs code != 0                                      -> still running
+    - network error while polling                            -> keep polling
+    - no result before task_timeout                          -> failure
+
+    Optional hooks for the run journal: on_event(batch_id, payload, state, task_id=None,
+    file_urls=None) is called when a task is created, succeeds or finally fails, and
+    resume_lookup(payload) -> (state, task_id, file_urls) lets a resumed run skip finished
+    payloads or re-attach to an unfinished task. rate_limits (rate_limit.RateLimits) paces
+    creates and polls; a queue-full create response backs off without using up a retry.
+    prepare_payload(payload, batch_id) -> payload or None runs in a worker thread before
+    anything else (used to wait for a pipelined payload's own uploads); None fails the payload.
+    metrics (metrics.RunMetrics) receives the same create/poll/task timings as the thread path.
+
+    The synchronous hooks (on_event, resume_lookup) and the payload iterator (which streams
+    prompt files) do journal/cache/file I/O, so run_payloads() calls them on one dedicated
+    thread instead of the event loop: polls never stall behind them, calls stay in order, and
+    they cannot queue behind prepare_payload calls blocked on uploads in the default pool.
+    """
+
+    def __init__(self, api_url, headers, connect_timeout=60, polling_interval=5, task_timeout=300,
+                 max_in_flight=100, max_connections=100, log=None, outputs_url=OUTPUTS_URL, polling_policy=None,
+                 on_event=None, resume_lookup=None, rate_limits=None, prepare_payload=None, metrics=None):
+        if aiohttp is None:
+            raise RuntimeError("asyncio 引擎需要 aiohttp: pip install aiohttp")
+        self.api_url = api_url
+        self.outputs_url = outputs_url
+        self.headers = dict(headers)
+        self.connect_timeout = connect_timeout
+        self.polling_interval = polling_interval
+        self.task_timeout = task_timeout
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_connections = max(1, max_connections)
+        self.log = log or (lambda message, level='INFO': None)
+        self.polling_policy = polling_policy or AdaptivePollingPolicy(base_interval=polling_interval, adaptive=False,
+                                                                      history_path=None)
+        self.rate_limits = rate_limits or RateLimits()
+        self.prepare_payload = prepare_payload
+        self.metrics = metrics or RunMetrics()
+        self.on_event = on_event or (lambda batch_id, payload, state, task_id=None, file_urls=None: None)
+        self.resume_lookup = resume_lookup or (lambda payload: (None, None, []))
+        self._io_executor = None
+
+    async def _offload(self, func, *args, **kwargs):
+        """Runs a blocking hook on the I/O thread of run_payloads() (inline outside of it)."""
+        if self._io_executor is None:
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, functools.partial(func, *args, **kwargs))
+
+    async def _post_json(self, session, url, payload):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.connect_timeout)
+        async with session.post(url, json=payload, headers=self.headers, timeout=timeout) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def run_task(self, session, payload, batch_id, task_id=None):
+        """
+        Creates one task (or re-attaches to task_id) and polls it to completion.
+        Returns (success, file_urls).
+        """
+        metrics = self.metrics
+        webapp_id = payload.get('webappId')
+        try:
+            if task_id:
+                self.log(f"批次 {batch_id}: 重新接管未完成的任务, Task ID: {task_id}", level='INFO')
+            else:
+                self.log(f"批次 {batch_id}: 正在创建任务...", level='INFO')
+                limits = self.rate_limits.create
+                throttled_wait = 0.0
+                while True:
+                    await asyncio.sleep(limits.reserve())
+                    sent_at = time.monotonic()
+                    try:
+                        create_data = await self._post_json(session, self.api_url, payload)
+                    finally:
+                        metrics.observe('create', webapp_id, time.monotonic() - sent_at)
+                    if not is_queue_full(create_data) or throttled_wait >= self.task_timeout:
+                        break
+                    metrics.inc('queue_full', webapp_id)
+                    cooldown = limits.throttled()
+                    throttled_wait += cooldown
+                    self.log(f"批次 {batch_id}: 平台队列已满 ({create_data.get('msg', create_data.get('code'))}), "
+                             f"当前创建速率 {limits.describe()}, {cooldown:.0f}s 后重新提交 (不计入重试次数)", level='WARNING')
+
+                if create_data.get('code') != 0 or 'taskId' not in (create_data.get('data') or {}):
+                    error_msg = create_data.get('msg', '创建任务时返回了未知错误')
+                    metrics.inc('create_errors', webapp_id)
+                    self.log(f"批次 {batch_id}: 创建任务失败: {error_msg}", level='ERROR')
+                    return False, []
+
+                task_id = create_data['data']['taskId']
+                limits.succeeded()
+                await self._offload(self.on_event, batch_id, payload, STATE_CREATED, task_id=task_id)
+                self.log(f"批次 {batch_id}: 任务创建成功, Task ID: {task_id}", level='INFO')
+
+            start_time = last_poll_at = time.monotonic()
+            outputs_payload = {"apiKey": payload.get('apiKey'), "taskId": task_id}
+            schedule = self.polling_policy.schedule(webapp_id, self.task_timeout)
+            while True:
+                elapsed = time.monotonic() - start_time
+                if elapsed > self.task_timeout:
+                    self.polling_policy.record_finished(webapp_id, schedule)
+                    self.log(f"批次 {batch_id}: 任务超时 ({self.task_timeout}s, 已查询 {schedule.polls} 次)", level='ERROR')
+                    return False, []
+
+                await asyncio.sleep(schedule.next_delay(elapsed))
+                await asyncio.sleep(self.rate_limits.poll.reserve())
+
+                sent_at = time.monotonic()
+                try:
+                    outputs_data = await self._post_json(session, self.outputs_url, outputs_payload)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as poll_e:
+                    metrics.inc('poll_errors', webapp_id)
+                    self.log(f"批次 {batch_id}: 查询结果时网络错误: {poll_e}, 将在稍后重试查询。", level='WARNING')
+                    continue
+                finally:
+                    metrics.observe('poll', webapp_id, time.monotonic() - sent_at)
+
+                if outputs_data.get('code') != 0:
+                    last_poll_at = sent_at
+                else:
+                    duration = time.monotonic() - start_time
+                    metrics.observe('task', webapp_id, duration)
+                    metrics.observe('result_lag', webapp_id, sent_at - last_poll_at)
+                    if isinstance(outputs_data.get('data'), list) and outputs_data['data']:
+                        file_urls = [result.get('fileUrl', 'N/A') for result in outputs_data['data']]
+                        self.polling_policy.record_finished(webapp_id, schedule, duration)
+                        await self._offload(self.on_event, batch_id, payload, STATE_SUCCEEDED, task_id=task_id, file_urls=file_urls)
+                        self.log(f"批次 {batch_id}: 任务成功完成! (耗时 {duration:.0f}s, 查询 {schedule.polls} 次)", level='SUCCESS')
+                        for i, file_url in enumerate(file_urls):
+                            self.log(f"  结果 {i+1}: {file_url}", level='SUCCESS')
+                        return True, file_urls
+                    self.polling_policy.record_finished(webapp_id, schedule)
+                    error_msg = outputs_data.get('msg', '任务完成但未返回任何结果或已失败。')
+                    self.log(f"批次 {batch_id}: {error_msg} (查询 {schedule.polls} 次)", level='ERROR')
+                    return False, []
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.log(f"批次 {batch_id}: 初始网络请求失败: {e}", level='ERROR')
+            return False, []
+        except Exception as e:
+            self.log(f"批次 {batch_id}: 处理时发生未知错误: {e}", level='ERROR')
+            return False, []
+
+    async def _run_with_retries(self, session, payload, batch_id, total, max_retries, retry_interval, success_delay):
+        if self.prepare_payload:
+            payload = await asyncio.to_thread(self.prepare_payload, payload, batch_id)
+            if payload is None:
+                return False, []
+
+        state, resume_task_id, file_urls = await self._offload(self.resume_lookup, payload)
+        if state == STATE_SUCCEEDED:
+            await self._offload(self.on_event, batch_id, payload, STATE_SUCCEEDED, task_id=resume_task_id, file_urls=file_urls)
+            self.log(f"批次 {batch_id}: 已在之前的运行中完成, 跳过。", level='SUCCESS')
+            return True, file_urls
+
+        for attempt in range(max_retries + 1):
+            self.log(f"批次 {batch_id}/{total}: 开始第 {attempt + 1}/{max_retries + 1} 次尝试...", level='INFO')
+            task_id, resume_task_id = resume_task_id, None
+            ok, file_urls = await self.run_task(session, payload, batch_id, task_id=task_id)
+            if ok:
+                if success_delay > 0 and batch_id != total:
+                    await asyncio.sleep(success_delay)
+                return True, file_urls
+            if attempt < max_retries:
+                self.metrics.inc('retries', payload.get('webappId'))
+                self.log(f"批次 {batch_id} 任务失败，将在 {retry_interval} 秒后重试。", level='WARNING')
+                await asyncio.sleep(retry_interval)
+        await self._offload(self.on_event, batch_id, payload, STATE_FAILED)
+        return False, []
+
+    async def run_payloads(self, payloads, total, max_retries=0, retry_interval=60, success_delay=0, on_result=None):
+        """
+        Runs every payload with at most max_in_flight tasks outstanding.
+        A fixed set of worker coroutines pulls from the payload iterator, so memory does
+        not grow with the number of payloads. on_result(batch_id, success, file_urls) is
+        called as each payload finishes. Returns (succeeded, failed).
+        """
+        counts = {'succeeded': 0, 'failed': 0}
+        payload_iter = iter(enumerate(payloads, start=1))
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        # One thread, so the shared payload iterator is never advanced concurrently
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-io")
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def worker():
+                while True:
+                    item = await self._offload(next, payload_iter, None)
+                    if item is None:
+                        break
+                    batch_id, payload = item
+                    ok, file_urls = await self._run_with_retries(session, payload, batch_id, total,
+                                                                 max_retries, retry_interval, success_delay)
+                    counts['succeeded' if ok else 'failed'] += 1
+                    if on_result:
+                        on_result(batch_id, ok, file_urls)
+
+            try:
+                await asyncio.gather(*(worker() for _ in range(min(self.max_in_flight, max(total, 1)))))
+            finally:
+                self._io_executor.shutdown(wait=True)
+                self._io_executor = None
+
+        return counts['succeeded'], counts['failed']
+
+    def run(self, payloads, total, **kwargs):
+        """Blocking entry point for callers outside an event loop (e.g. a Tk worker thread)."""
+        return asyncio.run(self.run_payloads(payloads, total, **kwargs))
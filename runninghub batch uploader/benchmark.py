@@ -0,0 +1,252 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_server
+
+try:
+    import resource
+except ImportError:  # Windows: 峰值内存不可用
+    resource = None
+
+# --- 离线压测：本地模拟服务 + 真实执行代码，按模式/并发/引擎对比吞吐、延迟与请求量 ---
+
+DEFAULT_MODES = 'M1,M4,M5,M7a,M7b'
+DEFAULT_CONCURRENCY = '1,4,16'
+BENCH_WEBAPP_ID = 'benchmark'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def mode_inputs(mode_code, tasks):
+    """(images, prompts, fixed_image) counts that make mode_code produce about `tasks` payloads."""
+    code = mode_code.upper()
+    if code in ('M1', 'M8'):
+        return tasks, (1 if code == 'M1' else 0), False
+    if code == 'M3':
+        return 0, tasks, False
+    if code == 'M4':
+        return tasks, tasks, False
+    if code == 'M5':
+        side = max(2, math.ceil(math.sqrt(tasks)))
+        return side, side, False
+    if code == 'M6':
+        return 1, tasks, False
+    if code == 'M7A':
+        return tasks + 1, 0, False
+    if code == 'M7B':
+        return 2 * tasks + 1, 0, False
+    if code == 'M10':
+        return tasks, 0, True
+    raise ValueError(f"压测不支持的模式: {mode_code} (可选 M1 M3 M4 M5 M6 M7a M7b M8 M10)")
+
+
+def write_workdir(workdir, base_url, mode_code, tasks, asset_kb):
+    """Creates the config, synthetic images and prompt file for one scenario."""
+    n_img, n_prompt, fixed = mode_inputs(mode_code, tasks)
+    config = {
+        'url': base_url + mock_server.CREATE_PATH, 'webappId': BENCH_WEBAPP_ID, 'apiKey': 'benchmark-api-key',
+        'nodeInfoList': [
+            {'nodeId': '1', 'fieldName': 'image', 'fieldValue': '', 'description': 'image'},
+            {'nodeId': '2', 'fieldName': 'text', 'fieldValue': 'benchmark prompt', 'description': 'prompt'},
+        ],
+    }
+    with open(os.path.join(workdir, 'bench_config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    images = [f"img{i:04d}.png" for i in range(n_img)]
+    for name in images + (['fixed.png'] if fixed else []):
+        with open(os.path.join(workdir, name), 'wb') as f:
+            f.write(name.encode() + os.urandom(asset_kb * 1024))
+    prompt_files = []
+    if n_prompt:
+        with open(os.path.join(workdir, 'bench_prompts.json'), 'w', encoding='utf-8') as f:
+            json.dump([f"prompt {i}" for i in range(n_prompt)], f)
+        prompt_files.append('bench_prompts.json')
+    return images, prompt_files, 'fixed.png' if fixed else None
+
+
+def run_scenario(spec):
+    """
+    Child-process entry point: runs one scenario with the real RunnerCore against the mock
+    server in the current directory and returns client-side measurements. Runs in its own
+    process so the peak RSS belongs to this scenario alone.
+    """
+    import runner_core
+
+    runner_core.UPLOAD_URL = spec['base_url'] + mock_server.UPLOAD_PATH
+    runner_core.OUTPUTS_URL = spec['base_url'] + mock_server.OUTPUTS_PATH
+    images, prompt_files, fixed_image = write_workdir(os.getcwd(), spec['base_url'], spec['mode'],
+                                                      spec['tasks'], spec['asset_kb'])
+
+    created, finished, errors = {}, {}, []
+
+    class BenchRunner(runner_core.RunnerCore):
+        def _task_event(self, batch_id, payload, state, task_id=None, file_urls=None):
+            now = time.monotonic()
+            if state == runner_core.STATE_CREATED:
+                created[batch_id] = now
+            elif state == runner_core.STATE_SUCCEEDED:
+                finished[batch_id] = now
+            super()._task_event(batch_id, payload, state, task_id=task_id, file_urls=file_urls)
+
+    def log(message, level='INFO'):
+        if level == 'ERROR':
+            errors.append(message)
+
+    settings = runner_core.RunSettings(
+        max_concurrent_tasks=spec['concurrency'], use_async_engine=spec['engine'] == 'async',
+        pipelined=spec['pipelined'], task_polling_interval=spec['poll_interval'],
+        adaptive_polling=spec['adaptive'], download_results=spec['download'],
+        retry_interval=1, max_retries=2, task_timeout=spec['task_timeout'])
+    core = BenchRunner(settings, log=log)
+    core.load_config('bench_config.json')
+    if fixed_image:
+        core.file_overrides['1'] = fixed_image
+
+    start = time.monotonic()
+    core.generate_payloads(runner_core.find_mode_option(spec['mode']), images, [], prompt_files, auto_recommend=False)
+    succeeded, failed = core.run_api_requests()
+    wall = time.monotonic() - start
+
+    # Every payload is queued at start, so start->finish is the end-to-end latency (waiting for
+    # a slot, uploads, creation, queueing on the server); create->finish is the task alone
+    latencies = sorted(finished[b] - start for b in finished)
+    exec_latencies = sorted(finished[b] - created[b] for b in finished if b in created)
+    peak_rss_mb = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    return {
+        'payloads': core.payload_count, 'succeeded': succeeded, 'failed': failed, 'wall': wall,
+        'tasks_per_min': succeeded / wall * 60 if wall > 0 else 0.0,
+        'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99),
+        'exec_p50': percentile(exec_latencies, 50), 'exec_p95': percentile(exec_latencies, 95),
+        'first_result': min(finished.values()) - start if finished else None,
+        'peak_rss_mb': peak_rss_mb, 'errors': errors[:5],
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="RunningHub 批量执行离线压测: 启动本地模拟服务, 用真实执行代码按模式/并发/引擎跑一遍并汇总吞吐与延迟")
+    parser.add_argument('--modes', default=DEFAULT_MODES, help=f"逗号分隔的模式代码 (默认 {DEFAULT_MODES})")
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help=f"逗号分隔的并发数 (默认 {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--engines', default='threads', help="threads, async 或 threads,async")
+    parser.add_argument('--pipelined', choices=('off', 'on', 'both'), default='off', help="是否测试流水线模式")
+    parser.add_argument('--tasks', type=int, default=40, help="每个场景的大致任务数")
+    parser.add_argument('--asset-kb', type=int, default=64, help="每张合成图片的大小 (KB)")
+    parser.add_argument('--poll-interval', type=int, default=1, help="任务轮询间隔 (s)")
+    parser.add_argument('--no-adaptive', action='store_true', help="关闭自适应轮询")
+    parser.add_argument('--no-download', action='store_true', help="不下载任务结果")
+    parser.add_argument('--task-timeout', type=int, default=120)
+    parser.add_argument('--json', dest='json_path', help="把结果另存为 JSON 文件")
+    server_group = parser.add_argument_group("模拟服务")
+    server_group.add_argument('--duration', default='lognormal:2,0.3', help="任务耗时分布: fixed:S | uniform:MIN,MAX | lognormal:MEDIAN,SIGMA")
+    server_group.add_argument('--error-rate', type=float, default=0.0, help="请求返回 HTTP 500 的概率")
+    server_group.add_argument('--fail-rate', type=float, default=0.0, help="任务无结果 (失败) 的概率")
+    server_group.add_argument('--max-running', type=int, default=0, help="同时运行任务上限, 超出返回队列已满 (0=不限)")
+    server_group.add_argument('--rate-limit', type=float, default=0.0, help="全局请求速率上限 (次/s, 0=不限)")
+    server_group.add_argument('--upload-delay', type=float, default=0.0, help="每次上传的额外延迟 (s)")
+    return parser
+
+
+def _fmt(value, spec='.2f'):
+    return '-' if value is None else format(value, spec)
+
+
+def print_table(results):
+    header = (f"{'场景':<30} {'任务':>5} {'成功':>5} {'耗时s':>7} {'任务/分':>8} {'p50':>6} {'p95':>6} {'p99':>6} {'执行p50':>7} "
+              f"{'首结果s':>7} {'上传/任务':>8} {'创建/任务':>8} {'查询/任务':>8} {'满/限':>7} {'内存MB':>7}")
+    print(header)
+    print('-' * 148)
+    for r in results:
+        per_task = max(r['payloads'], 1)
+        counts = r['server']
+        print(f"{r['name']:<30} {r['payloads']:>5} {r['succeeded']:>5} {r['wall']:>7.1f} {r['tasks_per_min']:>8.1f} "
+              f"{_fmt(r['p50']):>6} {_fmt(r['p95']):>6} {_fmt(r['p99']):>6} {_fmt(r['exec_p50']):>7} "
+              f"{_fmt(r['first_result'], '.1f'):>7} "
+              f"{counts['upload'] / per_task:>8.2f} {counts['create'] / per_task:>8.2f} {counts['outputs'] / per_task:>8.2f} "
+              f"{counts['queue_full']:>3}/{counts['rate_limited']:<3} {_fmt(r['peak_rss_mb'], '.0f'):>7}")
+    print("p50/p95/p99: 单任务从场景开始提交到拿到结果的秒数 (含排队/上传); 执行p50: 创建成功到拿到结果; 满/限: 队列已满次数/HTTP 429 次数; 内存为客户端进程峰值 RSS。")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--scenario']:
+        print(json.dumps(run_scenario(json.loads(argv[1]))), flush=True)
+        return 0
+
+    args = build_parser().parse_args(argv)
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    for mode in modes:
+        mode_inputs(mode, 1)
+    concurrency_levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    pipelined_options = {'off': [False], 'on': [True], 'both': [False, True]}[args.pipelined]
+
+    server, base_url = mock_server.start(duration=args.duration, error_rate=args.error_rate, fail_rate=args.fail_rate,
+                                         max_running=args.max_running, rate_limit=args.rate_limit,
+                                         upload_delay=args.upload_delay)
+    state = server.RequestHandlerClass.state
+    print(f"模拟服务: {base_url}, 任务耗时 {args.duration}, 错误率 {args.error_rate}, 失败率 {args.fail_rate}, "
+          f"运行上限 {args.max_running or '不限'}, 速率上限 {args.rate_limit or '不限'}", flush=True)
+
+    script = os.path.abspath(__file__)
+    results = []
+    try:
+        for mode in modes:
+            for engine in engines:
+                for pipelined in pipelined_options:
+                    for concurrency in concurrency_levels:
+                        name = f"{mode} {engine} c={concurrency}{' 流水线' if pipelined else ''}"
+                        spec = {'base_url': base_url, 'mode': mode, 'engine': engine, 'pipelined': pipelined,
+                                'concurrency': concurrency, 'tasks': args.tasks, 'asset_kb': args.asset_kb,
+                                'poll_interval': args.poll_interval, 'adaptive': not args.no_adaptive,
+                                'download': not args.no_download, 'task_timeout': args.task_timeout}
+                        state.reset()
+                        workdir = tempfile.mkdtemp(prefix='runninghub_bench_')
+                        try:
+                            proc = subprocess.run([sys.executable, script, '--scenario', json.dumps(spec)], cwd=workdir,
+                                                  capture_output=True, text=True)
+                        finally:
+                            shutil.rmtree(workdir, ignore_errors=True)
+                        if proc.returncode != 0:
+                            print(f"{name}: 场景运行失败\n{proc.stderr.strip()[-2000:]}", flush=True)
+                            continue
+                        result = json.loads(proc.stdout.strip().splitlines()[-1])
+                        result.update(name=name, mode=mode, engine=engine, pipelined=pipelined,
+                                      concurrency=concurrency, server=state.snapshot())
+                        results.append(result)
+                        print(f"{name}: {result['succeeded']}/{result['payloads']} 成功, {result['wall']:.1f}s, "
+                              f"{result['tasks_per_min']:.1f} 任务/分", flush=True)
+                        for message in result['errors']:
+                            print(f"  错误: {message}", flush=True)
+    finally:
+        server.shutdown()
+
+    if results:
+        print()
+        print_table(results)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'server': {k: getattr(args, k) for k in ('duration', 'error_rate', 'fail_rate', 'max_running',
+                                                                  'rate_limit', 'upload_delay')},
+                       'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json_path}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- 结果下载：任务成功后立即并行下载 fileUrl，支持断点续传 ---
+
+DOWNLOAD_DIRNAME = 'runninghub_outputs'
+CHUNK_SIZE = 1024 * 1024
+
+
+def safe_stem(name, max_length=60):
+    """Filesystem-safe short form of an asset name (directory and extension dropped)."""
+    stem = os.path.splitext(os.path.basename(str(name)))[0]
+    stem = re.sub(r'[\\/:*?"<>|\s]+', '_', stem).strip('._')
+    return stem[:max_length] or 'result'
+
+
+def result_filename(batch_id, source, index, file_url):
+    """
+    e.g. 0007_img012_1_3fa9c2d1.png: batch ID, source asset stem, 1-based output index, a short
+    digest of the file URL and its extension. The digest ties an existing file (or .part) to
+    the output it came from, so a rerun with changed inputs never skips or resumes into a
+    previous run's file. Query strings (signatures) are left out of the digest.
+    """
+    parsed = urlparse(file_url)
+    ext = os.path.splitext(unquote(parsed.path))[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,5}', ext):
+        ext = ''
+    identity = f"{parsed.netloc}{parsed.path}" if parsed.path.strip('/') else file_url
+    digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:8]
+    return f"{batch_id:04d}_{safe_stem(source)}_{index}_{digest}{ext}"
+
+
+class ResultDownloader:
+    """
+    Streams task outputs to disk on a pooled session from a background thread pool.
+
+    submit() returns immediately, so downloads overlap with tasks still running. Each file
+    is written in chunks to `<name>.part` and renamed when complete; an existing .part is
+    resumed with an HTTP Range request (restarting from scratch if the server ignores it),
+    and an existing final file is skipped. Names carry a digest of the file URL (see
+    result_filename), so only the same output is ever skipped or resumed. Call close() at the end of a run to wait for
+    the remaining downloads and get (downloaded, skipped, failed, bytes). With a
+    metrics.RunMetrics given, each finished file is timed under the 'download' phase.
+    """
+
+    def __init__(self, output_dir, concurrency=4, connect_timeout=60, max_attempts=3, log=None,
+                 metrics=None, webapp_id=None):
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.connect_timeout = connect_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.log = log or (lambda message, level='INFO': None)
+        self.metrics = metrics
+        self.webapp_id = webapp_id
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="download")
+        self._lock = threading.Lock()
+        self.downloaded = self.skipped = self.failed = self.bytes_written = 0
+
+    def submit(self, batch_id, source, file_urls):
+        """Queues every output URL of one finished batch."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        for index, file_url in enumerate(file_urls, start=1):
+            if not file_url or not str(file_url).startswith(('http://', 'https://')):
+                continue
+            path = os.path.join(self.output_dir, result_filename(batch_id, source, index, file_url))
+            self._executor.submit(self._download, batch_id, file_url, path)
+
+    def _count(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def _download(self, batch_id, file_url, path):
+        if os.path.exists(path):
+            self._count('skipped')
+            return
+        part_path = f"{path}.part"
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                self._stream_to(file_url, part_path)
+                os.replace(part_path, path)
+                self._count('downloaded')
+                if self.metrics:
+                    self.metrics.observe('download', self.webapp_id, time.monotonic() - started)
+                    self.metrics.inc('download_bytes', self.webapp_id, os.path.getsize(path))
+                self.log(f"批次 {batch_id}: 结果已下载 -> {os.path.basename(path)}", level='SUCCESS')
+                return
+            except (requests.exceptions.RequestException, OSError) as e:
+                level = 'WARNING' if attempt < self.max_attempts else 'ERROR'
+                self.log(f"批次 {batch_id}: 下载 {os.path.basename(path)} 失败 (第 {attempt}/{self.max_attempts} 次): {e}", level=level)
+        self._count('failed')
+
+    def _stream_to(self, file_url, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self.session.get(file_url, headers=headers, stream=True,
+                              timeout=(self.connect_timeout, self.connect_timeout)) as response:
+            if response.status_code == 416 and offset:
+                return  # .part already holds the whole file
+            response.raise_for_status()
+            mode = 'ab' if offset and response.status_code == 206 else 'wb'
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    self._count('bytes_written', len(chunk))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        return self.downloaded, self.skipped, self.failed, self.bytes_written
+
+    def summary(self):
+        return (f"结果下载: 新下载 {self.downloaded}, 已存在跳过 {self.skipped}, 失败 {self.failed}, "
+                f"共 {self.bytes_written / 1024 / 1024:.1f} MB -> {self.output_dir}")
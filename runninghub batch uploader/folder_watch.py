@@ -0,0 +1,226 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import time
+
+# --- 监视文件夹：增量目录索引 (文件名/大小/修改时间)，Linux 下使用 inotify，其余平台轮询；文件写完后再交给上传 ---
+
+# Names upstream tools use while a file is still being written
+TEMP_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download', '.filepart')
+
+# Directory mtimes this recent are not trusted: a coarse-grained clock may not have ticked since
+DIR_MTIME_GRACE_NS = 2 * 10**9
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_available():
+    """True when inotify can be used; otherwise watching falls back to polling."""
+    return _libc is not None
+
+
+def is_settled_candidate(name):
+    return not name.startswith(('.', '~')) and not name.lower().endswith(TEMP_SUFFIXES)
+
+
+class DirectoryIndex:
+    """
+    Incremental index of the regular files in one directory: name -> (size, mtime_ns).
+
+    refresh() reports names added and removed since the previous call. A directory's own
+    mtime changes whenever an entry is created, removed or renamed, so while it is
+    unchanged the listing is skipped entirely and a rescan costs one stat() however big the
+    folder is; otherwise only the new names are stat()ed. Content rewrites of existing
+    files do not touch the directory mtime; refresh(stat_all=True) re-stats every entry to
+    catch those as well.
+    """
+
+    def __init__(self, directory, accept=None):
+        self.directory = directory
+        self.accept = accept or (lambda name: True)
+        self.entries = {}
+        self._dir_mtime_ns = None
+
+    def stat(self, name):
+        """(size, mtime_ns) of a regular file in the directory, or None."""
+        try:
+            st = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def refresh(self, stat_all=False):
+        """Returns (added, changed, removed) sorted name lists. Raises FileNotFoundError if the directory is gone."""
+        dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        listing_current = (dir_mtime_ns == self._dir_mtime_ns and
+                           time.time_ns() - dir_mtime_ns > DIR_MTIME_GRACE_NS)
+        added, changed, removed = [], [], []
+        if not listing_current:
+            self._dir_mtime_ns = dir_mtime_ns
+            names = {name for name in os.listdir(self.directory) if self.accept(name)}
+            removed = sorted(self.entries.keys() - names)
+            for name in removed:
+                del self.entries[name]
+            for name in sorted(names - self.entries.keys()):
+                info = self.stat(name)
+                if info is not None:
+                    self.entries[name] = info
+                    added.append(name)
+        if stat_all:
+            new_names = set(added)
+            for name, info in list(self.entries.items()):
+                if name in new_names:
+                    continue
+                current = self.stat(name)
+                if current is None:
+                    del self.entries[name]
+                    removed.append(name)
+                elif current != info:
+                    self.entries[name] = current
+                    changed.append(name)
+        return added, changed, removed
+
+
+class FolderWatcher:
+    """
+    Reports files that appear in (or are rewritten in) a directory once they are complete.
+
+    Files present when the watcher starts form the baseline and are not reported. New and
+    changed names come from inotify on Linux (no directory listing at all) or from
+    DirectoryIndex.refresh() every poll_interval elsewhere, with a full re-stat every
+    full_scan_interval seconds to catch in-place rewrites. A candidate is handed out only
+    after its size and mtime have stayed the same for settle_seconds, so files still being
+    written are not uploaded half-done; dot files and temp names (.part, .tmp, ...) are ignored.
+    """
+
+    def __init__(self, directory, accept=None, settle_seconds=2.0, poll_interval=1.0, full_scan_interval=60.0,
+                 use_inotify=True):
+        self.directory = directory
+        self.accept = lambda name: is_settled_candidate(name) and (accept is None or accept(name))
+        self.settle_seconds = float(settle_seconds)
+        self.poll_interval = float(poll_interval)
+        self.full_scan_interval = float(full_scan_interval)
+        self.index = DirectoryIndex(directory, self.accept)
+        self.index.refresh()
+        self._candidates = {}
+        self._next_poll = self._next_full_scan = time.monotonic()
+        self._fd = None
+        if use_inotify and _libc is not None:
+            self._fd = self._open_inotify()
+        self.backend = 'inotify' if self._fd is not None else '轮询'
+
+    def _open_inotify(self):
+        fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if _libc.inotify_add_watch(fd, os.fsencode(self.directory), _WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _read_events(self):
+        """Drains pending inotify events into the candidate set. Returns False on queue overflow."""
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return not overflow
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self.index.entries.pop(name, None)
+                    self._candidates.pop(name, None)
+                elif name and self.accept(name):
+                    self._candidates.setdefault(name, (None, 0.0))
+
+    def wait(self, timeout):
+        """Sleeps up to timeout seconds, waking early when inotify has events."""
+        if self._fd is not None:
+            select.select([self._fd], [], [], max(0.0, timeout))
+        else:
+            time.sleep(max(0.0, timeout))
+
+    def changes(self):
+        """Names that are new or changed and have finished writing since the last call (sorted)."""
+        now = time.monotonic()
+        if self._fd is not None:
+            # inotify reports rewrites too; a full comparison is only needed when events were lost
+            full_scan = not self._read_events()
+        else:
+            full_scan = now >= self._next_full_scan
+            if full_scan:
+                self._next_full_scan = now + self.full_scan_interval
+        if full_scan or (self._fd is None and now >= self._next_poll):
+            self._next_poll = now + self.poll_interval
+            known = dict(self.index.entries)
+            added, changed, removed = self.index.refresh(stat_all=full_scan)
+            for name in removed:
+                self._candidates.pop(name, None)
+            for name in added + changed:
+                # Back to the pre-change state so the settle check below sees the difference
+                if name in known:
+                    self.index.entries[name] = known[name]
+                else:
+                    self.index.entries.pop(name, None)
+                self._candidates.setdefault(name, (None, 0.0))
+
+        ready = []
+        for name, (seen, since) in list(self._candidates.items()):
+            info = self.index.stat(name)
+            if info is None:
+                del self._candidates[name]
+            elif info != seen:
+                self._candidates[name] = (info, now)
+            elif now - since >= self.settle_seconds:
+                del self._candidates[name]
+                if self.index.entries.get(name) != info:
+                    self.index.entries[name] = info
+                    ready.append(name)
+        return sorted(ready)
+
+    @property
+    def pending(self):
+        """Number of files seen but still settling."""
+        return len(self._candidates)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from rate_limit import RateLimits, is_queue_full
+
+# --- 多 API Key 调度：按 Key 的并发上限分配任务，队列已满/额度不足的 Key 暂停或降并发 ---
+
+# Create-response markers meaning the account itself cannot take work (no balance / invalid key).
+QUOTA_MARKERS = ('BALANCE', 'QUOTA', 'INSUFFICIENT', 'COIN', '余额', '额度', 'APIKEY_INVALID', 'APIKEY_UNAUTHORIZED')
+
+REJECT_QUEUE_FULL = 'queue_full'
+REJECT_QUOTA = 'quota'
+
+
+def classify_rejection(create_data):
+    """'queue_full', 'quota' or None for a create response, telling the scheduler how to treat the key."""
+    if is_queue_full(create_data):
+        return REJECT_QUEUE_FULL
+    if create_data.get('code') != 0:
+        msg = str(create_data.get('msg') or '').upper()
+        if any(marker in msg for marker in QUOTA_MARKERS):
+            return REJECT_QUOTA
+    return None
+
+
+def mask_key(api_key):
+    """Log-safe form of an API key: first and last four characters."""
+    return f"{api_key[:4]}…{api_key[-4:]}" if len(api_key) > 8 else "****"
+
+
+def parse_key_specs(entries):
+    """
+    Normalises API key entries from a config's "apiKeys" list or the CLI into dicts with
+    key / concurrency / create_rate (None = use the run settings). Accepted forms:
+    "KEY", "KEY:CONCURRENCY", "KEY:CONCURRENCY:CREATE_RATE" and
+    {"key": ..., "concurrency": ..., "create_rate": ...}. Raises ValueError on bad input.
+    """
+    specs, seen = [], set()
+    for entry in entries or []:
+        if isinstance(entry, dict):
+            key, concurrency, create_rate = entry.get('key') or entry.get('apiKey'), entry.get('concurrency'), entry.get('create_rate')
+        else:
+            parts = str(entry).strip().split(':')
+            if len(parts) > 3:
+                raise ValueError(f"无法解析 API Key 设置: {entry} (格式 KEY[:并发[:创建速率]])")
+            key = parts[0]
+            concurrency = parts[1] if len(parts) > 1 and parts[1] else None
+            create_rate = parts[2] if len(parts) > 2 and parts[2] else None
+        key = str(key or '').strip()
+        if not key:
+            raise ValueError(f"API Key 设置缺少 key: {entry}")
+        if key in seen:
+            continue
+        seen.add(key)
+        specs.append({'key': key,
+                      'concurrency': int(concurrency) if concurrency is not None else None,
+                      'create_rate': float(create_rate) if create_rate is not None else None})
+    return specs
+
+
+class ApiKeySlot:
+    """One account in the pool: its concurrency budget, own rate limiters and counters."""
+
+    def __init__(self, key, concurrency, rate_limits):
+        self.key = key
+        self.label = mask_key(key)
+        self.max_concurrency = max(1, concurrency)
+        self.limit = self.max_concurrency
+        self.rate_limits = rate_limits
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.consecutive_rejections = 0
+        self.succeeded = self.failed = self.rejected = 0
+        # Integral of in_flight over time, for the utilisation figure
+        self.busy_seconds = 0.0
+        self._last_change = time.monotonic()
+
+    def _set_in_flight(self, value, now):
+        self.busy_seconds += self.in_flight * (now - self._last_change)
+        self._last_change = now
+        self.in_flight = value
+
+
+class ApiKeyPool:
+    """
+    Spreads tasks over several RunningHub API keys.
+
+    acquire() blocks until some key is below its concurrency limit and not cooling down,
+    preferring the key with the lowest load; release() hands it back with the outcome.
+    A queue-full rejection halves that key's limit and pauses it for a cooldown that
+    doubles per consecutive rejection, so new work flows to the other keys; successes
+    raise the limit again one step at a time. A quota/balance rejection disables the key
+    for the rest of the run. summary_lines() reports per-key throughput.
+    """
+
+    def __init__(self, specs, default_concurrency=1, create_rate=0.0, upload_rate=0.0, poll_rate=0.0,
+                 base_cooldown=5.0, max_cooldown=60.0):
+        if not specs:
+            raise ValueError("API Key 列表为空")
+        self.slots = [ApiKeySlot(spec['key'], spec['concurrency'] or default_concurrency,
+                                 RateLimits(create_rate if spec['create_rate'] is None else spec['create_rate'],
+                                            upload_rate, poll_rate))
+                      for spec in specs]
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.started = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def capacity(self):
+        """Total tasks the pool can run at once when no key is throttled."""
+        return sum(slot.max_concurrency for slot in self.slots)
+
+    def describe(self):
+        return ", ".join(f"{slot.label} (并发 {slot.max_concurrency}, 创建 {slot.rate_limits.create.describe()})"
+                         for slot in self.slots)
+
+    def _pick(self, now):
+        usable = [slot for slot in self.slots
+                  if not slot.disabled and slot.cooldown_until <= now and slot.in_flight < slot.limit]
+        if not usable:
+            return None
+        slot = min(usable, key=lambda s: (s.in_flight / s.limit, s.in_flight))
+        slot._set_in_flight(slot.in_flight + 1, now)
+        return slot
+
+    def acquire(self):
+        """Blocks until a key is free. Returns None once every key has been disabled."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                slot = self._pick(now)
+                if slot is not None:
+                    return slot
+                active = [s for s in self.slots if not s.disabled]
+                if not active:
+                    return None
+                cooling = [s.cooldown_until - now for s in active if s.cooldown_until > now]
+                self._cond.wait(timeout=min(cooling) if cooling else None)
+
+    def release(self, slot, outcome=None):
+        """
+        Returns a key to the pool. outcome: True/False for a finished task, REJECT_QUEUE_FULL
+        or REJECT_QUOTA for a create rejection (the task itself is then retried elsewhere),
+        None when nothing was submitted. Returns the cooldown applied, in seconds.
+        """
+        cooldown = 0.0
+        with self._cond:
+            now = time.monotonic()
+            slot._set_in_flight(slot.in_flight - 1, now)
+            if outcome is True:
+                slot.succeeded += 1
+                slot.consecutive_rejections = 0
+                if slot.limit < slot.max_concurrency:
+                    slot.limit += 1
+            elif outcome is False:
+                slot.failed += 1
+            elif outcome == REJECT_QUEUE_FULL:
+                slot.rejected += 1
+                if now >= slot.cooldown_until:
+                    slot.consecutive_rejections += 1
+                    slot.limit = max(1, slot.limit // 2)
+                    cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (slot.consecutive_rejections - 1))
+                    slot.cooldown_until = now + cooldown
+                else:
+                    cooldown = slot.cooldown_until - now
+            elif outcome == REJECT_QUOTA:
+                slot.rejected += 1
+                slot.disabled = True
+            self._cond.notify_all()
+        return cooldown
+
+    def summary_lines(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        lines = []
+        for slot in self.slots:
+            state = "已停用" if slot.disabled else f"当前并发上限 {slot.limit}/{slot.max_concurrency}"
+            lines.append(f"  {slot.label}: 成功 {slot.succeeded}, 失败 {slot.failed}, 被拒 {slot.rejected}, "
+                         f"{slot.succeeded / elapsed * 60:.1f} 任务/分, 占用率 {slot.busy_seconds / elapsed / slot.max_concurrency:.0%}, {state}")
+        return lines
@@ -0,0 +1,228 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# --- 运行指标：各阶段耗时直方图 (按 webappId)、计数器，定时导出 JSON / Prometheus 文本文件 ---
+
+METRICS_JSON_FILENAME = 'runninghub_metrics.json'
+METRICS_PROM_FILENAME = 'runninghub_metrics.prom'
+
+# Histogram upper bounds in seconds; the last bucket is +Inf
+BUCKET_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Phase -> description used in the summary table
+PHASES = {
+    'upload': '上传请求',
+    'create': '创建请求',
+    'poll': '查询请求',
+    'task': '平台排队+执行',
+    'result_lag': '结果发现延迟',
+    'download': '结果下载',
+}
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus style). Not thread-safe on its own."""
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimated q-quantile, interpolated linearly inside the bucket like histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.total, 6), 'max': round(self.max, 6),
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in BUCKET_BOUNDS] + ['+Inf'], self.buckets))}
+
+
+class RunMetrics:
+    """
+    Thread-safe registry of phase histograms and event counters, both keyed by webappId.
+
+    observe(phase, webapp_id, seconds) records one timing and inc(event, webapp_id, n)
+    bumps a counter; each is one dict lookup and a few additions under a lock, cheap
+    enough to leave on for every request. snapshot() returns a JSON-ready dict,
+    to_prometheus() the node_exporter textfile format and summary_lines() a table for
+    the end of a run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, phase, webapp_id, seconds):
+        key = (phase, str(webapp_id))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(max(0.0, seconds))
+
+    def inc(self, event, webapp_id, amount=1):
+        key = (event, str(webapp_id))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            phases, counters = {}, {}
+            for (phase, webapp_id), histogram in self.histograms.items():
+                phases.setdefault(webapp_id, {})[phase] = histogram.to_dict()
+            for (event, webapp_id), value in self.counters.items():
+                counters.setdefault(webapp_id, {})[event] = value
+            return {'started': self.started, 'updated': time.time(), 'phases': phases, 'counters': counters}
+
+    def to_prometheus(self):
+        lines = ["# HELP runninghub_phase_seconds Duration of each request/task phase.",
+                 "# TYPE runninghub_phase_seconds histogram"]
+        with self._lock:
+            for (phase, webapp_id), h in sorted(self.histograms.items()):
+                labels = f'phase="{phase}",webapp_id="{webapp_id}"'
+                cumulative = 0
+                for bound, n in zip([str(b) for b in BUCKET_BOUNDS] + ['+Inf'], h.buckets):
+                    cumulative += n
+                    lines.append(f'runninghub_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'runninghub_phase_seconds_sum{{{labels}}} {h.total:.6f}')
+                lines.append(f'runninghub_phase_seconds_count{{{labels}}} {h.count}')
+            lines += ["# HELP runninghub_events_total Counted events (tasks, retries, queue-full responses, bytes).",
+                      "# TYPE runninghub_events_total counter"]
+            for (event, webapp_id), value in sorted(self.counters.items()):
+                lines.append(f'runninghub_events_total{{event="{event}",webapp_id="{webapp_id}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """Per-webappId table of phase counts and latencies plus the counters."""
+        snapshot = self.snapshot()
+        lines = []
+        for webapp_id in sorted(set(snapshot['phases']) | set(snapshot['counters'])):
+            lines.append(f"webappId {webapp_id}:")
+            lines.append(f"  {'阶段':<14}{'次数':>7}{'平均s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'最大s':>9}{'累计s':>10}")
+            for phase, label in PHASES.items():
+                h = snapshot['phases'].get(webapp_id, {}).get(phase)
+                if not h:
+                    continue
+                mean = h['sum'] / h['count']
+                lines.append(f"  {label:<14}{h['count']:>7}{mean:>9.2f}{h['p50']:>9.2f}{h['p95']:>9.2f}"
+                             f"{h['p99']:>9.2f}{h['max']:>9.2f}{h['sum']:>10.1f}")
+            counters = snapshot['counters'].get(webapp_id)
+            if counters:
+                lines.append("  计数: " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+        return lines
+
+
+class MetricsGroup:
+    """
+    Read-only combined view of several RunMetrics (one per config of a multi-config
+    batch). Offers the same snapshot() / to_prometheus() / summary_lines() as RunMetrics,
+    so one MetricsExporter covers the whole batch; series with the same webappId are merged.
+    """
+
+    def __init__(self, members):
+        self.members = list(members)
+
+    def merged(self):
+        combined = RunMetrics()
+        for metrics in self.members:
+            with metrics._lock:
+                for key, histogram in metrics.histograms.items():
+                    combined.histograms.setdefault(key, Histogram()).merge(histogram)
+                for key, value in metrics.counters.items():
+                    combined.counters[key] = combined.counters.get(key, 0) + value
+                combined.started = min(combined.started, metrics.started)
+        return combined
+
+    def snapshot(self):
+        return self.merged().snapshot()
+
+    def to_prometheus(self):
+        return self.merged().to_prometheus()
+
+    def summary_lines(self):
+        return self.merged().summary_lines()
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    Writes RunMetrics to <directory>/runninghub_metrics.json and .prom every `interval`
+    seconds from a daemon thread (atomic replace, so readers never see a partial file),
+    and once more on stop(). Point node_exporter's textfile collector at the .prom file.
+    """
+
+    def __init__(self, metrics, directory, interval=15, log=None):
+        self.metrics = metrics
+        self.json_path = os.path.join(directory, METRICS_JSON_FILENAME)
+        self.prom_path = os.path.join(directory, METRICS_PROM_FILENAME)
+        self.interval = max(1.0, float(interval))
+        self.log = log or (lambda message, level='INFO': None)
+        self._stop = threading.Event()
+        self._thread = None
+        self._warned = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="metrics-export", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            _write_atomic(self.json_path, json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=1))
+            _write_atomic(self.prom_path, self.metrics.to_prometheus())
+        except OSError as e:
+            if not self._warned:
+                self._warned = True
+                self.log(f"运行指标导出失败: {e}", level='WARNING')
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.write()
@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# --- 本地模拟 RunningHub 服务：离线测试/压测上传、创建任务、查询结果与下载，不消耗额度 ---
+
+UPLOAD_PATH = '/task/openapi/upload'
+OUTPUTS_PATH = '/task/openapi/outputs'
+CREATE_PATH = '/task/openapi/ai-app/run'
+STATS_PATH = '/_mock/stats'
+RESET_PATH = '/_mock/reset'
+
+# Codes RunningHub uses for "still running" and "queue full"
+CODE_RUNNING = 804
+CODE_QUEUE_FULL = 421
+
+
+def parse_distribution(spec):
+    """
+    Task duration distribution: 'fixed:S', 'uniform:MIN,MAX' or 'lognormal:MEDIAN,SIGMA'
+    (seconds). Returns a zero-argument sampler.
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2:
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median
+    raise ValueError(f"无法解析任务耗时分布: {spec} (示例: fixed:2, uniform:1,5, lognormal:8,0.5)")
+
+
+class MockState:
+    """Tasks, counters and failure knobs shared by all handler threads."""
+
+    def __init__(self, duration='lognormal:2,0.3', error_rate=0.0, fail_rate=0.0, max_running=0,
+                 rate_limit=0.0, upload_delay=0.0, output_bytes=64 * 1024, max_running_per_key=0, exhausted_keys=()):
+        self.sample_duration = parse_distribution(duration)
+        self.error_rate = error_rate
+        self.fail_rate = fail_rate
+        self.max_running = max_running
+        self.rate_limit = rate_limit
+        self.upload_delay = upload_delay
+        self.output_bytes = output_bytes
+        self.max_running_per_key = max_running_per_key
+        self.exhausted_keys = set(exhausted_keys)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.tasks = {}
+            self.next_task_id = 1
+            self.counts = {'upload': 0, 'create': 0, 'outputs': 0, 'download': 0,
+                           'queue_full': 0, 'rate_limited': 0, 'errors': 0}
+            self.tasks_per_key = {}
+            self._tokens = max(1.0, self.rate_limit)
+            self._last = time.monotonic()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def allow_request(self):
+        """Global token bucket; False means the request should get HTTP 429."""
+        if self.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self._tokens = min(max(1.0, self.rate_limit), self._tokens + (now - self._last) * self.rate_limit)
+            self._last = now
+            if self._tokens < 1:
+                self.counts['rate_limited'] += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def create_task(self, api_key=None):
+        with self.lock:
+            now = time.monotonic()
+            running = [t for t in self.tasks.values() if t['done_at'] > now]
+            if ((self.max_running and len(running) >= self.max_running) or
+                    (self.max_running_per_key and sum(1 for t in running if t['key'] == api_key) >= self.max_running_per_key)):
+                self.counts['queue_full'] += 1
+                return None
+            task_id = str(self.next_task_id)
+            self.next_task_id += 1
+            self.tasks[task_id] = {'done_at': now + max(0.0, self.sample_duration()),
+                                   'failed': random.random() < self.fail_rate, 'key': api_key}
+            self.tasks_per_key[api_key] = self.tasks_per_key.get(api_key, 0) + 1
+            return task_id
+
+    def task(self, task_id):
+        with self.lock:
+            return self.tasks.get(str(task_id))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts, tasks=len(self.tasks), tasks_per_key=dict(self.tasks_per_key))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None  # set on the server-specific subclass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self, keep_limit=64 * 1024):
+        """Reads the request body in chunks; returns the first keep_limit bytes and the total size."""
+        remaining = int(self.headers.get('Content-Length', 0))
+        head, total = b'', 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(1024 * 1024, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            total += len(chunk)
+            if len(head) < keep_limit:
+                head += chunk[:keep_limit - len(head)]
+        return head, total
+
+    def do_POST(self):
+        state = self.state
+        path = urlparse(self.path).path
+        head, total = self._read_body()
+        if path == STATS_PATH:
+            return self._send_json(state.snapshot())
+        if path == RESET_PATH:
+            state.reset()
+            return self._send_json({'code': 0})
+        if not state.allow_request():
+            return self._send_json({'code': 429, 'msg': 'TOO_MANY_REQUESTS'}, status=429)
+        if random.random() < state.error_rate:
+            state.count('errors')
+            return self._send_json({'code': 500, 'msg': 'MOCK_SERVER_ERROR'}, status=500)
+
+        if path == UPLOAD_PATH:
+            state.count('upload')
+            if state.upload_delay:
+                time.sleep(state.upload_delay)
+            match = re.search(rb'filename="([^"]*)"', head)
+            name = match.group(1) if match else b'file'
+            ext = re.search(rb'(\.[A-Za-z0-9]{1,5})$', name)
+            file_name = f"api/{hashlib.md5(name + str(total).encode()).hexdigest()}{(ext.group(1).decode() if ext else '')}"
+            return self._send_json({'code': 0, 'msg': 'success', 'data': {'fileName': file_name, 'fileType': 'input'}})
+
+        if path == OUTPUTS_PATH:
+            state.count('outputs')
+            try:
+                task_id = json.loads(head or b'{}').get('taskId')
+            except ValueError:
+                task_id = None
+            task = state.task(task_id)
+            if task is None:
+                return self._send_json({'code': 807, 'msg': 'APIKEY_TASK_NOT_FOUND'})
+            if time.monotonic() < task['done_at']:
+                return self._send_json({'code': CODE_RUNNING, 'msg': 'APIKEY_TASK_IS_RUNNING'})
+            if task['failed']:
+                return self._send_json({'code': 0, 'msg': 'success', 'data': []})
+            host = self.headers.get('Host', f'127.0.0.1:{self.server.server_port}')
+            return self._send_json({'code': 0, 'msg': 'success', 'data': [
+                {'fileUrl': f"http://{host}/files/{task_id}.png", 'fileType': 'png'}]})
+
+        # Any other POST is treated as the workflow's create endpoint (its URL comes from the config)
+        state.count('create')
+        try:
+            api_key = json.loads(head or b'{}').get('apiKey')
+        except ValueError:
+            api_key = None
+        if api_key in state.exhausted_keys:
+            return self._send_json({'code': 1001, 'msg': 'APIKEY_INSUFFICIENT_BALANCE'})
+        task_id = state.create_task(api_key)
+        if task_id is None:
+            return self._send_json({'code': CODE_QUEUE_FULL, 'msg': 'TASK_QUEUE_MAXED'})
+        return self._send_json({'code': 0, 'msg': 'success', 'data': {'taskId': task_id, 'taskStatus': 'RUNNING'}})
+
+    def do_GET(self):
+        state = self.state
+        path = urlparse(self.path).path
+        if path == STATS_PATH:
+            return self._send_json(state.snapshot())
+        if not path.startswith('/files/'):
+            return self._send_json({'code': 404, 'msg': 'NOT_FOUND'}, status=404)
+        state.count('download')
+        data = (path.encode() * (state.output_bytes // max(len(path), 1) + 1))[:state.output_bytes]
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            start = min(int(range_header[6:].split('-')[0] or 0), len(data))
+        body = data[start:]
+        self.send_response(206 if range_header else 200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start(host='127.0.0.1', port=0, **options):
+    """Starts the mock server on a daemon thread; returns (server, base_url). port=0 picks a free port."""
+    handler = type('BoundMockHandler', (MockHandler,), {'state': MockState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-runninghub", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="本地模拟 RunningHub OpenAPI (上传/创建/查询/下载)，用于离线测试与压测")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--duration', default='lognormal:2,0.3', help="任务耗时分布: fixed:S | uniform:MIN,MAX | lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="任意请求返回 HTTP 500 的概率")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="任务完成但无结果 (失败) 的概率")
+    parser.add_argument('--max-running', type=int, default=0, help="同时运行的任务上限, 超出返回队列已满 (0=不限)")
+    parser.add_argument('--max-running-per-key', type=int, default=0, help="每个 apiKey 同时运行的任务上限 (0=不限)")
+    parser.add_argument('--exhausted-keys', default='', help="逗号分隔的 apiKey, 创建任务时返回余额不足")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="全局请求速率上限 (次/s), 超出返回 HTTP 429 (0=不限)")
+    parser.add_argument('--upload-delay', type=float, default=0.0, help="每次上传的额外延迟 (s)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server, base_url = start(args.host, args.port, duration=args.duration, error_rate=args.error_rate,
+                             fail_rate=args.fail_rate, max_running=args.max_running,
+                             rate_limit=args.rate_limit, upload_delay=args.upload_delay,
+                             max_running_per_key=args.max_running_per_key,
+                             exhausted_keys=[k for k in args.exhausted_keys.split(',') if k])
+    print(f"模拟服务已启动: {base_url}  (创建任务 URL: {base_url}{CREATE_PATH}, 统计: {base_url}{STATS_PATH})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import copy
+import itertools
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from metrics import MetricsExporter, MetricsGroup
+from rate_limit import RateLimits
+from result_cache import ResultCache
+from runner_core import RunnerCore, log_error_report, log_to_file
+from upload_cache import UploadCache
+
+# --- 多配置批量运行：一次扫描/上传供多个 webapp 配置生成负载，任务共用一个执行池并在配置间公平调度 ---
+
+
+class SharedUploads:
+    """
+    Upload memo shared by the cores of a multi-config batch. The first core asking for a
+    (key, file, preprocessing) combination performs the upload; concurrent and later callers
+    wait for and reuse its result. Failed uploads are forgotten so the next caller retries.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.requested = 0
+        self.uploaded = 0
+
+    def get_or_upload(self, key, upload):
+        with self._lock:
+            self.requested += 1
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = upload()
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if result:
+                self.uploaded += 1
+            else:
+                self._futures.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def summary(self):
+        return f"多配置共享上传: 共请求 {self.requested} 次, 实际上传 {self.uploaded} 个文件 (其余复用)"
+
+
+def config_label(path, taken):
+    """Short, filesystem-safe name for a config file, unique within `taken`."""
+    stem = re.sub(r'[\\/:*?"<>|\s]+', '_', os.path.splitext(os.path.basename(path))[0]) or 'config'
+    label = stem
+    for n in itertools.count(2):
+        if label not in taken:
+            return label
+        label = f"{stem}_{n}"
+
+
+class ConfigRun:
+    """One config of a batch: its RunnerCore plus the scheduler's per-config counters."""
+
+    def __init__(self, label, path, core):
+        self.label = label
+        self.path = path
+        self.core = core
+        self.run = None
+        self.payloads = None
+        self.in_flight = 0
+        self.dispatched = 0
+        self.succeeded = 0
+        self.failed = 0
+
+
+class MultiConfigBatch:
+    """
+    Runs several webapp configs from one session over the same working directory.
+
+    Each config gets its own RunnerCore (own settings copy, journal, downloader subfolder
+    <download_dir>/<config name>, polling policy and metrics), but the directory is scanned
+    once, the upload/result caches and rate limiters are shared, images are preprocessed once
+    for all configs and each file is uploaded once per account (SharedUploads). run() executes every config's payloads on one
+    thread pool: whenever a worker frees up, the next payload comes from the config with the
+    fewest tasks in flight (ties: fewest dispatched), so configs share the pool evenly and a
+    large batch cannot starve a small one. Results are reported per config.
+    """
+
+    def __init__(self, config_paths, settings, log=None, warn=None):
+        self.settings = settings
+        self.log = log or log_to_file
+        self.warn = warn
+        self.shared_uploads = SharedUploads()
+        self.upload_cache = UploadCache()
+        self.result_cache = ResultCache()
+        self.shared_preprocessed = {}
+        self.configs = []
+        self._config_paths = list(config_paths)
+
+    def _prefixed_log(self, label):
+        return lambda message, level='INFO': self.log(f"[{label}] {message}", level=level)
+
+    def load(self):
+        """Loads every config into its own core. Raises OSError/ValueError naming the bad file."""
+        self.configs = []
+        taken = set()
+        for path in self._config_paths:
+            label = config_label(path, taken)
+            taken.add(label)
+            settings = copy.copy(self.settings)
+            settings.download_dir = os.path.join(self.settings.download_dir, label)
+            # One exporter covers the whole batch (see run); per-config exports would overwrite each other
+            settings.metrics_interval = 0
+            warn = None
+            if self.warn:
+                warn = lambda title, message, label=label: self.warn(f"[{label}] {title}", message)
+            core = RunnerCore(settings=settings, log=self._prefixed_log(label), warn=warn)
+            try:
+                core.load_config(path)
+            except (OSError, ValueError) as e:
+                raise type(e)(f"{os.path.basename(path)}: {e}") from e
+            core.upload_cache = self.upload_cache
+            core.result_cache = self.result_cache
+            core.shared_uploads = self.shared_uploads
+            core.shared_preprocessed = self.shared_preprocessed
+            core.batch_cache_stats = True
+            self.configs.append(ConfigRun(label, path, core))
+        # Same account settings, so the configs draw from one set of request budgets
+        s = self.settings
+        rate_limits = RateLimits(s.create_rate, s.upload_rate, s.poll_rate)
+        for config in self.configs:
+            config.core.rate_limits = rate_limits
+        self.log(f"已加载 {len(self.configs)} 个配置: " +
+                 ", ".join(f"{c.label} (webappId {c.core.API_DATA.get('webappId')})" for c in self.configs), level='SUCCESS')
+        return self.configs
+
+    def scan_directory(self, directory):
+        """Scans the working directory once and hands the result to every config."""
+        assets = self.configs[0].core.scan_directory(directory)
+        for config in self.configs[1:]:
+            config.core.current_directory = directory
+            config.core.scanned_assets = assets
+        return assets
+
+    def generate_payloads(self, current_mode, selected_images_local, selected_videos_local, selected_jsons,
+                          auto_recommend=True):
+        """Plans every config's payloads from the same selection; returns {label: final_mode}."""
+        modes = {}
+        # The first core to need a file starts its preprocessing; a new batch may see edited files
+        self.shared_preprocessed.clear()
+        for config in self.configs:
+            _, modes[config.label] = config.core.generate_payloads(current_mode, selected_images_local, selected_videos_local,
+                                                                   selected_jsons, auto_recommend=auto_recommend)
+        if not self.settings.pipelined:  # pipelined uploads are still running; run() reports them at the end
+            self.log(self.shared_uploads.summary(), level='INFO')
+        return modes
+
+    def _next_payload(self, active):
+        """(config, batch_id, payload) from the least-served config that still has payloads, or None."""
+        while active:
+            config = min(active, key=lambda c: (c.in_flight, c.dispatched))
+            item = next(config.payloads, None)
+            if item is None:
+                active.remove(config)
+                continue
+            config.in_flight += 1
+            config.dispatched += 1
+            return (config,) + item
+
+    def run(self, resume=False):
+        """Executes all configs' payloads on one shared pool. Returns (succeeded, failed) over all configs."""
+        if self.settings.use_async_engine:
+            self.log("多配置批量运行使用共享线程池执行, 已忽略 asyncio 引擎设置。", level='WARNING')
+        # Hits of all configs add up to one batch total (see _log_summary)
+        self.result_cache.reset_stats()
+        active = []
+        for config in self.configs:
+            config.in_flight = config.dispatched = config.succeeded = config.failed = 0
+            if not config.core.payload_count:
+                continue
+            config.run = config.core.begin_run(resume)
+            if config.run is None:
+                config.failed = config.core.payload_count
+                continue
+            config.payloads = enumerate(config.core.iter_request_payloads(), start=1)
+            active.append(config)
+        started = list(active)
+
+        exporter = None
+        interval = float(self.settings.metrics_interval)
+        if interval > 0 and started:
+            exporter = MetricsExporter(MetricsGroup(c.core.metrics for c in started), started[0].core.current_directory,
+                                       interval=interval, log=self.log)
+            exporter.start()
+            self.log(f"运行指标 (全部配置合并) 每 {interval:.0f}s 导出到 {exporter.json_path} / {exporter.prom_path}", level='INFO')
+
+        total = sum(c.core.payload_count for c in started)
+        workers = max([max(1, int(self.settings.max_concurrent_tasks))] + [c.run['max_concurrent'] for c in started])
+        self.log(f"--- 多配置批量运行: {len(started)} 个配置, 共 {total} 个请求, 共享 {workers} 个执行线程 ---", level='INFO')
+        done_count = 0
+        try:
+            # One payload per worker: the config choice is made when a worker frees up, not ahead of time
+            pending = {}
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, total)), thread_name_prefix="multi-task") as executor:
+                while True:
+                    while len(pending) < workers:
+                        item = self._next_payload(active)
+                        if item is None:
+                            break
+                        config, batch_id, payload = item
+                        pending[executor.submit(config.core.run_payload, payload, batch_id, config.run)] = config
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        config = pending.pop(future)
+                        config.in_flight -= 1
+                        done_count += 1
+                        try:
+                            batch_id, ok = future.result()
+                        except Exception as e:
+                            config.failed += 1
+                            log_error_report(f"未知错误在 _run_payload_with_retries: {e}", config.core.API_DATA)
+                            config.core.log(f"工作线程发生未知错误: {e}", level='ERROR')
+                            continue
+                        if ok:
+                            config.succeeded += 1
+                        else:
+                            config.failed += 1
+                        config.core.log(f"批次 {batch_id} {'成功' if ok else '失败'} "
+                                        f"(本配置 {config.succeeded + config.failed}/{config.core.payload_count}, "
+                                        f"全部 {done_count}/{total})", level='SUCCESS' if ok else 'ERROR')
+        finally:
+            for config in started:
+                config.core.end_run(config.run, config.succeeded, config.failed)
+            if exporter:
+                exporter.stop()
+            self._log_summary()
+        return sum(c.succeeded for c in self.configs), sum(c.failed for c in self.configs)
+
+    def _log_summary(self):
+        lines = [f"  {'配置':<24}{'webappId':<22}{'请求':>6}{'成功':>6}{'失败':>6}  结果目录"]
+        for config in self.configs:
+            core = config.core
+            output_dir = os.path.join(core.current_directory, core.settings.download_dir) if core.settings.download_results else '-'
+            lines.append(f"  {config.label:<24}{str(core.API_DATA.get('webappId')):<22}{core.payload_count:>6}"
+                         f"{config.succeeded:>6}{config.failed:>6}  {output_dir}")
+        lines.append("  " + self.shared_uploads.summary())
+        if self.result_cache.hits:
+            lines.append("  " + self.result_cache.stats_summary())
+        self.log("--- 多配置批量运行结果 ---\n" + "\n".join(lines), level='INFO')
@@ -0,0 +1,91 @@
+import os
+import time
+
+import requests
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+# --- 流式 multipart 上传：分块读取文件，内存占用与文件大小无关 ---
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Slowest sustained upload speed still treated as healthy; the upload timeout scales from it.
+UPLOAD_MIN_BYTES_PER_SEC = 256 * 1024
+
+
+class UploadTimeout(requests.exceptions.Timeout):
+    """Raised from inside the body generator when an upload exceeds its size-scaled budget."""
+
+
+def upload_time_budget(file_size, connect_timeout):
+    """Seconds an upload of file_size bytes may take: the connect timeout plus size at the minimum speed."""
+    return connect_timeout + file_size / UPLOAD_MIN_BYTES_PER_SEC
+
+
+class StreamingMultipartBody:
+    """
+    multipart/form-data body for one file plus plain form fields, produced in chunks.
+
+    Headers are rendered with urllib3's RequestField exactly as requests does for
+    `files={'file': (name, fp)}`, but the file is read UPLOAD_CHUNK_SIZE bytes at a time
+    instead of being loaded whole. __len__ lets requests send a Content-Length rather than
+    chunked transfer encoding. The file is opened only while the body is being iterated and
+    closed as soon as iteration ends, fails or close() is called.
+
+    progress(bytes_sent, total) is called after every chunk; once `deadline`
+    (time.monotonic() value) passes, iteration raises UploadTimeout.
+    """
+
+    def __init__(self, fields, file_field, filename, filepath, progress=None, deadline=None,
+                 chunk_size=UPLOAD_CHUNK_SIZE):
+        self.filepath = filepath
+        self.file_size = os.path.getsize(filepath)
+        self.progress = progress
+        self.deadline = deadline
+        self.chunk_size = chunk_size
+        self.bytes_sent = 0
+        self._iterator = None
+
+        boundary = choose_boundary()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        delimiter = f"--{boundary}\r\n".encode('latin-1')
+
+        parts = []
+        for name, value in fields.items():
+            field = RequestField.from_tuples(name, str(value))
+            parts.append(delimiter + field.render_headers().encode('utf-8') + str(value).encode('utf-8') + b"\r\n")
+        file_part = RequestField(name=file_field, data=b'', filename=filename)
+        file_part.make_multipart()
+        parts.append(delimiter + file_part.render_headers().encode('utf-8'))
+
+        self._preamble = b''.join(parts)
+        self._epilogue = f"\r\n--{boundary}--\r\n".encode('latin-1')
+
+    def __len__(self):
+        return len(self._preamble) + self.file_size + len(self._epilogue)
+
+    def __iter__(self):
+        self.close()
+        self.bytes_sent = 0
+        self._iterator = self._generate()
+        return self._iterator
+
+    def _generate(self):
+        yield self._preamble
+        with open(self.filepath, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                if self.deadline is not None and time.monotonic() > self.deadline:
+                    raise UploadTimeout(f"上传超时 (已发送 {self.bytes_sent}/{self.file_size} 字节)")
+                self.bytes_sent += len(chunk)
+                if self.progress:
+                    self.progress(self.bytes_sent, self.file_size)
+                yield chunk
+        yield self._epilogue
+
+    def close(self):
+        """Closes the file handle if an iteration is still open (e.g. after a network error)."""
+        if self._iterator is not None:
+            self._iterator.close()
+            self._iterator = None
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+import statistics
+import threading
+
+# --- 自适应轮询：按 webappId 历史耗时推迟首次查询，之后指数退避 + 抖动 ---
+
+DURATION_HISTORY_FILENAME = 'task_durations.json'
+
+# Serialises read-merge-write of the history file between policies in one process
+# (each config of a multi-config batch has its own policy)
+_history_file_lock = threading.Lock()
+
+
+class PollSchedule:
+    """Per-task sequence of poll delays. Call next_delay() once before every poll."""
+
+    def __init__(self, first_delay, base_interval, max_interval, backoff, jitter, task_timeout):
+        self.first_delay = first_delay
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.task_timeout = task_timeout
+        self.polls = 0
+
+    def next_delay(self, elapsed):
+        """Returns seconds to wait before the next poll, never sleeping past the task timeout."""
+        if self.polls == 0:
+            delay = self.first_delay
+        else:
+            delay = min(self.base_interval * self.backoff ** (self.polls - 1), self.max_interval)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.polls += 1
+        return max(0.0, min(delay, self.task_timeout - elapsed))
+
+
+class AdaptivePollingPolicy:
+    """
+    Builds PollSchedules for tasks and learns typical task durations per webappId.
+
+    With adaptive=True the first poll waits first_poll_fraction of the median observed
+    duration for the webapp (or base_interval when nothing is known yet), then delays
+    grow by `backoff` per poll up to max_interval with +/- `jitter` randomisation.
+    With adaptive=False every delay is base_interval, matching the original fixed loop.
+    Observed durations are kept in a small JSON file so the next session starts warm;
+    save() merges this policy's new samples into whatever the file holds by then, so
+    policies saving one after another do not drop each other's samples.
+    """
+
+    def __init__(self, base_interval=5, adaptive=True, max_interval=60, backoff=1.5, jitter=0.2,
+                 first_poll_fraction=0.8, history_path=DURATION_HISTORY_FILENAME, history_size=50):
+        self.base_interval = max(0.0, base_interval)
+        self.adaptive = adaptive
+        self.max_interval = max(max_interval, self.base_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.first_poll_fraction = first_poll_fraction
+        self.history_path = history_path
+        self.history_size = history_size
+        self.durations = {}
+        self._new_samples = {}
+        self.total_polls = 0
+        self.tasks_finished = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _read_history(self):
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                return {str(k): list(v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError, TypeError):
+            return {}
+
+    def _load(self):
+        if self.history_path:
+            self.durations = self._read_history()
+
+    def save(self):
+        """Appends the samples recorded since the last save to the history file's current content."""
+        if not self.history_path:
+            return
+        with _history_file_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                new_samples, self._new_samples = self._new_samples, {}
+                self._dirty = False
+            merged = self._read_history()
+            for webapp_id, samples in new_samples.items():
+                merged[webapp_id] = (merged.get(webapp_id, []) + samples)[-self.history_size:]
+            tmp_path = f"{self.history_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(merged))
+            os.replace(tmp_path, self.history_path)
+        with self._lock:
+            # Later schedules also benefit from what other policies learned
+            for webapp_id, samples in merged.items():
+                recent = self._new_samples.get(webapp_id, [])
+                self.durations[webapp_id] = (samples + recent)[-self.history_size:]
+
+    def median_duration(self, webapp_id):
+        with self._lock:
+            samples = self.durations.get(str(webapp_id))
+            return statistics.median(samples) if samples else None
+
+    def schedule(self, webapp_id, task_timeout):
+        if not self.adaptive:
+            return PollSchedule(self.base_interval, self.base_interval, self.base_interval, 1.0, 0.0, task_timeout)
+
+        median = self.median_duration(webapp_id)
+        first_delay = max(self.base_interval, median * self.first_poll_fraction) if median else self.base_interval
+        return PollSchedule(min(first_delay, task_timeout), self.base_interval, self.max_interval,
+                            self.backoff, self.jitter, task_timeout)
+
+    def record_finished(self, webapp_id, schedule, duration=None):
+        """Records the poll count of a finished task and, for successes, its duration."""
+        with self._lock:
+            self.total_polls += schedule.polls
+            self.tasks_finished += 1
+            if duration is not None:
+                samples = self.durations.setdefault(str(webapp_id), [])
+                samples.append(round(duration, 1))
+                del samples[:-self.history_size]
+                self._new_samples.setdefault(str(webapp_id), []).append(round(duration, 1))
+                self._dirty = True
+
+    def reset_stats(self):
+        with self._lock:
+            self.total_polls = self.tasks_finished = 0
+
+    def stats_summary(self):
+        avg = self.total_polls / self.tasks_finished if self.tasks_finished else 0
+        return f"轮询统计: {self.tasks_finished} 个任务共查询 {self.total_polls} 次, 平均每任务 {avg:.1f} 次"
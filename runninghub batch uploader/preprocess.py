@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 可选依赖: pip install pillow
+    Image = ImageOps = None
+
+# --- 上传前图片预处理：多进程缩放/转码/去除 EXIF，结果按源文件哈希+参数缓存 ---
+
+PREPROCESS_CACHE_DIRNAME = 'runninghub_preprocess'
+IMAGE_FORMATS = ('keep', 'JPEG', 'PNG', 'WEBP')
+_FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+def is_available():
+    return Image is not None
+
+
+def default_cache_dir():
+    return os.path.join(tempfile.gettempdir(), PREPROCESS_CACHE_DIRNAME)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def preprocess_image(src_path, cache_dir, max_edge, image_format, quality, strip_exif):
+    """
+    Worker-process entry point. Returns (output_path, source_bytes, output_bytes, seconds, cached).
+    output_path is src_path itself when nothing needs changing, or when a same-format re-encode
+    (no resize, no EXIF to strip) would not be smaller.
+    """
+    start = time.perf_counter()
+    src_size = os.path.getsize(src_path)
+    with Image.open(src_path) as im:
+        src_format = im.format
+        out_format = src_format if image_format == 'keep' else image_format
+        ext = _FORMAT_EXTENSIONS.get(out_format)
+        needs_resize = max_edge > 0 and max(im.size) > max_edge
+        has_exif = bool(im.info.get('exif'))
+        if ext is None or not (needs_resize or out_format != src_format or (strip_exif and has_exif)):
+            return src_path, src_size, src_size, time.perf_counter() - start, False
+
+        settings_key = f"{max_edge}|{out_format}|{quality}|{int(strip_exif)}"
+        key = hashlib.sha256(f"{_file_sha256(src_path)}|{settings_key}".encode('utf-8')).hexdigest()[:32]
+        out_path = os.path.join(cache_dir, key + ext)
+        if os.path.exists(out_path):
+            return out_path, src_size, os.path.getsize(out_path), time.perf_counter() - start, True
+
+        exif = None if strip_exif else im.info.get('exif')
+        # Bake the EXIF orientation into the pixels before the tag is dropped
+        image = ImageOps.exif_transpose(im) if strip_exif else im
+        if needs_resize:
+            image = image.copy() if image is im else image
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if out_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        save_kwargs = {'optimize': True} if out_format in ('JPEG', 'PNG') else {}
+        if out_format in ('JPEG', 'WEBP'):
+            save_kwargs['quality'] = quality
+        if exif:
+            save_kwargs['exif'] = exif
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format=out_format, **save_kwargs)
+
+    out_size = os.path.getsize(tmp_path)
+    # Only a pure re-encode may fall back to the original; a resize or EXIF strip must reach the upload
+    must_keep = needs_resize or (strip_exif and has_exif)
+    if not must_keep and out_size >= src_size and out_format == src_format:
+        os.remove(tmp_path)
+        return src_path, src_size, src_size, time.perf_counter() - start, False
+    os.replace(tmp_path, out_path)
+    return out_path, src_size, out_size, time.perf_counter() - start, False
+
+
+class ImagePreprocessor:
+    """
+    Runs preprocess_image for many files on a ProcessPoolExecutor (one process per core by
+    default). start() returns immediately with a future per source path, so uploads can begin
+    as soon as their own file is ready; summary() reports bytes saved and time spent.
+    Outputs live in a temp cache keyed by source content hash plus settings and are reused
+    across runs.
+    """
+
+    def __init__(self, max_edge=0, image_format='keep', quality=90, strip_exif=True, workers=0, cache_dir=None):
+        if Image is None:
+            raise RuntimeError("图片预处理需要 Pillow: pip install pillow")
+        self.max_edge = int(max_edge)
+        self.image_format = image_format if image_format in IMAGE_FORMATS else 'keep'
+        self.quality = int(quality)
+        self.strip_exif = bool(strip_exif)
+        self.workers = int(workers) or os.cpu_count() or 1
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.futures = {}
+        self._started = None
+
+    def describe(self):
+        edge = f"最长边 {self.max_edge}px" if self.max_edge > 0 else "不缩放"
+        return f"{edge}, 格式 {self.image_format}, 质量 {self.quality}, {'去除' if self.strip_exif else '保留'} EXIF"
+
+    def start(self, src_paths):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._started = time.perf_counter()
+        unique_paths = list(dict.fromkeys(src_paths))
+        executor = ProcessPoolExecutor(max_workers=min(self.workers, max(len(unique_paths), 1)))
+        for path in unique_paths:
+            self.futures[path] = executor.submit(preprocess_image, path, self.cache_dir, self.max_edge,
+                                                 self.image_format, self.quality, self.strip_exif)
+        executor.shutdown(wait=False)
+        return self.futures
+
+    def summary(self):
+        """Waits for every file and returns a one-line report."""
+        wait(list(self.futures.values()))
+        wall = time.perf_counter() - self._started if self._started else 0.0
+        src_total = out_total = cpu = 0
+        changed = cached = failed = 0
+        for src_path, future in self.futures.items():
+            if future.exception() is not None:
+                failed += 1
+                continue
+            out_path, src_size, out_size, seconds, was_cached = future.result()
+            src_total += src_size
+            out_total += out_size
+            cpu += seconds
+            changed += out_path != src_path
+            cached += was_cached
+        saved = src_total - out_total
+        return (f"图片预处理: {len(self.futures)} 个文件, 处理 {changed} 个 (缓存命中 {cached}), 失败 {failed}; "
+                f"{src_total / 1024 / 1024:.1f} MB -> {out_total / 1024 / 1024:.1f} MB, 节省 {saved / 1024 / 1024:.1f} MB; "
+                f"耗时 {wall:.1f}s (进程累计 {cpu:.1f}s, {self.workers} 进程)")
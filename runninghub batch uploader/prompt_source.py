@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+
+# --- 提示词流式读取：JSON 数组逐项解析、JSONL 逐行解析，按需去重，不把整个文件读入内存 ---
+
+PROMPT_FILE_EXTENSIONS = ('.json', '.jsonl')
+READ_CHUNK_CHARS = 256 * 1024
+
+_WHITESPACE = ' \t\r\n'
+_decoder = json.JSONDecoder()
+
+
+def iter_json_items(path, chunk_chars=READ_CHUNK_CHARS):
+    """
+    Yields the top-level items of a prompt file while reading it in chunks: the elements of
+    a JSON array, or each value of a JSONL / concatenated-JSON file (a single JSON object is
+    a one-item file). Memory use is bounded by the largest single item, not the file.
+    Raises ValueError on malformed content, after yielding everything before it.
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buf, pos, eof = '', 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_chars)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def next_value():
+            # A value is only accepted once a character follows it (or the file ended), so a
+            # number or literal cut at the chunk boundary is never decoded half-read.
+            nonlocal pos
+            while True:
+                try:
+                    value, end = _decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        fill()
+        skip_whitespace()
+        if pos < len(buf) and buf[pos] == '[':
+            pos += 1
+            skip_whitespace()
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            while True:
+                yield next_value()
+                skip_whitespace()
+                if pos >= len(buf):
+                    raise ValueError("JSON 数组未结束")
+                if buf[pos] == ']':
+                    return
+                if buf[pos] != ',':
+                    raise ValueError("JSON 数组元素之间缺少逗号")
+                pos += 1
+                skip_whitespace()
+        else:
+            while pos < len(buf):
+                yield next_value()
+                skip_whitespace()
+
+
+def prompts_from_item(item, prompt_key, text_id):
+    """
+    Prompt texts carried by one file item, for the shapes the tool accepts: a plain string,
+    a dict keyed by the text field (or the legacy 'prompt' key) and a full API payload with
+    nodeInfoList. Returns (prompts, used_legacy_key).
+    """
+    if isinstance(item, str):
+        return [item], False
+    if not isinstance(item, dict):
+        return [], False
+    if prompt_key in item:
+        return [item.get(prompt_key)], False
+    if 'prompt' in item:
+        return [item.get('prompt')], True
+    if 'nodeInfoList' in item:
+        return [node['fieldValue'] for node in item.get('nodeInfoList') or []
+                if node.get('nodeId') == text_id and node.get('fieldValue')], False
+    return [], False
+
+
+class PromptSource:
+    """
+    Re-iterable stream of the prompts in the selected JSON / JSONL files.
+
+    scan() makes one pass to count the prompts (the batch modes need the count up front),
+    reporting per-file problems; each later iteration reads the files again, so memory stays
+    flat however many prompts there are. With dedupe=True repeated prompts are dropped on
+    the fly, keeping only a 16-byte digest per distinct prompt. Empty prompts are skipped.
+    """
+
+    def __init__(self, paths, prompt_key, text_id, dedupe=False, log=None):
+        self.paths = list(paths)
+        self.prompt_key = prompt_key
+        self.text_id = text_id
+        self.dedupe = dedupe
+        self.log = log or (lambda message, level='INFO': None)
+        self.count = 0
+        self.duplicates = 0
+        self.first = None
+
+    def _iter_file(self, path, report):
+        legacy_warned = False
+        for item in iter_json_items(path):
+            prompts, legacy = prompts_from_item(item, self.prompt_key, self.text_id)
+            if legacy and report and not legacy_warned:
+                legacy_warned = True
+                self.log(f"警告: JSON文件 {os.path.basename(path)} 使用 'prompt' 键，但当前API配置需要 '{self.prompt_key}'。已作为兼容模式加载。",
+                         level='WARNING')
+            for prompt in prompts:
+                if prompt:
+                    yield prompt
+
+    def _iter(self, report=False):
+        seen = set() if self.dedupe else None
+        for path in self.paths:
+            try:
+                for prompt in self._iter_file(path, report):
+                    if seen is not None:
+                        digest = hashlib.blake2b(str(prompt).encode('utf-8'), digest_size=16).digest()
+                        if digest in seen:
+                            if report:
+                                self.duplicates += 1
+                            continue
+                        seen.add(digest)
+                    yield prompt
+            except (OSError, ValueError) as e:
+                if report:
+                    self.log(f"错误: 解析 JSON 文件 {os.path.basename(path)} 失败: {e}", level='ERROR')
+
+    def scan(self):
+        """Counts the prompts in one streaming pass; returns the count."""
+        self.count = self.duplicates = 0
+        self.first = None
+        for prompt in self._iter(report=True):
+            if self.first is None:
+                self.first = prompt
+            self.count += 1
+        return self.count
+
+    def __iter__(self):
+        return self._iter()
+
+    def __len__(self):
+        return self.count
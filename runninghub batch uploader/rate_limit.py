@@ -0,0 +1,126 @@
+import threading
+import time
+
+# --- 速率限制：令牌桶 (创建/上传/查询分别限速)，平台队列已满时自适应退避 ---
+
+# RunningHub create responses meaning "too many tasks queued / running for this account".
+QUEUE_FULL_CODES = (415, 421)
+# Specific phrases only: other create errors may merely mention concurrency (并发) and must
+# fail through the normal retry path instead of being throttled until the task timeout
+QUEUE_FULL_MARKERS = ('MAXED', 'QUEUE_FULL', '队列已满', '并发已达上限', '并发数已达上限')
+
+
+def is_queue_full(create_data):
+    """True when a create response is the platform's queue-full / concurrency-limit rejection."""
+    if create_data.get('code') in QUEUE_FULL_CODES:
+        return True
+    msg = str(create_data.get('msg') or '')
+    return any(marker in msg.upper() for marker in QUEUE_FULL_MARKERS)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. rate is requests/second (0 = unlimited), burst the bucket size.
+
+    reserve() claims a token and returns how long the caller must wait before sending, so
+    threads use time.sleep(bucket.reserve()) and coroutines asyncio.sleep(bucket.reserve()).
+
+    throttled() is called when the server reports backpressure: the effective rate is halved
+    (starting from fallback_rate when unlimited) and every caller waits out a cooldown that
+    doubles per consecutive rejection up to max_cooldown. succeeded() raises the rate again by
+    recovery_step per success until the configured rate (or unlimited) is restored.
+    """
+
+    def __init__(self, rate=0.0, burst=None, fallback_rate=1.0, min_rate=0.1,
+                 base_cooldown=5.0, max_cooldown=60.0, recovery_step=0.1):
+        self.configured_rate = max(0.0, float(rate))
+        self.rate = self.configured_rate
+        self.burst = burst
+        self.fallback_rate = fallback_rate
+        self.min_rate = min_rate
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.recovery_step = recovery_step
+        self.throttle_count = 0
+        self._consecutive_throttles = 0
+        self._cooldown_until = 0.0
+        self._tokens = self._capacity()
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        return self.burst if self.burst else max(1.0, self.rate)
+
+    def configure(self, rate):
+        """Applies a new configured rate (e.g. when settings change between runs)."""
+        with self._lock:
+            self.configured_rate = self.rate = max(0.0, float(rate))
+            self._consecutive_throttles = 0
+            self._tokens = min(self._tokens, self._capacity())
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._cooldown_until - now)
+            if self.rate > 0:
+                self._tokens = min(self._capacity(), self._tokens + (now - self._last) * self.rate)
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            self._last = now
+            return wait
+
+    def throttled(self):
+        """Registers a server-side rejection. Returns the cooldown in seconds."""
+        with self._lock:
+            self.throttle_count += 1
+            now = time.monotonic()
+            if now < self._cooldown_until:
+                # Rejections from requests already in flight share the current cooldown
+                return self._cooldown_until - now
+            self._consecutive_throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2 if self.rate > 0 else self.fallback_rate)
+            self._tokens = min(self._tokens, self._capacity())
+            cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (self._consecutive_throttles - 1))
+            self._cooldown_until = now + cooldown
+            return cooldown
+
+    def succeeded(self):
+        with self._lock:
+            self._consecutive_throttles = 0
+            if self.rate == self.configured_rate:
+                return
+            step = self.recovery_step * (self.configured_rate or self.fallback_rate)
+            self.rate += step
+            if self.configured_rate and self.rate >= self.configured_rate:
+                self.rate = self.configured_rate
+            elif not self.configured_rate and self.rate >= self.fallback_rate * 10:
+                self.rate = 0.0
+
+    def describe(self):
+        rate = self.rate
+        return "不限" if rate <= 0 else f"{rate:.2f}/s"
+
+
+class RateLimits:
+    """Separate buckets for task creation, file uploads and result polling, shared by all workers."""
+
+    def __init__(self, create_rate=0.0, upload_rate=0.0, poll_rate=0.0):
+        self.create = TokenBucket(create_rate)
+        self.upload = TokenBucket(upload_rate)
+        self.poll = TokenBucket(poll_rate)
+
+    def configure(self, create_rate, upload_rate, poll_rate):
+        for bucket, rate in ((self.create, create_rate), (self.upload, upload_rate), (self.poll, poll_rate)):
+            if bucket.configured_rate != max(0.0, float(rate)):
+                bucket.configure(rate)
+
+    def describe(self):
+        text = f"创建 {self.create.describe()}, 上传 {self.upload.describe()}, 查询 {self.poll.describe()}"
+        if self.create.throttle_count:
+            text += f" (队列已满 {self.create.throttle_count} 次)"
+        return text
+
+    def reset_stats(self):
+        for bucket in (self.create, self.upload, self.poll):
+            bucket.throttle_count = 0
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+
+# --- 结果缓存：完全相同的负载 (webappId + 节点参数) 直接复用之前成功任务的输出，不再重复提交 ---
+
+RESULT_CACHE_FILENAME = 'result_cache.json'
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class ResultCache:
+    """
+    Persistent memo of successful task outputs, keyed by run_journal.payload_hash
+    (webappId plus the normalised nodeInfoList, independent of the apiKey).
+
+    Entries hold the output fileUrls, the task id, the completion time and how long the task
+    took, which is what a hit is credited as saved. Entries older than ttl_seconds are
+    dropped (the platform's output URLs do not live forever); beyond max_entries the least
+    recently used entries are evicted. Hits and saved seconds are counted per run.
+    """
+
+    def __init__(self, cache_path=RESULT_CACHE_FILENAME, ttl_seconds=24 * 3600, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.seconds_saved = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError):
+            # A corrupt cache file only costs resubmissions; start over.
+            self.entries = {}
+
+    def save(self):
+        """Writes the cache atomically if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            serialized = json.dumps({'entries': self.entries}, ensure_ascii=False)
+            self._dirty = False
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(serialized)
+        os.replace(tmp_path, self.cache_path)
+
+    def get(self, key):
+        """Returns the cached entry for key (and counts the hit), or None on miss/expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and self.ttl_seconds > 0 and now - entry['completed_at'] < self.ttl_seconds:
+                entry['last_used'] = now
+                self.hits += 1
+                self.seconds_saved += entry.get('task_seconds') or 0.0
+                self._dirty = True
+                return entry
+            if entry:
+                del self.entries[key]
+                self._dirty = True
+            return None
+
+    def put(self, key, file_urls, task_id=None, task_seconds=None):
+        """Stores a successful result; re-reporting the same outputs keeps the original completion time."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry['file_urls'] == file_urls:
+                entry['last_used'] = now
+                return
+            self.entries[key] = {'file_urls': list(file_urls), 'task_id': task_id, 'task_seconds': task_seconds,
+                                 'completed_at': now, 'last_used': now}
+            self._dirty = True
+            overflow = len(self.entries) - self.max_entries
+            if overflow > 0:
+                for old_key in sorted(self.entries, key=lambda k: self.entries[k]['last_used'])[:overflow]:
+                    del self.entries[old_key]
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.seconds_saved = 0.0
+
+    def stats_summary(self):
+        minutes = self.seconds_saved / 60
+        return (f"结果缓存: 命中 {self.hits} 个负载 (直接复用之前的输出, 未提交任务), "
+                f"估计节省 GPU 时间 {minutes:.1f} 分钟")
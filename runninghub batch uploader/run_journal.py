@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+# --- 运行日志库：SQLite (WAL) 记录每个负载的状态，用于崩溃后续跑 ---
+
+JOURNAL_FILENAME = 'run_journal.db'
+
+STATE_CREATED = 'created'
+STATE_SUCCEEDED = 'succeeded'
+STATE_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    webapp_id   TEXT,
+    mode        TEXT,
+    total       INTEGER,
+    started_at  REAL
+);
+CREATE TABLE IF NOT EXISTS payloads (
+    run_id       TEXT NOT NULL,
+    batch_id     INTEGER NOT NULL,
+    webapp_id    TEXT,
+    payload_hash TEXT NOT NULL,
+    state        TEXT NOT NULL,
+    task_id      TEXT,
+    file_urls    TEXT,
+    error        TEXT,
+    updated_at   REAL,
+    PRIMARY KEY (run_id, batch_id)
+);
+CREATE INDEX IF NOT EXISTS idx_payloads_hash ON payloads (webapp_id, payload_hash);
+"""
+
+_UPSERT = """
+INSERT INTO payloads (run_id, batch_id, webapp_id, payload_hash, state, task_id, file_urls, error, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (run_id, batch_id) DO UPDATE SET
+    state = excluded.state,
+    task_id = COALESCE(excluded.task_id, payloads.task_id),
+    file_urls = COALESCE(excluded.file_urls, payloads.file_urls),
+    error = excluded.error,
+    updated_at = excluded.updated_at
+"""
+
+
+def payload_hash(payload):
+    """
+    Canonical hash of a payload: webappId plus nodeInfoList normalised by nodeId/fieldName.
+    apiKey is left out so the same work is recognised whichever key submitted it.
+    """
+    nodes = sorted(
+        ({k: node.get(k) for k in ('nodeId', 'fieldName', 'fieldValue')} for node in payload.get('nodeInfoList', [])),
+        key=lambda node: (str(node['nodeId']), str(node['fieldName'])),
+    )
+    canonical = json.dumps({'webappId': payload.get('webappId'), 'nodeInfoList': nodes},
+                           sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class RunJournal:
+    """
+    Persistent record of batch executions in a SQLite database in WAL mode.
+
+    record() only enqueues; a background writer thread commits queued state transitions
+    in one transaction every flush_interval seconds (or once batch_size rows are waiting),
+    so the task hot loop never waits on disk. A crash loses at most the last interval.
+    """
+
+    def __init__(self, path=JOURNAL_FILENAME, flush_interval=0.5, batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._closed = False
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        conn.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="run-journal", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start_run(self, webapp_id, mode, total):
+        run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self._queue.put(('run', (run_id, webapp_id, mode, total, time.time())))
+        return run_id
+
+    def record(self, run_id, batch_id, webapp_id, payload_key, state, task_id=None, file_urls=None, error=None):
+        urls = json.dumps(file_urls, ensure_ascii=False) if file_urls is not None else None
+        self._queue.put(('payload', (run_id, batch_id, webapp_id, payload_key, state,
+                                     str(task_id) if task_id is not None else None, urls, error, time.time())))
+
+    def _writer_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            rows, runs = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                kind, values = item
+                (runs if kind == 'run' else rows).append(values)
+            if runs or rows:
+                try:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)", runs)
+                        conn.executemany(_UPSERT, rows)
+                except sqlite3.Error as e:
+                    logging.warning(f"运行日志写入失败, 丢弃 {len(rows)} 条记录: {e}")
+        conn.close()
+
+    def close(self):
+        """Flushes everything queued and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def load_resume_index(self, webapp_id):
+        """
+        Returns {payload_hash: (state, task_id, file_urls)} for a webapp, preferring any
+        successful record over unfinished ones. Failed attempts are not returned, so those
+        payloads simply run again.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT payload_hash, state, task_id, file_urls FROM payloads "
+                "WHERE webapp_id = ? AND state IN (?, ?) ORDER BY updated_at",
+                (str(webapp_id), STATE_CREATED, STATE_SUCCEEDED),
+            )
+            index = {}
+            for key, state, task_id, file_urls in cursor:
+                if index.get(key, (None,))[0] == STATE_SUCCEEDED:
+                    continue
+                index[key] = (state, task_id, json.loads(file_urls) if file_urls else [])
+            return index
+        finally:
+            conn.close()
@@ -0,0 +1,1697 @@
+import json
+import logging
+import os
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import async_engine
+import preprocess
+from downloader import DOWNLOAD_DIRNAME, ResultDownloader
+from folder_watch import DirectoryIndex, FolderWatcher
+from key_pool import REJECT_QUEUE_FULL, REJECT_QUOTA, ApiKeyPool, classify_rejection, parse_key_specs
+from metrics import MetricsExporter, RunMetrics
+from multipart_stream import StreamingMultipartBody, upload_time_budget
+from polling import AdaptivePollingPolicy
+from prompt_source import PROMPT_FILE_EXTENSIONS, PromptSource
+from rate_limit import RateLimits, is_queue_full
+from result_cache import ResultCache
+from run_journal import STATE_CREATED, STATE_FAILED, STATE_SUCCEEDED, RunJournal, payload_hash
+from upload_cache import UploadCache, file_sha256
+
+# --- 无界面核心：配置解析、负载生成、上传与任务执行 (不依赖 tkinter) ---
+
+LOG_FILENAME = 'api_runner_log.txt'
+UPLOAD_URL = "https://www.runninghub.cn/task/openapi/upload"
+OUTPUTS_URL = "https://www.runninghub.cn/task/openapi/outputs"
+
+# Uploads at least this large report progress in 10% steps
+UPLOAD_PROGRESS_MIN_BYTES = 20 * 1024 * 1024
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.webm')
+
+BATCH_MODE_OPTIONS = [
+    "M0: 默认单请求模式",
+    "M1: 多图单提示词/视频",
+    "M2: 多视频单提示词/图片",
+    "M3: 纯多提示词批量",
+    "M4: 多图多提示词 1:1 顺序匹配",
+    "M6: 单图多提示词",
+    "M7a: 多图滑窗 (2图/1步, [001,002],[002,003]...)",
+    "M7b: 多图滑窗 (3图/2步, [001,002,003],[003,004,005]...)",
+    "M8: 纯多图批量",
+    "M9: 纯多视频批量",
+    "M10: 固定单图+多图组合",
+    "M11: 固定双图+多图组合",
+    "M5: (危险) 笛卡尔积/全组合"
+]
+
+
+def log_error_report(message, api_data=None):
+    """记录错误并生成详细的错误报告文件."""
+    error_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_filename = f'ERROR_REPORT_{error_time}.txt'
+
+    logging.error(message)
+
+    with open(report_filename, 'w', encoding='utf-8') as f:
+        f.write(f"--- API Runner 错误报告 ---\n")
+        f.write(f"时间戳: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"错误信息: {message}\n")
+        f.write(f"--- 当前 API 配置 ---\n")
+        if api_data:
+            f.write(f"URL: {api_data.get('url', 'N/A')}\n")
+            f.write(f"Webapp ID: {api_data.get('webappId', 'N/A')}\n")
+            f.write(f"API Key: {api_data.get('apiKey', 'N/A')[:4]}...\n")
+        f.write(f"------------------------------\n")
+
+    return f"操作失败。已生成错误报告文件：{report_filename}"
+
+
+def log_to_file(message, level='INFO'):
+    """Writes one record to the file logger; 'SUCCESS' has no logging level and maps to INFO."""
+    log_method = getattr(logging, level.lower(), logging.info)
+    log_method(message)
+
+
+def parse_config_file(filepath):
+    """
+    Parses an API config file: either a JSON object with url/webappId/apiKey/nodeInfoList,
+    or a pasted curl command. Raises ValueError when required fields are missing.
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        file_content = f.read()
+
+    config = None
+    try:
+        config = json.loads(file_content)
+    except json.JSONDecodeError:
+        url_match = re.search(r'(?:POST|GET|PUT)\s+[\'"](https?:\/\/[^\'"]+)[\'"]', file_content)
+        api_url = url_match.group(1) if url_match else None
+        json_body_match = re.search(r'(?:--data-raw|--data)\s+[\'"]\s*(\{.*\})\s*[\'"]', file_content, re.DOTALL)
+        if not api_url or not json_body_match:
+            raise ValueError("未在文件中找到有效的 API URL 和/或 JSON 请求主体。")
+        json_string = json_body_match.group(1)
+        body_data = json.loads(json_string)
+
+        config = {
+            "url": api_url, "webappId": body_data.get('webappId'), "apiKey": body_data.get('apiKey'), "nodeInfoList": body_data.get('nodeInfoList')
+        }
+
+    required_keys = ['url', 'webappId', 'apiKey', 'nodeInfoList']
+    if not all(key in config and config[key] for key in required_keys):
+        raise ValueError("解析后的配置信息中缺少必要的字段。")
+    return config
+
+
+def build_interface_info(config):
+    return [
+        {
+            "code": node['nodeId'],
+            "name": node['description'],
+            "type": node['fieldName'],
+            "default_value": node.get('fieldValue', '')
+        }
+        for node in config['nodeInfoList']
+    ]
+
+
+def asset_kind(filename):
+    """'image', 'video' or 'json_config' by file extension; None for anything else."""
+    lower = filename.lower()
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    if lower.endswith(VIDEO_EXTENSIONS):
+        return 'video'
+    if lower.endswith(PROMPT_FILE_EXTENSIONS):
+        return 'json_config'
+    return None
+
+
+def classify_files(files):
+    """Splits a directory listing into sorted image / video / json lists."""
+    assets = {'image': [], 'video': [], 'json_config': []}
+    for f in files:
+        kind = asset_kind(f)
+        if kind:
+            assets[kind].append(f)
+    for names in assets.values():
+        names.sort()
+    return assets
+
+
+def count_mode_payloads(mode, n_img, n_vid, n_prompt):
+    """Number of payloads a batch mode produces for the given input counts, without building them."""
+    if mode.startswith("M0"):
+        return 1
+    if mode.startswith(("M3", "M6")):
+        return n_prompt if n_prompt > 1 else 1
+    if mode.startswith("M4"):
+        return min(n_img, n_prompt)
+    if "M7" in mode:
+        window_size, step_size = (2, 1) if "M7a" in mode else (3, 2)
+        return (n_img - window_size) // step_size + 1 if n_img >= window_size else 0
+    if mode.startswith(("M1", "M8", "M10", "M11")):
+        return n_img
+    if mode.startswith(("M2", "M9")):
+        return n_vid
+    if mode.startswith("M5"):
+        return n_img * n_prompt
+    return 0
+
+
+def find_mode_option(mode_code):
+    """Maps a short code such as 'M7a' to its full BATCH_MODE_OPTIONS entry (None if unknown)."""
+    return next((opt for opt in BATCH_MODE_OPTIONS if opt.split(':')[0].lower() == mode_code.strip().lower()), None)
+
+
+def recommend_mode(current_mode, n_img, n_vid, n_prompt):
+    """Auto-recommends a batch mode from the input counts, keeping explicit window/combination choices."""
+    if n_img > 1 and n_prompt > 1 and n_img == n_prompt: return "M4: 多图多提示词 1:1 顺序匹配"
+    elif n_img == 1 and n_prompt > 1: return "M6: 单图多提示词"
+    elif n_img > 1 and n_prompt == 0 and n_vid == 0: return "M8: 纯多图批量"
+    elif n_vid > 1 and n_prompt == 0 and n_img == 0: return "M9: 纯多视频批量"
+    elif n_img > 1 and n_prompt <= 1:
+         if "滑窗" not in current_mode and "组合" not in current_mode: return "M1: 多图单提示词/视频"
+    elif n_vid > 1 and n_prompt <= 1: return "M2: 多视频单提示词/图片"
+    elif n_prompt > 1 and n_img < 2 and n_vid < 2: return "M3: 纯多提示词批量"
+    elif "组合" not in current_mode: return "M0: 默认单请求模式"
+    return current_mode
+
+
+class RunSettings:
+    """Run/retry settings shared by the Tk app and the CLI. Attribute names match the GUI fields."""
+
+    def __init__(self, upload_timeout=60, retry_interval=60, max_retries=6, upload_delay_on_success=0,
+                 max_concurrent_tasks=1, upload_concurrency=4, upload_cache_ttl_hours=24,
+                 use_async_engine=False, task_polling_interval=5, task_timeout=300, adaptive_polling=True,
+                 payload_log_limit=10, create_rate=0.0, upload_rate=0.0, poll_rate=0.0,
+                 download_results=True, download_concurrency=4, download_dir=DOWNLOAD_DIRNAME, pipelined=False,
+                 preprocess_max_edge=0, preprocess_format='keep', preprocess_quality=90, preprocess_strip_exif=True,
+                 preprocess_workers=0, metrics_interval=15, dedupe_prompts=False, result_cache_ttl_hours=24,
+                 force_resubmit=False):
+        self.upload_timeout = upload_timeout
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.upload_delay_on_success = upload_delay_on_success
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.upload_concurrency = upload_concurrency
+        self.upload_cache_ttl_hours = upload_cache_ttl_hours
+        self.use_async_engine = use_async_engine
+        self.task_polling_interval = task_polling_interval
+        self.task_timeout = task_timeout
+        self.adaptive_polling = adaptive_polling
+        self.payload_log_limit = payload_log_limit
+        # Requests/second per endpoint class; 0 = unlimited (queue-full backoff still applies)
+        self.create_rate = create_rate
+        self.upload_rate = upload_rate
+        self.poll_rate = poll_rate
+        # Result download; a relative download_dir is resolved against the working directory
+        self.download_results = download_results
+        self.download_concurrency = download_concurrency
+        self.download_dir = download_dir
+        # Upload batch files in the background and submit each payload once its own inputs are up
+        self.pipelined = pipelined
+        # Image preprocessing before upload (needs Pillow); off while max edge is 0 and format 'keep'
+        self.preprocess_max_edge = preprocess_max_edge
+        self.preprocess_format = preprocess_format
+        self.preprocess_quality = preprocess_quality
+        self.preprocess_strip_exif = preprocess_strip_exif
+        self.preprocess_workers = preprocess_workers
+        # Seconds between metrics file exports during a run; 0 = summary table only
+        self.metrics_interval = metrics_interval
+        # Drop repeated prompts while streaming the prompt files
+        self.dedupe_prompts = dedupe_prompts
+        # Reuse outputs of identical payloads that succeeded within this many hours (0 = off);
+        # force_resubmit submits everything anyway for one run (new results are still cached)
+        self.result_cache_ttl_hours = result_cache_ttl_hours
+        self.force_resubmit = force_resubmit
+
+
+class RunnerCore:
+    """
+    GUI-free batch runner. Holds the active API config, the scanned assets of the working
+    directory and the generated payloads, and performs uploads and task execution.
+
+    Front ends pass a `log(message, level)` callback for progress and a
+    `warn(title, message)` callback for user-facing mode warnings. Per-node values typed
+    into a front end go into `value_overrides` / `file_overrides` (nodeId -> value).
+    `api_key_specs` (from the config's "apiKeys" list or a front end) switches runs to
+    the multi-key scheduler.
+    """
+
+    def __init__(self, settings=None, log=None, warn=None):
+        self.settings = settings or RunSettings()
+        self.log = log or log_to_file
+        self.warn = warn or (lambda title, message: self.log(f"{title}: {message}", level='WARNING'))
+
+        self.current_directory = os.getcwd()
+        self.scanned_assets = {'image': [], 'video': [], 'json_config': []}
+        self.scan_changed = False
+        self._dir_index = None
+        self._payload_plan = None
+        self._source_names = {}
+        self._pending_uploads = {}
+        self._preprocessed = {}
+        self.payload_count = 0
+        self.prompts = []
+
+        self.API_DATA = {}
+        self.INTERFACE_INFO = []
+        self.BASE_HEADERS = {"Content-Type": "application/json"}
+        self.value_overrides = {}
+        self.file_overrides = {}
+
+        self.http_session = None
+        self._http_session_pool_size = 0
+        self._http_session_lock = threading.Lock()
+        self.upload_cache = None
+        self.result_cache = None
+        self._reuse_results = False
+        self._created_at = {}
+        self.polling_policy = None
+        self.rate_limits = None
+        self.journal = None
+        self.downloader = None
+        self._run_id = None
+        self._resume_index = {}
+        self.metrics = RunMetrics()
+        self.api_key_specs = []
+        self.key_pool = None
+        self._key_inputs = set()
+        self._input_digests = {}
+        self._key_uploads = {}
+        self._key_upload_lock = threading.Lock()
+        self._key_upload_executor = None
+        self.shared_uploads = None
+        # Multi-config batches: preprocessing futures by local name shared by all cores, and
+        # result cache stats reset and reported once for the whole batch instead of per core
+        self.shared_preprocessed = None
+        self.batch_cache_stats = False
+
+    # --- 配置与文件扫描 ---
+
+    def load_config(self, filepath):
+        config = parse_config_file(filepath)
+        self.API_DATA = config
+        self.INTERFACE_INFO = build_interface_info(config)
+        # Start from the config defaults, exactly like the GUI editor fields do.
+        self.value_overrides = {info['code']: info['default_value'] for info in self.INTERFACE_INFO
+                                if info['type'] in ("value", "text", "select", "prompt")}
+        self.file_overrides = {info['code']: info['default_value'] for info in self.INTERFACE_INFO
+                               if info['type'] in ("image", "video")}
+        # Optional per-config preprocessing block, e.g. "preprocess": {"max_edge": 1024, "format": "JPEG"}
+        options = config.get('preprocess')
+        if isinstance(options, dict):
+            for key in ('max_edge', 'format', 'quality', 'strip_exif', 'workers'):
+                if key in options:
+                    setattr(self.settings, f'preprocess_{key}', options[key])
+            self.log(f"配置文件指定了图片预处理参数: {options}", level='INFO')
+        # Optional pool of accounts, e.g. "apiKeys": ["KEY1", "KEY2:3", {"key": "KEY3", "concurrency": 2}]
+        self.api_key_specs = parse_key_specs(config.get('apiKeys'))
+        if self.api_key_specs:
+            self.log(f"配置文件包含 {len(self.api_key_specs)} 个 API Key, 任务将在这些 Key 之间调度。", level='INFO')
+        return config
+
+    def scan_directory(self, directory=None):
+        """
+        Rescans the working directory. Raises FileNotFoundError if it does not exist.
+        The scan is incremental: a DirectoryIndex remembers the listing, an unchanged directory
+        costs one stat() and otherwise only added/removed names are applied to the sorted
+        asset lists. scan_changed tells whether anything differs from the previous scan.
+        """
+        if directory is not None:
+            self.current_directory = directory
+        index = self._dir_index
+        if index is None or index.directory != self.current_directory:
+            index = DirectoryIndex(self.current_directory, accept=lambda name: asset_kind(name) is not None)
+            self._dir_index = index
+            self.scanned_assets = {'image': [], 'video': [], 'json_config': []}
+        try:
+            added, _, removed = index.refresh()
+        except FileNotFoundError:
+            self._dir_index = None
+            raise
+        for name in removed:
+            names = self.scanned_assets[asset_kind(name)]
+            i = bisect_left(names, name)
+            if i < len(names) and names[i] == name:
+                del names[i]
+        for name in added:
+            insort(self.scanned_assets[asset_kind(name)], name)
+        self.scan_changed = bool(added or removed)
+        return self.scanned_assets
+
+    def node_id_of_type(self, *types):
+        return next((info['code'] for info in self.INTERFACE_INFO if info['type'] in types), None)
+
+    def extract_prompts_from_json(self, json_filenames):
+        """
+        Points self.prompts at a streaming PromptSource over the selected JSON/JSONL files and
+        counts the prompts in one pass; payload generation then reads them lazily.
+        """
+        self.prompts = []
+        text_node_info = next((info for info in self.INTERFACE_INFO if info['type'] in ('text', 'prompt')), None)
+
+        if not text_node_info:
+            if json_filenames:
+                self.log("当前API配置中未找到 'text' 或 'prompt' 类型的字段，无法加载提示词。", level='WARNING')
+            return
+
+        source = PromptSource([os.path.join(self.current_directory, f) for f in json_filenames],
+                              prompt_key=text_node_info['type'], text_id=text_node_info['code'],
+                              dedupe=bool(self.settings.dedupe_prompts), log=self.log)
+        started = time.monotonic()
+        source.scan()
+        self.prompts = source
+        if json_filenames:
+            dedupe_note = f", 去除重复 {source.duplicates} 个" if source.dedupe else ""
+            self.log(f"从JSON文件中成功提取了 {source.count} 个提示词{dedupe_note} (流式读取, 耗时 {time.monotonic() - started:.1f}s)。",
+                     level='INFO')
+
+    # --- 负载生成 ---
+
+    def _default_value(self, node_id):
+        return next((info['default_value'] for info in self.INTERFACE_INFO if info['code'] == node_id), None)
+
+    def _get_base_payload_nodes(self, image_id, video_id, text_id):
+        base_nodes = []
+        for info in self.INTERFACE_INFO:
+            node_id = info['code']
+            override = self.value_overrides.get(node_id)
+            field_value = override if override not in (None, '') else info['default_value']
+
+            if node_id not in [image_id, video_id, text_id] and field_value is not None:
+                 base_nodes.append({
+                    "nodeId": node_id, "fieldName": info['type'], "fieldValue": field_value, "description": info['name']
+                })
+        return base_nodes
+
+    def _create_payload(self, base_nodes, text_id=None, text_val=None, image_id=None, image_val=None, video_id=None, video_val=None):
+        final_nodes = list(base_nodes)
+
+        default_text_val = self.value_overrides[text_id] if text_id in self.value_overrides else self._default_value(text_id)
+        default_image_val = self.file_overrides[image_id] if image_id in self.file_overrides else self._default_value(image_id)
+        default_video_val = self.file_overrides[video_id] if video_id in self.file_overrides else self._default_value(video_id)
+
+        def append_node(node_id, node_type, description, value, default_value):
+            if node_id:
+                 final_nodes.append({
+                    "nodeId": node_id, "fieldName": node_type, "fieldValue": value if value is not None else default_value, "description": description
+                })
+
+        text_info = next((info for info in self.INTERFACE_INFO if info['code'] == text_id), None)
+        if text_info: append_node(text_id, text_info['type'], text_info['name'], text_val, default_text_val)
+
+        image_info = next((info for info in self.INTERFACE_INFO if info['code'] == image_id), None)
+        if image_info: append_node(image_id, image_info['type'], image_info['name'], image_val, default_image_val)
+
+        video_info = next((info for info in self.INTERFACE_INFO if info['code'] == video_id), None)
+        if video_info: append_node(video_id, video_info['type'], video_info['name'], video_val, default_video_val)
+
+        return {
+            "webappId": self.API_DATA['webappId'], "apiKey": self.API_DATA['apiKey'], "nodeInfoList": final_nodes
+        }
+
+    def _create_single_payload(self):
+        node_info_list = []
+        for info in self.INTERFACE_INFO:
+            node_id = info['code']
+            field_value = self.value_overrides[node_id] if node_id in self.value_overrides else info['default_value']
+            node_info_list.append({
+                "nodeId": node_id, "fieldName": info['type'], "fieldValue": field_value, "description": info['name']
+            })
+        return {
+            "webappId": self.API_DATA['webappId'], "apiKey": self.API_DATA['apiKey'], "nodeInfoList": node_info_list
+        }
+
+    def generate_payloads(self, current_mode, selected_images_local, selected_videos_local, selected_jsons, auto_recommend=True):
+        """
+        Uploads the selected files, extracts prompts and plans the payloads for the batch mode.
+        Nothing is materialised: payload_count comes from the mode arithmetic and
+        iter_request_payloads() builds each payload when the run pulls it.
+        With settings.pipelined only the fixed files are uploaded here; batch files upload in
+        the background and each payload waits for just its own inputs when it is run.
+        With api_key_specs set nothing is uploaded here: payloads keep local file names and
+        each file is uploaded under whichever key runs it (see _payload_for_key).
+        Returns (recommended_mode, final_mode); final_mode differs only when nothing could
+        be generated and the single-request fallback was used.
+        """
+        self.log("--- 开始生成请求负载 ---", level='INFO')
+        # A new batch starts a new metrics window (uploads below are part of it)
+        self.metrics.reset()
+        selected_images_local = sorted(selected_images_local)
+        selected_videos_local = sorted(selected_videos_local)
+
+        image_id = self.node_id_of_type('image')
+        video_id = self.node_id_of_type('video')
+
+        fixed_image_local = self.file_overrides.get(image_id) if image_id else None
+        fixed_video_local = self.file_overrides.get(video_id) if video_id else None
+        fixed_images_parts = [img.strip() for img in fixed_image_local.split(',')] if fixed_image_local else []
+
+        fixed_files = fixed_images_parts + ([fixed_video_local] if fixed_video_local else [])
+        self._start_preprocessing(selected_images_local + fixed_images_parts)
+        self._pending_uploads = {}
+        self._source_names = {}
+        self._key_inputs = set()
+        multi_key = bool(self.api_key_specs)
+        if multi_key:
+            # 1. Multi-key: uploads belong to an account, so they happen once a key is assigned
+            self.log(f"多 API Key 模式 ({len(self.api_key_specs)} 个 Key): 文件在任务分配到 Key 后按需上传, 每个文件在每个 Key 下只上传一次。", level='INFO')
+            uploaded = {f: f for f in fixed_files}
+            self._key_inputs = set(selected_images_local + selected_videos_local + fixed_files)
+            uploaded_images = list(selected_images_local)
+            uploaded_videos = list(selected_videos_local)
+        elif self.settings.pipelined:
+            # 1. Pipelined: upload the fixed files now, batch files in order in the background
+            self.log("流水线模式: 先上传固定文件, 批量文件在后台按顺序上传, 每个任务在自身输入就绪后立即提交。", level='INFO')
+            uploaded = self._upload_files_parallel(fixed_files)
+            self._start_pipelined_uploads(selected_images_local + selected_videos_local)
+            uploaded_images = list(selected_images_local)
+            uploaded_videos = list(selected_videos_local)
+        else:
+            # 1. Upload all required files first (batch files and fixed files in one parallel stage)
+            self.log("开始上传所有必需的文件...", level='INFO')
+            uploaded = self._upload_files_parallel(selected_images_local + selected_videos_local + fixed_files)
+
+            uploaded_images = [uploaded[f] for f in selected_images_local if uploaded.get(f)]
+            uploaded_videos = [uploaded[f] for f in selected_videos_local if uploaded.get(f)]
+
+            if len(uploaded_images) != len(selected_images_local) or len(uploaded_videos) != len(selected_videos_local):
+                self.log("一个或多个批量文件上传失败。仅使用上传成功的文件生成任务。", level='WARNING')
+
+        uploaded_fixed_image = None
+        if len(fixed_images_parts) > 1:
+            uploaded_fixed_parts = [uploaded[p] for p in fixed_images_parts if uploaded.get(p)]
+            if len(uploaded_fixed_parts) == len(fixed_images_parts):
+                 uploaded_fixed_image = ",".join(uploaded_fixed_parts)
+            else:
+                 self.log("一个或多个固定图片上传失败。", level='ERROR')
+        else:
+            uploaded_fixed_image = uploaded.get(fixed_images_parts[0]) if fixed_images_parts else None
+
+        uploaded_fixed_video = uploaded.get(fixed_video_local)
+        self._source_names.update({server: local for local, server in uploaded.items() if server})
+        if not multi_key:
+            self.log("文件上传阶段完成。" if not self._pending_uploads else "固定文件上传完成, 批量文件继续在后台上传。", level='INFO')
+
+        # 2. Extract prompts
+        self.extract_prompts_from_json(selected_jsons)
+        prompts = self.prompts
+
+        N_img, N_vid, N_prompt = len(uploaded_images), len(uploaded_videos), len(prompts)
+
+        # 3. Auto-recommend mode
+        text_id = self.node_id_of_type('text', 'prompt')
+        final_mode = recommend_mode(current_mode, N_img, N_vid, N_prompt) if auto_recommend else current_mode
+        recommended_mode = final_mode
+        self.log(f"已根据输入自动推荐模式，当前执行模式: {final_mode}", level='INFO')
+
+        # 4. Plan payloads using UPLOADED URLs; they are built lazily when the run pulls them
+        prompt_default = prompts.first if N_prompt == 1 else (self.value_overrides.get(text_id) if text_id else None)
+        plan = {
+            'mode': final_mode, 'base_nodes': self._get_base_payload_nodes(image_id, video_id, text_id),
+            'text_id': text_id, 'image_id': image_id, 'video_id': video_id,
+            'images': uploaded_images, 'videos': uploaded_videos, 'prompts': prompts,
+            'prompt_default': prompt_default, 'image_default': uploaded_fixed_image, 'video_default': uploaded_fixed_video,
+            'single': False, 'key_pool': multi_key,
+        }
+
+        n_img_effective = N_img
+        if final_mode.startswith("M10") and (not uploaded_fixed_image or ',' in uploaded_fixed_image):
+            self.warn("模式错误", "M10 模式要求在'单个请求参数'中选择一个固定的图片 (且上传成功)。")
+            n_img_effective = 0
+        elif final_mode.startswith("M11") and (not uploaded_fixed_image or len(uploaded_fixed_image.split(',')) != 2):
+            self.warn("模式错误", "M11 模式要求在'单个请求参数'的图片栏中填入两个固定的图片文件名，并用逗号分隔 (且全部上传成功)。")
+            n_img_effective = 0
+        elif final_mode.startswith("M5") and (N_img == 0 or N_prompt == 0):
+            self.warn("警告", "笛卡尔积模式要求同时选中多个图片和多个提示词。")
+            plan['single'] = True
+
+        num_payloads = 1 if plan['single'] else count_mode_payloads(final_mode, n_img_effective, N_vid, N_prompt)
+        if num_payloads == 0:
+             plan['single'] = True
+             num_payloads = 1
+             final_mode = "M0: 默认单请求模式 (兜底)"
+        plan['mode'] = final_mode
+
+        self._payload_plan = plan
+        self.payload_count = num_payloads
+        self.log(f"成功生成 {num_payloads} 个 API 请求负载。模式: {final_mode}", level='SUCCESS')
+        self._log_payload_sample()
+
+        return recommended_mode, final_mode
+
+    def iter_request_payloads(self, plan=None):
+        """Yields the planned payloads (or those of the given plan) one at a time; call again for a fresh pass."""
+        plan = plan if plan is not None else self._payload_plan
+        if not plan:
+            return
+        if plan['single']:
+            yield self._create_single_payload()
+            return
+
+        mode, base_nodes = plan['mode'], plan['base_nodes']
+        text_id, image_id, video_id = plan['text_id'], plan['image_id'], plan['video_id']
+        images, videos, prompts = plan['images'], plan['videos'], plan['prompts']
+        prompt_default, image_default, video_default = plan['prompt_default'], plan['image_default'], plan['video_default']
+
+        if mode.startswith(("M0", "M3", "M6")):
+            items = prompts if len(prompts) > 1 else [prompt_default]
+            if mode.startswith("M0"): items = itertools.islice(items, 1)
+            img_val = images[0] if len(images) == 1 else image_default
+            for prompt in items:
+                 yield self._create_payload(base_nodes, text_id, prompt, image_id, img_val, video_id, video_default)
+
+        elif mode.startswith(("M1", "M4", "M7", "M8", "M10", "M11")):
+            if mode.startswith("M4"):
+                 for img, prompt in zip(images, prompts):
+                    yield self._create_payload(base_nodes, text_id, prompt, image_id, img, video_id, video_default)
+            elif "M7" in mode:
+                window_size, step_size = (2, 1) if "M7a" in mode else (3, 2)
+                i = 0
+                while i + window_size <= len(images):
+                    image_value = ",".join(images[i : i + window_size])
+                    yield self._create_payload(base_nodes, text_id, prompt_default, image_id, image_value, video_id, video_default)
+                    i += step_size
+            elif mode.startswith("M8"):
+                for img in images:
+                    yield self._create_payload(base_nodes, text_id, None, image_id, img, video_id, None)
+            elif mode.startswith(("M10", "M11")):
+                for img in images:
+                    combined_images = f"{image_default},{img}"
+                    yield self._create_payload(base_nodes, text_id, prompt_default, image_id, combined_images, video_id, video_default)
+            else: # M1
+                for img in images:
+                    yield self._create_payload(base_nodes, text_id, prompt_default, image_id, img, video_id, video_default)
+
+        elif mode.startswith(("M2", "M9")):
+             if mode.startswith("M9"):
+                 for vid in videos:
+                     yield self._create_payload(base_nodes, text_id, None, image_id, None, video_id, vid)
+             else:
+                for vid in videos:
+                    yield self._create_payload(base_nodes, text_id, prompt_default, image_id, image_default, video_id, vid)
+        elif mode.startswith("M5"):
+             # Prompt-major order (every image for prompt 1, then prompt 2, ...): the prompt
+             # source is streamed once per pass instead of once per image
+             for prompt in prompts:
+                 for img in images:
+                     yield self._create_payload(base_nodes, text_id, prompt, image_id, img, video_id, video_default)
+
+    def _log_payload_sample(self):
+        """Logs the first payload_log_limit payloads as JSON (negative = all of them)."""
+        limit = int(self.settings.payload_log_limit)
+        if limit == 0 or not self.payload_count:
+            return
+        shown = self.payload_count if limit < 0 else min(limit, self.payload_count)
+        self.log("--- 生成的请求负载 (JSON) ---", level='INFO')
+        for i, payload in enumerate(itertools.islice(self.iter_request_payloads(), shown)):
+            payload_str = json.dumps(payload, indent=2, ensure_ascii=False)
+            self.log(f"--- 负载 #{i+1} ---\n{payload_str}", level='INFO')
+        if shown < self.payload_count:
+            self.log(f"... 其余 {self.payload_count - shown} 个负载未记录 (负载日志样本数={limit})", level='INFO')
+        self.log("--- 请求负载日志结束 ---", level='INFO')
+
+    # --- 上传 ---
+
+    def _get_http_session(self):
+        """
+        Returns the shared keep-alive session used for uploads and task requests.
+        The connection pool is sized to the larger of the upload and task concurrency,
+        and the session is rebuilt if those settings grow between runs.
+        """
+        pool_size = max(int(self.settings.upload_concurrency), int(self.settings.max_concurrent_tasks), 1)
+
+        with self._http_session_lock:
+            if self.http_session is None or self._http_session_pool_size < pool_size:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.http_session = session
+                self._http_session_pool_size = pool_size
+            return self.http_session
+
+    def _get_upload_cache(self):
+        """Returns the persistent upload cache, or None when it is disabled (TTL 0)."""
+        ttl_hours = int(self.settings.upload_cache_ttl_hours)
+        if ttl_hours <= 0:
+            return None
+        if self.upload_cache is None:
+            self.upload_cache = UploadCache()
+        self.upload_cache.ttl_seconds = ttl_hours * 3600
+        return self.upload_cache
+
+    def _get_result_cache(self):
+        """Returns the persistent result cache, or None when it is disabled (TTL 0)."""
+        ttl_hours = float(self.settings.result_cache_ttl_hours)
+        if ttl_hours <= 0:
+            return None
+        if self.result_cache is None:
+            self.result_cache = ResultCache()
+        self.result_cache.ttl_seconds = ttl_hours * 3600
+        return self.result_cache
+
+    def _get_rate_limits(self):
+        """Returns the shared rate limiters, reconfigured from the current settings."""
+        s = self.settings
+        if self.rate_limits is None:
+            self.rate_limits = RateLimits(s.create_rate, s.upload_rate, s.poll_rate)
+        else:
+            self.rate_limits.configure(s.create_rate, s.upload_rate, s.poll_rate)
+        return self.rate_limits
+
+    def _upload_files_parallel(self, local_filenames):
+        """
+        Uploads the given files concurrently over the shared session.
+        Returns a dict mapping each local filename to its server fileName (None on failure).
+        Duplicate names are uploaded once.
+        """
+        unique_names = list(dict.fromkeys(f for f in local_filenames if f))
+        if not unique_names:
+            return {}
+
+        concurrency = max(1, int(self.settings.upload_concurrency))
+
+        cache = self._get_upload_cache()
+        if cache:
+            cache.reset_stats()
+
+        results = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(unique_names)), thread_name_prefix="upload") as executor:
+            future_to_name = {executor.submit(self._upload_file_and_get_url, name): name for name in unique_names}
+            for future in as_completed(future_to_name):
+                results[future_to_name[future]] = future.result()
+
+        failed = sum(1 for name in unique_names if not results.get(name))
+        self.log(f"并行上传完成: 成功 {len(unique_names) - failed}/{len(unique_names)} (并发 {concurrency}, "
+                 f"耗时 {time.monotonic() - started:.1f}s)",
+                 level='INFO' if not failed else 'WARNING')
+        if cache:
+            self.log(cache.stats_summary(), level='INFO')
+            try:
+                cache.save()
+            except OSError as e:
+                self.log(f"上传缓存写入失败: {e}", level='WARNING')
+        return results
+
+    def _start_preprocessing(self, local_filenames, reset=True):
+        """
+        Starts the optional image preprocessing stage on a process pool. Uploads pick up each
+        file's result through _upload_source(), so they overlap with the remaining processing.
+        reset=False keeps the results of earlier calls (watch mode adds files to a running batch).
+        With shared_preprocessed set (multi-config batches) files already started by another
+        core are reused instead of being processed again.
+        """
+        if reset:
+            self._preprocessed = {}
+        s = self.settings
+        if int(s.preprocess_max_edge) <= 0 and s.preprocess_format == 'keep':
+            return
+        if not preprocess.is_available():
+            self.log("图片预处理需要 Pillow (pip install pillow)，本次直接上传原图。", level='WARNING')
+            return
+        names = [f for f in dict.fromkeys(local_filenames) if f and f.lower().endswith(IMAGE_EXTENSIONS)
+                 and os.path.exists(os.path.join(self.current_directory, f))]
+        shared = self.shared_preprocessed
+        if shared is not None:
+            self._preprocessed.update({name: shared[name] for name in names if name in shared})
+            names = [name for name in names if name not in shared]
+        if not names:
+            return
+        try:
+            preprocessor = preprocess.ImagePreprocessor(s.preprocess_max_edge, s.preprocess_format, s.preprocess_quality,
+                                                        s.preprocess_strip_exif, s.preprocess_workers)
+            futures = preprocessor.start([os.path.join(self.current_directory, f) for f in names])
+        except (OSError, ValueError, RuntimeError) as e:
+            self.log(f"图片预处理启动失败, 直接上传原图: {e}", level='WARNING')
+            return
+        started = {name: futures[os.path.join(self.current_directory, name)] for name in names}
+        self._preprocessed.update(started)
+        if shared is not None:
+            shared.update(started)
+        self.log(f"开始图片预处理 ({preprocessor.describe()}, {preprocessor.workers} 进程)...", level='INFO')
+        threading.Thread(target=lambda: self.log(preprocessor.summary(), level='INFO'),
+                         name="preprocess-report", daemon=True).start()
+
+    def _upload_source(self, local_filename, filepath):
+        """Returns (path, upload filename) to upload for a local file, waiting for its preprocessing if any."""
+        future = self._preprocessed.get(local_filename)
+        if future is None:
+            return filepath, local_filename
+        try:
+            out_path = future.result()[0]
+        except Exception as e:
+            self.log(f"预处理 {local_filename} 失败, 将上传原图: {e}", level='WARNING')
+            return filepath, local_filename
+        if out_path == filepath:
+            return filepath, local_filename
+        return out_path, os.path.splitext(local_filename)[0] + os.path.splitext(out_path)[1]
+
+    def _start_pipelined_uploads(self, local_filenames):
+        """
+        Starts uploading the batch files in order on a background pool and records a future
+        per local name in _pending_uploads. Payloads resolve their inputs through
+        _resolve_payload_inputs(), so the first task can start right after its own upload.
+        """
+        unique_names = list(dict.fromkeys(f for f in local_filenames if f))
+        if not unique_names:
+            return
+        cache = self._get_upload_cache()
+        if cache:
+            cache.reset_stats()
+
+        def remember(local_name, future):
+            server_name = future.result()
+            if server_name:
+                self._source_names[server_name] = local_name
+
+        executor = ThreadPoolExecutor(max_workers=max(1, int(self.settings.upload_concurrency)), thread_name_prefix="upload")
+        for name in unique_names:
+            future = executor.submit(self._upload_file_and_get_url, name)
+            future.add_done_callback(lambda f, name=name: remember(name, f))
+            self._pending_uploads[name] = future
+        executor.shutdown(wait=False)
+
+        def report(futures):
+            wait(futures)
+            failed = sum(1 for f in futures if not f.result())
+            self.log(f"后台上传完成: 成功 {len(futures) - failed}/{len(futures)} (耗时 {time.monotonic() - started:.1f}s)",
+                     level='INFO' if not failed else 'WARNING')
+            if cache:
+                self.log(cache.stats_summary(), level='INFO')
+                try:
+                    cache.save()
+                except OSError as e:
+                    self.log(f"上传缓存写入失败: {e}", level='WARNING')
+
+        started = time.monotonic()
+        threading.Thread(target=report, args=(list(self._pending_uploads.values()),),
+                         name="upload-report", daemon=True).start()
+
+    def _resolve_payload_inputs(self, payload, batch_id):
+        """
+        Replaces local file names in a pipelined payload's image/video nodes with their server
+        names, waiting only for those uploads. Returns None if any of them failed.
+        """
+        pending = self._pending_uploads
+        if not pending:
+            return payload
+        nodes = payload['nodeInfoList']
+        for i, node in enumerate(nodes):
+            if node.get('fieldName') not in ('image', 'video') or not node.get('fieldValue'):
+                continue
+            parts = [part.strip() for part in str(node['fieldValue']).split(',')]
+            if not any(part in pending for part in parts):
+                continue
+            resolved = [pending[part].result() if part in pending else part for part in parts]
+            if not all(resolved):
+                failed = [part for part, server in zip(parts, resolved) if not server]
+                self.log(f"批次 {batch_id}: 输入文件上传失败 ({', '.join(failed)}), 跳过该负载。", level='ERROR')
+                return None
+            nodes[i] = dict(node, fieldValue=",".join(resolved))
+        return payload
+
+    def _upload_file_and_get_url(self, local_filename, slot=None):
+        """
+        Uploads a single file and returns the server-side filename/URL. With a key-pool slot
+        the file is uploaded under that key, using its upload rate limiter. With
+        shared_uploads set (multi-config batches) each file is uploaded once per account and
+        preprocessing setting, and every config of the batch reuses that upload.
+        """
+        if self.shared_uploads is None or not local_filename:
+            return self._upload_file(local_filename, slot)
+        s = self.settings
+        key = (slot.key if slot else self.API_DATA['apiKey'], os.path.join(self.current_directory, local_filename),
+               s.preprocess_max_edge, s.preprocess_format, s.preprocess_quality, bool(s.preprocess_strip_exif))
+        return self.shared_uploads.get_or_upload(key, lambda: self._upload_file(local_filename, slot))
+
+    def _upload_file(self, local_filename, slot=None):
+        if not local_filename:
+            return None
+
+        filepath = os.path.join(self.current_directory, local_filename)
+        if not os.path.exists(filepath):
+            self.log(f"Upload Error: File not found at {filepath}", level='ERROR')
+            return None
+
+        file_type = 'video' if local_filename.lower().endswith(VIDEO_EXTENSIONS) else 'image'
+        upload_url = UPLOAD_URL
+        filepath, upload_name = self._upload_source(local_filename, filepath)
+
+        api_key = slot.key if slot else self.API_DATA['apiKey']
+        limits = slot.rate_limits if slot else self._get_rate_limits()
+        key_note = f" [Key {slot.label}]" if slot else ""
+        cache = self._get_upload_cache()
+        cache_key, file_size = None, 0
+        webapp_id = self.API_DATA.get('webappId')
+        if cache:
+            try:
+                file_size = os.path.getsize(filepath)
+                cache_key = cache.make_key(api_key, file_type, cache.content_hash(filepath))
+                cached_filename = cache.get(cache_key, file_size)
+                if cached_filename:
+                    self.metrics.inc('upload_cache_hits', webapp_id)
+                    self.log(f"Upload cache hit: {local_filename} -> {cached_filename}", level='SUCCESS')
+                    return cached_filename
+            except OSError as e:
+                self.log(f"上传缓存读取 {local_filename} 失败, 将直接上传: {e}", level='WARNING')
+
+        payload = {
+            'apiKey': api_key,
+            'fileType': file_type
+        }
+
+        body = None
+        sent_at = None
+        try:
+            # Streamed in chunks with a deadline that scales with the file size
+            file_size = os.path.getsize(filepath)
+            connect_timeout = int(self.settings.upload_timeout)
+            budget = upload_time_budget(file_size, connect_timeout)
+            body = StreamingMultipartBody(payload, 'file', upload_name, filepath,
+                                          progress=self._upload_progress_reporter(local_filename, file_size))
+            self.log(f"Uploading {file_type}: {local_filename} ({file_size / 1024 / 1024:.1f} MB){key_note}...", level='INFO')
+
+            time.sleep(limits.upload.reserve())
+            sent_at = time.monotonic()
+            body.deadline = sent_at + budget
+            response = self._get_http_session().post(upload_url, data=body, headers={'Content-Type': body.content_type},
+                                                     timeout=(connect_timeout, budget))
+            response.raise_for_status()
+            response_data = response.json()
+
+            if response_data.get('code') == 0 and response_data.get('data', {}).get('fileName'):
+                server_filename = response_data['data']['fileName']
+                self.metrics.inc('upload_bytes', webapp_id, file_size)
+                if cache_key:
+                    cache.put(cache_key, server_filename, file_size)
+                self.log(f"Upload successful: {local_filename} -> {server_filename}{key_note}", level='SUCCESS')
+                return server_filename
+            else:
+                error_msg = response_data.get('msg', 'Unknown upload error')
+                self.log(f"Upload failed for {local_filename}: {error_msg}", level='ERROR')
+                return None
+        except requests.exceptions.RequestException as e:
+            self.log(f"Upload failed for {local_filename} with network error: {e}", level='ERROR')
+            return None
+        except Exception as e:
+            self.log(f"An unexpected error occurred during upload of {local_filename}: {e}", level='ERROR')
+            return None
+        finally:
+            if body is not None:
+                body.close()
+            if sent_at is not None:
+                self.metrics.observe('upload', webapp_id, time.monotonic() - sent_at)
+                self.metrics.inc('uploads', webapp_id)
+
+    def _upload_progress_reporter(self, local_filename, file_size):
+        """Progress callback for large uploads that logs every 10%; None for small files."""
+        if file_size < UPLOAD_PROGRESS_MIN_BYTES:
+            return None
+        state = {'next_step': 10, 'start': time.monotonic()}
+
+        def report(bytes_sent, total):
+            percent = bytes_sent * 100 // total
+            if percent < state['next_step']:
+                return
+            state['next_step'] = percent // 10 * 10 + 10
+            speed = bytes_sent / max(time.monotonic() - state['start'], 1e-6) / 1024 / 1024
+            self.log(f"Uploading {local_filename}: {percent}% ({bytes_sent / 1024 / 1024:.0f}/{total / 1024 / 1024:.0f} MB, "
+                     f"{speed:.1f} MB/s)", level='INFO')
+
+        return report
+
+    # --- 任务执行 ---
+
+    def _handle_single_task(self, payload, batch_id, task_id=None, slot=None, journal_payload=None):
+        """
+        Handles the complete lifecycle of a single task: create, poll for status, and get results.
+        With task_id given (resuming from the run journal) creation is skipped and polling
+        re-attaches to that task. Returns True if successful, False otherwise.
+        With a key-pool slot the task uses that key's rate limiters, and a queue-full or quota
+        rejection returns REJECT_QUEUE_FULL / REJECT_QUOTA at once so the caller can move the
+        payload to another key. journal_payload is what the run journal records (default payload).
+        """
+        api_url = self.API_DATA['url']
+        api_key = payload.get('apiKey') or self.API_DATA['apiKey']
+        journal_payload = journal_payload or payload
+
+        connect_timeout = int(self.settings.upload_timeout)
+        task_timeout = int(self.settings.task_timeout)
+        if self.polling_policy is None:
+            self.polling_policy = AdaptivePollingPolicy(base_interval=int(self.settings.task_polling_interval),
+                                                        adaptive=bool(self.settings.adaptive_polling))
+        policy = self.polling_policy
+        limits = slot.rate_limits if slot else self._get_rate_limits()
+        metrics = self.metrics
+        webapp_id = payload.get('webappId')
+
+        try:
+            # 1. Create the task (or re-attach to one created by an interrupted run)
+            if task_id:
+                self.log(f"批次 {batch_id}: 重新接管未完成的任务, Task ID: {task_id}", level='INFO')
+            else:
+                self.log(f"批次 {batch_id}: 正在创建任务...", level='INFO')
+                throttled_wait = 0.0
+                while True:
+                    time.sleep(limits.create.reserve())
+                    sent_at = time.monotonic()
+                    try:
+                        create_response = self._get_http_session().post(api_url, headers=self.BASE_HEADERS, json=payload, timeout=connect_timeout)
+                        create_response.raise_for_status()
+                        create_data = create_response.json()
+                    finally:
+                        metrics.observe('create', webapp_id, time.monotonic() - sent_at)
+                    if slot is not None:
+                        rejection = classify_rejection(create_data)
+                        if rejection:
+                            metrics.inc(rejection, webapp_id)
+                            self.log(f"批次 {batch_id}: Key {slot.label} 拒绝创建任务 ({create_data.get('msg', create_data.get('code'))})", level='WARNING')
+                            return rejection
+                    # Queue full / concurrency limit: back off and resubmit without using up a retry attempt
+                    if not is_queue_full(create_data) or throttled_wait >= task_timeout:
+                        break
+                    metrics.inc('queue_full', webapp_id)
+                    cooldown = limits.create.throttled()
+                    throttled_wait += cooldown
+                    self.log(f"批次 {batch_id}: 平台队列已满 ({create_data.get('msg', create_data.get('code'))}), "
+                             f"当前创建速率 {limits.create.describe()}, {cooldown:.0f}s 后重新提交 (不计入重试次数)", level='WARNING')
+
+                if create_data.get('code') != 0 or 'data' not in create_data or 'taskId' not in create_data['data']:
+                    error_msg = create_data.get('msg', '创建任务时返回了未知错误')
+                    metrics.inc('create_errors', webapp_id)
+                    self.log(f"批次 {batch_id}: 创建任务失败: {error_msg}", level='ERROR')
+                    return False
+
+                task_id = create_data['data']['taskId']
+                limits.create.succeeded()
+                self._task_event(batch_id, journal_payload, STATE_CREATED, task_id=task_id)
+                self.log(f"批次 {batch_id}: 任务创建成功, Task ID: {task_id}", level='INFO')
+
+            # 2. Poll for task completion by checking the outputs endpoint
+            start_time = time.time()
+            last_poll_at = time.monotonic()
+            outputs_url = OUTPUTS_URL
+            schedule = policy.schedule(payload.get('webappId'), task_timeout)
+
+            while True:
+                elapsed = time.time() - start_time
+                if elapsed > task_timeout:
+                    policy.record_finished(payload.get('webappId'), schedule)
+                    self.log(f"批次 {batch_id}: 任务超时 ({task_timeout}s, 已查询 {schedule.polls} 次)", level='ERROR')
+                    return False
+
+                time.sleep(schedule.next_delay(elapsed))
+                time.sleep(limits.poll.reserve())
+
+                self.log(f"批次 {batch_id}: 正在查询任务结果 (Task ID: {task_id}, 第 {schedule.polls} 次)...", level='INFO')
+                outputs_payload = {"apiKey": api_key, "taskId": task_id}
+
+                sent_at = time.monotonic()
+                try:
+                    outputs_response = self._get_http_session().post(outputs_url, headers=self.BASE_HEADERS, json=outputs_payload, timeout=connect_timeout)
+                    outputs_response.raise_for_status()
+                    outputs_data = outputs_response.json()
+                except requests.exceptions.RequestException as poll_e:
+                    metrics.inc('poll_errors', webapp_id)
+                    self.log(f"批次 {batch_id}: 查询结果时网络错误: {poll_e}, 将在稍后重试查询。", level='WARNING')
+                    continue
+                finally:
+                    metrics.observe('poll', webapp_id, time.monotonic() - sent_at)
+
+                if outputs_data.get('code') == 0:
+                    duration = time.time() - start_time
+                    # The result may have been ready at any point since the previous poll
+                    metrics.observe('task', webapp_id, duration)
+                    metrics.observe('result_lag', webapp_id, sent_at - last_poll_at)
+                    if isinstance(outputs_data.get('data'), list) and outputs_data['data']:
+                        policy.record_finished(payload.get('webappId'), schedule, duration)
+                        file_urls = [result.get('fileUrl', 'N/A') for result in outputs_data['data']]
+                        self._task_event(batch_id, journal_payload, STATE_SUCCEEDED, task_id=task_id, file_urls=file_urls)
+                        self.log(f"批次 {batch_id}: 任务成功完成! (耗时 {duration:.0f}s, 查询 {schedule.polls} 次)", level='SUCCESS')
+                        for i, file_url in enumerate(file_urls):
+                            self.log(f"  结果 {i+1}: {file_url}", level='SUCCESS')
+                        return True
+                    else:
+                        policy.record_finished(payload.get('webappId'), schedule)
+                        error_msg = outputs_data.get('msg', '任务完成但未返回任何结果或已失败。')
+                        self.log(f"批次 {batch_id}: {error_msg} (查询 {schedule.polls} 次)", level='ERROR')
+                        return False
+                else:
+                    last_poll_at = sent_at
+                    status_msg = outputs_data.get('msg', '任务仍在处理中...')
+                    self.log(f"批次 {batch_id}: {status_msg}", level='INFO')
+
+        except requests.exceptions.RequestException as e:
+            self.log(f"批次 {batch_id}: 初始网络请求失败: {e}", level='ERROR')
+            return False
+        except Exception as e:
+            log_error_report(f"未知错误在 _handle_single_task: {e}", self.API_DATA)
+            self.log(f"批次 {batch_id}: 处理时发生未知错误: {e}", level='ERROR')
+            return False
+
+    def _run_payload_with_retries(self, payload, batch_id, total, max_retries, retry_interval, success_delay):
+        """
+        Runs one payload through _handle_single_task with the configured retry policy.
+        When resuming, payloads already finished are skipped and the first attempt
+        re-attaches to a task left unfinished. Pipelined payloads first wait for their own
+        uploads. Executed inside a worker thread; returns (batch_id, success).
+        """
+        payload = self._resolve_payload_inputs(payload, batch_id)
+        if payload is None:
+            return batch_id, False
+
+        state, resume_task_id, file_urls = self._resume_lookup(payload)
+        if state == STATE_SUCCEEDED:
+            self._task_event(batch_id, payload, STATE_SUCCEEDED, task_id=resume_task_id, file_urls=file_urls)
+            self.log(f"批次 {batch_id}: 已在之前的运行中完成, 跳过。", level='SUCCESS')
+            for i, file_url in enumerate(file_urls):
+                self.log(f"  结果 {i+1}: {file_url}", level='SUCCESS')
+            return batch_id, True
+
+        if resume_task_id and self.key_pool:
+            self.log(f"批次 {batch_id}: 多 API Key 模式无法确定未完成任务 {resume_task_id} 所属的 Key, 将重新提交。", level='WARNING')
+            resume_task_id = None
+
+        for attempt in range(max_retries + 1):
+            self.log(f"批次 {batch_id}/{total}: 开始第 {attempt + 1}/{max_retries + 1} 次尝试...", level='INFO')
+
+            task_id, resume_task_id = resume_task_id, None
+            if self.key_pool:
+                ok = self._run_on_key_pool(payload, batch_id)
+            else:
+                ok = self._handle_single_task(payload, batch_id, task_id=task_id)
+            if ok:
+                if success_delay > 0 and batch_id != total:
+                    self.log(f"批次 {batch_id}: 等待 {success_delay} 秒后释放并发槽位...", level='INFO')
+                    time.sleep(success_delay)
+                return batch_id, True
+
+            if attempt < max_retries:
+                self.metrics.inc('retries', payload.get('webappId'))
+                self.log(f"批次 {batch_id} 任务失败，将在 {retry_interval} 秒后重试。", level='WARNING')
+                time.sleep(retry_interval)
+
+        self._task_event(batch_id, payload, STATE_FAILED)
+        msg = log_error_report(f"执行批次 {batch_id} 失败，已达到最大重试次数 ({max_retries} 次)。", self.API_DATA)
+        self.log(msg, level='ERROR')
+        return batch_id, False
+
+    # --- 多 API Key 调度 ---
+
+    def _open_key_pool(self, default_concurrency):
+        """Builds the key pool for a multi-key run; returns the total concurrency it allows."""
+        s = self.settings
+        self.key_pool = ApiKeyPool(self.api_key_specs, default_concurrency=default_concurrency,
+                                   create_rate=s.create_rate, upload_rate=s.upload_rate, poll_rate=s.poll_rate)
+        self._key_uploads = {}
+        self._key_upload_executor = ThreadPoolExecutor(max_workers=max(1, int(s.upload_concurrency)),
+                                                       thread_name_prefix="key-upload")
+        self.log(f"多 API Key 调度: {len(self.key_pool.slots)} 个 Key, 合计并发 {self.key_pool.capacity}: "
+                 f"{self.key_pool.describe()}", level='INFO')
+        return self.key_pool.capacity
+
+    def _close_key_pool(self):
+        if not self.key_pool:
+            return
+        self._key_upload_executor.shutdown(wait=True)
+        self.log("各 API Key 吞吐:\n" + "\n".join(self.key_pool.summary_lines()), level='INFO')
+        cache = self._get_upload_cache()
+        if cache:
+            try:
+                cache.save()
+            except OSError as e:
+                self.log(f"上传缓存写入失败: {e}", level='WARNING')
+        self.key_pool = None
+        self._key_upload_executor = None
+
+    def _upload_for_key(self, slot, local_filename):
+        """Server name of local_filename uploaded under slot's key; each file is uploaded once per key."""
+        with self._key_upload_lock:
+            future = self._key_uploads.get((slot.key, local_filename))
+            if future is None:
+                future = self._key_upload_executor.submit(self._upload_file_and_get_url, local_filename, slot)
+                self._key_uploads[(slot.key, local_filename)] = future
+        return future.result()
+
+    def _payload_for_key(self, payload, batch_id, slot):
+        """
+        Copy of payload bound to slot's API key, with local input files replaced by their
+        uploads under that key. Returns None if one of those uploads failed.
+        """
+        nodes = []
+        for node in payload['nodeInfoList']:
+            if node.get('fieldName') in ('image', 'video') and node.get('fieldValue'):
+                parts = [part.strip() for part in str(node['fieldValue']).split(',')]
+                if any(part in self._key_inputs for part in parts):
+                    resolved = [self._upload_for_key(slot, part) if part in self._key_inputs else part for part in parts]
+                    if not all(resolved):
+                        failed = [part for part, server in zip(parts, resolved) if not server]
+                        self.log(f"批次 {batch_id}: 输入文件在 Key {slot.label} 下上传失败 ({', '.join(failed)})。", level='ERROR')
+                        return None
+                    node = dict(node, fieldValue=",".join(resolved))
+            nodes.append(node)
+        return dict(payload, apiKey=slot.key, nodeInfoList=nodes)
+
+    def _input_digest(self, local_filename):
+        """Content digest of a local input file (memoised by size/mtime); 'missing:<name>' if unreadable."""
+        path = os.path.join(self.current_directory, local_filename)
+        try:
+            st = os.stat(path)
+            known = self._input_digests.get(path)
+            if known and known[:2] == (st.st_size, st.st_mtime_ns):
+                return known[2]
+            cache = self._get_upload_cache()
+            digest = f"sha256:{cache.content_hash(path) if cache else file_sha256(path)}"
+        except OSError:
+            return f"missing:{local_filename}"
+        self._input_digests[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def _payload_key(self, payload):
+        """
+        Run journal / result cache key of a payload (run_journal.payload_hash). Multi-key
+        payloads still name local files at this point, since uploads happen once a key is
+        assigned, so those inputs are replaced by their content digest first: a file edited
+        under the same name must not match the outputs recorded for its old content.
+        """
+        if not self._key_inputs:
+            return payload_hash(payload)
+        nodes = []
+        for node in payload['nodeInfoList']:
+            if node.get('fieldName') in ('image', 'video') and node.get('fieldValue'):
+                parts = [part.strip() for part in str(node['fieldValue']).split(',')]
+                if any(part in self._key_inputs for part in parts):
+                    node = dict(node, fieldValue=",".join(
+                        self._input_digest(part) if part in self._key_inputs else part for part in parts))
+            nodes.append(node)
+        return payload_hash(dict(payload, nodeInfoList=nodes))
+
+    def _run_on_key_pool(self, payload, batch_id):
+        """
+        One attempt of a payload on the key pool: takes the least-loaded free key, binds the
+        payload to it and runs the task. A key that rejects the create (queue full / no
+        quota) is paused or disabled and the payload moves to another key without using up
+        the attempt, for at most task_timeout seconds. Returns True/False.
+        """
+        pool = self.key_pool
+        deadline = time.monotonic() + int(self.settings.task_timeout)
+        while True:
+            slot = pool.acquire()
+            if slot is None:
+                self.log(f"批次 {batch_id}: 所有 API Key 均已停用, 无法提交。", level='ERROR')
+                return False
+            outcome = None
+            try:
+                keyed_payload = self._payload_for_key(payload, batch_id, slot)
+                if keyed_payload is not None:
+                    outcome = self._handle_single_task(keyed_payload, batch_id, slot=slot, journal_payload=payload)
+            finally:
+                cooldown = pool.release(slot, outcome)
+            if outcome == REJECT_QUOTA:
+                self.log(f"Key {slot.label} 额度不足或不可用, 本次运行停用该 Key; 批次 {batch_id} 改派其他 Key。", level='ERROR')
+            elif outcome == REJECT_QUEUE_FULL:
+                self.log(f"Key {slot.label} 队列已满, 暂停 {cooldown:.0f}s 并降低并发上限; 批次 {batch_id} 改派其他 Key。", level='WARNING')
+            else:
+                return bool(outcome)
+            if time.monotonic() > deadline:
+                self.log(f"批次 {batch_id}: 所有 Key 持续拒绝超过 {self.settings.task_timeout}s, 本次尝试失败。", level='ERROR')
+                return False
+
+    # --- 运行日志 (续跑) ---
+
+    def _open_journal(self, resume):
+        """Opens the run journal for this run; on failure the run goes ahead without one."""
+        self._resume_index = {}
+        try:
+            self.journal = RunJournal()
+            if resume:
+                self._resume_index = self.journal.load_resume_index(self.API_DATA['webappId'])
+        except sqlite3.Error as e:
+            self.log(f"运行日志库打开失败, 本次运行不记录进度: {e}", level='WARNING')
+            self.journal = None
+            return
+        if resume:
+            done = sum(1 for state, _, _ in self._resume_index.values() if state == STATE_SUCCEEDED)
+            self.log(f"续跑: 运行日志中有 {done} 个已完成负载, {len(self._resume_index) - done} 个未完成任务可重新接管。", level='INFO')
+        self._run_id = self.journal.start_run(self.API_DATA['webappId'], (self._payload_plan or {}).get('mode'), self.payload_count)
+
+    def _close_journal(self):
+        if self.journal:
+            self.journal.close()
+        self.journal = None
+        self._resume_index = {}
+
+    def _task_event(self, batch_id, payload, state, task_id=None, file_urls=None):
+        """
+        Journals and counts a task state change. Successful outputs are also queued for
+        download and remembered in the result cache, with the time since creation.
+        """
+        self.metrics.inc(f'tasks_{state}', payload.get('webappId'))
+        key = self._payload_key(payload)
+        if state == STATE_CREATED:
+            self._created_at[batch_id] = time.monotonic()
+        elif state == STATE_SUCCEEDED and file_urls and self.result_cache is not None:
+            created_at = self._created_at.pop(batch_id, None)
+            self.result_cache.put(key, file_urls, task_id=task_id,
+                                  task_seconds=time.monotonic() - created_at if created_at is not None else None)
+        if self.journal:
+            self.journal.record(self._run_id, batch_id, payload.get('webappId'), key, state,
+                                task_id=task_id, file_urls=file_urls)
+        if state == STATE_SUCCEEDED and self.downloader and file_urls:
+            self.downloader.submit(batch_id, self._payload_source(payload), file_urls)
+
+    # --- 结果下载 ---
+
+    def _payload_source(self, payload):
+        """Local name(s) of the image/video assets a payload was built from, used to name its outputs."""
+        names = []
+        for node in payload.get('nodeInfoList', []):
+            if node.get('fieldName') in ('image', 'video') and node.get('fieldValue'):
+                for part in str(node['fieldValue']).split(','):
+                    names.append(os.path.splitext(self._source_names.get(part.strip(), os.path.basename(part.strip())))[0])
+        return '+'.join(names)
+
+    def _open_downloader(self):
+        s = self.settings
+        if not s.download_results:
+            self.downloader = None
+            return
+        output_dir = os.path.join(self.current_directory, s.download_dir)
+        self.downloader = ResultDownloader(output_dir, concurrency=int(s.download_concurrency),
+                                           connect_timeout=int(s.upload_timeout), log=self.log,
+                                           metrics=self.metrics, webapp_id=self.API_DATA.get('webappId'))
+        self.log(f"任务成功后将自动下载结果到: {output_dir} (并发 {self.downloader.concurrency})", level='INFO')
+
+    def _close_downloader(self):
+        if not self.downloader:
+            return
+        self.log("等待剩余结果下载完成...", level='INFO')
+        self.downloader.close()
+        self.log(self.downloader.summary(), level='SUCCESS' if not self.downloader.failed else 'WARNING')
+        self.downloader = None
+
+    # --- 结果缓存 ---
+
+    def _close_result_cache(self):
+        cache = self.result_cache
+        if cache is None:
+            return
+        if cache.hits and not self.batch_cache_stats:
+            self.log(cache.stats_summary(), level='SUCCESS')
+        try:
+            cache.save()
+        except OSError as e:
+            self.log(f"结果缓存写入失败: {e}", level='WARNING')
+
+    # --- 运行指标 ---
+
+    def _start_metrics_export(self):
+        """Starts the periodic JSON/Prometheus export of self.metrics; returns the exporter or None."""
+        interval = float(self.settings.metrics_interval)
+        if interval <= 0:
+            return None
+        exporter = MetricsExporter(self.metrics, self.current_directory, interval=interval, log=self.log)
+        exporter.start()
+        self.log(f"运行指标每 {interval:.0f}s 导出到 {exporter.json_path} / {exporter.prom_path}", level='INFO')
+        return exporter
+
+    def _log_metrics_summary(self, exporter):
+        if exporter:
+            exporter.stop()
+        lines = self.metrics.summary_lines()
+        if lines:
+            self.log("--- 各阶段耗时统计 ---\n" + "\n".join(lines), level='INFO')
+
+    def _resume_lookup(self, payload):
+        """
+        Returns (state, task_id, file_urls) known for this payload from earlier runs, or Nones:
+        the run journal's record when resuming, and a result cache hit (an identical payload
+        that already succeeded) unless the run forces resubmission. Both engines skip payloads
+        reported as succeeded.
+        """
+        key = self._payload_key(payload)
+        recorded = self._resume_index.get(key, (None, None, [])) if self._resume_index else (None, None, [])
+        if recorded[0] == STATE_SUCCEEDED or not self._reuse_results:
+            return recorded
+        entry = self.result_cache.get(key)
+        if entry is None:
+            return recorded
+        self.metrics.inc('result_cache_hits', payload.get('webappId'))
+        age_hours = (time.time() - entry['completed_at']) / 3600
+        saved = f" (节省约 {entry['task_seconds']:.0f}s 任务时间)" if entry.get('task_seconds') else ""
+        self.log(f"结果缓存命中: 负载与 {age_hours:.1f} 小时前成功的任务 {entry.get('task_id')} 完全相同, "
+                 f"复用其输出, 不再提交{saved}。", level='INFO')
+        return STATE_SUCCEEDED, entry.get('task_id'), entry['file_urls']
+
+    def _run_with_async_engine(self, total, max_retries, retry_interval, success_delay,
+                               max_concurrent, connect_timeout, polling_interval, task_timeout):
+        """
+        Drives AsyncTaskEngine from the current thread. In this mode the max-concurrency
+        setting is the number of outstanding tasks tracked by one event loop.
+        """
+        done = {'count': 0}
+
+        def on_result(batch_id, ok, file_urls):
+            done['count'] += 1
+            if not ok:
+                msg = log_error_report(f"执行批次 {batch_id} 失败，已达到最大重试次数 ({max_retries} 次)。", self.API_DATA)
+                self.log(msg, level='ERROR')
+            self.log(f"批次 {batch_id} {'成功' if ok else '失败'} (已完成 {done['count']}/{total})",
+                     level='SUCCESS' if ok else 'ERROR')
+
+        engine = async_engine.AsyncTaskEngine(
+            self.API_DATA['url'], self.BASE_HEADERS,
+            connect_timeout=connect_timeout, polling_interval=polling_interval, task_timeout=task_timeout,
+            max_in_flight=max_concurrent, max_connections=min(max_concurrent, 100),
+            log=self.log, outputs_url=OUTPUTS_URL, polling_policy=self.polling_policy, rate_limits=self._get_rate_limits(),
+            on_event=self._task_event, resume_lookup=self._resume_lookup,
+            prepare_payload=self._resolve_payload_inputs if self._pending_uploads else None, metrics=self.metrics,
+        )
+        self.log(f"使用 asyncio 引擎执行，最大在途任务数 {max_concurrent}。", level='INFO')
+        return engine.run(self.iter_request_payloads(), total, max_retries=max_retries, retry_interval=retry_interval,
+                          success_delay=success_delay, on_result=on_result)
+
+    def begin_run(self, resume=False):
+        """
+        Logs the settings and opens what a run needs: polling policy, run journal, result
+        downloader, metrics export and, for multi-key payloads, the key pool. Returns the
+        run parameters for run_payload() / end_run(), or None when the run cannot start.
+        """
+        s = self.settings
+        run = {
+            'max_retries': int(s.max_retries),
+            'retry_interval': int(s.retry_interval),
+            'success_delay': int(s.upload_delay_on_success),
+            'polling_interval': int(s.task_polling_interval),
+            'task_timeout': int(s.task_timeout),
+            'connect_timeout': int(s.upload_timeout),
+            'max_concurrent': max(1, int(s.max_concurrent_tasks)),
+        }
+
+        self.log(f"--- 开始执行 {self.payload_count} 个 API 请求 ---", level='INFO')
+        settings_log = (f"设置: 连接超时={run['connect_timeout']}s, 失败重试间隔={run['retry_interval']}s, "
+                        f"最大重试={run['max_retries']}次, 成功间隔={run['success_delay']}s, "
+                        f"任务轮询={run['polling_interval']}s, 任务超时={run['task_timeout']}s, "
+                        f"最大并发={run['max_concurrent']}")
+        self.log(settings_log, level='INFO')
+        self._get_rate_limits().reset_stats()
+        self.log(f"速率限制: {self.rate_limits.describe()}", level='INFO')
+
+        self.polling_policy = AdaptivePollingPolicy(base_interval=run['polling_interval'],
+                                                    adaptive=bool(s.adaptive_polling))
+
+        use_async = bool(s.use_async_engine)
+        if use_async and not async_engine.is_available():
+            self.log("asyncio 引擎需要 aiohttp (pip install aiohttp)，已回退到线程池执行。", level='WARNING')
+            use_async = False
+        multi_key = bool((self._payload_plan or {}).get('key_pool'))
+        if multi_key and not self.api_key_specs:
+            self.log("负载按多 API Key 模式生成, 但当前没有 API Key 列表, 请重新生成负载。", level='ERROR')
+            return None
+        if multi_key and use_async:
+            self.log("多 API Key 调度目前只支持线程池执行, 已切换到线程池。", level='WARNING')
+            use_async = False
+        run['use_async'] = use_async
+
+        self._created_at = {}
+        cache = self.result_cache = self._get_result_cache()
+        self._reuse_results = cache is not None and not s.force_resubmit
+        if cache is not None:
+            if not self.batch_cache_stats:
+                cache.reset_stats()
+            if s.force_resubmit:
+                self.log("强制重新提交: 本次运行忽略结果缓存, 新结果仍会写入缓存。", level='INFO')
+
+        self._open_journal(resume)
+        self._open_downloader()
+        run['exporter'] = self._start_metrics_export()
+        if multi_key:
+            run['max_concurrent'] = self._open_key_pool(run['max_concurrent'])
+        return run
+
+    def _task_result(self, future):
+        """(batch_id, success) of a finished run_payload future; (None, False) if the worker raised."""
+        try:
+            return future.result()
+        except Exception as e:
+            log_error_report(f"未知错误在 _run_payload_with_retries: {e}", self.API_DATA)
+            self.log(f"工作线程发生未知错误: {e}", level='ERROR')
+            return None, False
+
+    def run_payload(self, payload, batch_id, run):
+        """Runs one payload of a run opened with begin_run(); returns (batch_id, success)."""
+        return self._run_payload_with_retries(payload, batch_id, self.payload_count, run['max_retries'],
+                                              run['retry_interval'], run['success_delay'])
+
+    def end_run(self, run, succeeded, failed):
+        """Closes what begin_run() opened and logs the end-of-run summaries."""
+        self._close_key_pool()
+        self._close_journal()
+        self._close_downloader()
+        self._log_metrics_summary(run['exporter'])
+        self._close_result_cache()
+        self.log(self.polling_policy.stats_summary(), level='INFO')
+        self.log(f"当前有效速率: {self.rate_limits.describe()}", level='INFO')
+        try:
+            self.polling_policy.save()
+        except OSError as e:
+            self.log(f"任务耗时记录写入失败: {e}", level='WARNING')
+        self.log(f"--- 所有请求执行完毕: 成功 {succeeded}, 失败 {failed} ---", level='INFO')
+
+    def run_api_requests(self, resume=False):
+        """
+        Executes the planned payloads with the current settings, recording progress in the
+        run journal. With resume=True payloads completed by an earlier run are skipped.
+        Returns (succeeded, failed).
+        """
+        total = self.payload_count
+        run = self.begin_run(resume)
+        if run is None:
+            return 0, total
+        max_concurrent = run['max_concurrent']
+
+        succeeded, failed = 0, 0
+        try:
+            if run['use_async']:
+                succeeded, failed = self._run_with_async_engine(
+                    total, run['max_retries'], run['retry_interval'], run['success_delay'], max_concurrent,
+                    run['connect_timeout'], run['polling_interval'], run['task_timeout'])
+                return succeeded, failed
+
+            # Each worker owns one in-flight task (create + poll + retries), so
+            # max_workers is exactly the number of tasks running on the platform.
+            # Payloads are pulled from the generator only as slots free up, keeping
+            # at most two payloads per worker alive at any time.
+            payload_iter = enumerate(self.iter_request_payloads(), start=1)
+            max_pending = max_concurrent * 2
+            pending = set()
+            with ThreadPoolExecutor(max_workers=min(max_concurrent, total), thread_name_prefix="api-task") as executor:
+                for batch_id, payload in itertools.islice(payload_iter, max_pending):
+                    pending.add(executor.submit(self.run_payload, payload, batch_id, run))
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_id, ok = self._task_result(future)
+                        if batch_id is None:
+                            failed += 1
+                            continue
+                        if ok:
+                            succeeded += 1
+                        else:
+                            failed += 1
+                        self.log(f"批次 {batch_id} {'成功' if ok else '失败'} (已完成 {succeeded + failed}/{total})",
+                                 level='SUCCESS' if ok else 'ERROR')
+                    for batch_id, payload in itertools.islice(payload_iter, max_pending - len(pending)):
+                        pending.add(executor.submit(self.run_payload, payload, batch_id, run))
+            return succeeded, failed
+        finally:
+            self.end_run(run, succeeded, failed)
+
+    # --- 监视文件夹 ---
+
+    def _watch_mode_error(self, mode):
+        """Why the planned mode cannot take files as they arrive, or None."""
+        plan = self._payload_plan
+        if mode.startswith("M10") and (not plan['image_default'] or ',' in plan['image_default']):
+            return "M10 模式要求在'单个请求参数'中选择一个固定的图片 (且上传成功)。"
+        if mode.startswith("M11") and (not plan['image_default'] or len(plan['image_default'].split(',')) != 2):
+            return "M11 模式要求在'单个请求参数'的图片栏中填入两个固定的图片文件名 (且全部上传成功)。"
+        if mode.startswith(("M4", "M5")) and not len(plan['prompts']):
+            return f"{mode.split(':')[0]} 模式需要选中包含提示词的 JSON 文件。"
+        return None
+
+    def _extend_plan(self, kind, local_names):
+        """
+        Adds newly arrived files to the running watch-mode plan. The files are uploaded (or
+        queued) the same way generate_payloads() handles batch files; returns the number of
+        payloads they add and an iterator over just those payloads.
+        """
+        plan = self._payload_plan
+        if kind == 'image':
+            self._start_preprocessing(local_names, reset=False)
+        if plan['key_pool']:
+            with self._key_upload_lock:
+                # A rewritten file has to be uploaded again under every key
+                for key in [key for key in self._key_uploads if key[1] in local_names]:
+                    del self._key_uploads[key]
+            self._key_inputs.update(local_names)
+            values = list(local_names)
+        elif self.settings.pipelined:
+            self._start_pipelined_uploads(local_names)
+            values = list(local_names)
+        else:
+            uploaded = self._upload_files_parallel(local_names)
+            values = [uploaded[f] for f in local_names if uploaded.get(f)]
+            self._source_names.update({server: local for local, server in uploaded.items() if server})
+
+        mode = plan['mode']
+        items = plan['images'] if kind == 'image' else plan['videos']
+        old_len = len(items)
+        old_count = count_mode_payloads(mode, len(plan['images']), len(plan['videos']), len(plan['prompts']))
+        items.extend(values)
+        added = count_mode_payloads(mode, len(plan['images']), len(plan['videos']), len(plan['prompts'])) - old_count
+
+        delta = dict(plan)
+        if "M7" in mode:
+            # Windows may span old and new images; restart at the first window not built yet
+            window_size, step_size = (2, 1) if "M7a" in mode else (3, 2)
+            built = (old_len - window_size) // step_size + 1 if old_len >= window_size else 0
+            delta['images'] = items[built * step_size:]
+        elif mode.startswith("M4"):
+            delta['images'] = values
+            delta['prompts'] = list(itertools.islice(plan['prompts'], old_len, old_len + len(values)))
+        elif kind == 'image':
+            delta['images'] = values
+        else:
+            delta['videos'] = values
+        self.payload_count += added
+        return added, self.iter_request_payloads(delta)
+
+    def run_watch(self, current_mode, selected_images_local, selected_videos_local, selected_jsons,
+                  stop_event=None, settle_seconds=2.0, poll_interval=1.0, idle_timeout=0):
+        """
+        Hot-folder mode: plans and runs the selected files like a normal batch, then keeps
+        watching the working directory and feeds each new or rewritten image (video for M2/M9)
+        into upload and submission under current_mode once it has finished writing (see
+        FolderWatcher). Runs on the thread pool. Stops taking new files when stop_event is set,
+        after idle_timeout seconds with nothing running or arriving (0 = never) or on Ctrl+C,
+        then waits for the tasks already submitted. Returns (succeeded, failed), or None when
+        the watch cannot start (mode without batch files, missing fixed image or prompts).
+        """
+        kind = 'video' if current_mode.startswith(("M2", "M9")) else 'image'
+        extensions = VIDEO_EXTENSIONS if kind == 'video' else IMAGE_EXTENSIONS
+        if current_mode.startswith(("M0", "M3", "M6")):
+            self.log(f"{current_mode.split(':')[0]} 模式不处理批量文件, 无法用于监视文件夹。", level='ERROR')
+            return None
+        if self.settings.use_async_engine:
+            self.log("监视文件夹模式使用线程池执行, 已忽略 asyncio 引擎设置。", level='WARNING')
+
+        # Baseline before uploading, so files dropped during generation are not missed
+        watcher = FolderWatcher(self.current_directory, accept=lambda name: name.lower().endswith(extensions),
+                                settle_seconds=settle_seconds, poll_interval=poll_interval)
+        run = None
+        succeeded, failed = 0, 0
+        try:
+            self.generate_payloads(current_mode, selected_images_local, selected_videos_local, selected_jsons,
+                                   auto_recommend=False)
+            plan = self._payload_plan
+            error = self._watch_mode_error(current_mode)
+            if error:
+                self.log(error, level='ERROR')
+                return None
+            if plan['single']:
+                # Not enough files yet (e.g. one image for a sliding window); they will arrive
+                plan['single'] = False
+                plan['mode'] = current_mode
+                self.payload_count = 0
+
+            self.log(f"--- 监视文件夹: {self.current_directory} (新{'视频' if kind == 'video' else '图片'}写入完成 "
+                     f"{watcher.settle_seconds:g}s 后提交, 方式: {watcher.backend}) ---", level='INFO')
+            run = self.begin_run(resume=False)
+            if run is None:
+                return None
+            max_concurrent = run['max_concurrent']
+            backlog = deque([enumerate(self.iter_request_payloads(), start=1)])
+            next_batch_id = self.payload_count + 1
+            pending = set()
+            stopping = aborting = False
+            last_activity = time.monotonic()
+            with ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="api-task") as executor:
+                while not aborting:
+                    try:
+                        if not stopping:
+                            names = watcher.changes()
+                            if names:
+                                self.log(f"监视文件夹: 发现 {len(names)} 个新文件: {', '.join(names[:5])}"
+                                         f"{' ...' if len(names) > 5 else ''}", level='INFO')
+                                count, payloads = self._extend_plan(kind, names)
+                                if count:
+                                    backlog.append(enumerate(payloads, start=next_batch_id))
+                                    next_batch_id += count
+                                self.log(f"监视文件夹: 新增 {count} 个负载 (共 {self.payload_count} 个)", level='INFO')
+                            while backlog and len(pending) < max_concurrent * 2:
+                                item = next(backlog[0], None)
+                                if item is None:
+                                    backlog.popleft()
+                                    continue
+                                batch_id, payload = item
+                                pending.add(executor.submit(self.run_payload, payload, batch_id, run))
+
+                        now = time.monotonic()
+                        if pending or backlog or watcher.pending:
+                            last_activity = now
+                        if not stopping and stop_event is not None and stop_event.is_set():
+                            stopping = True
+                            self.log("监视文件夹: 已停止监视, 等待已提交的任务结束。", level='INFO')
+                        elif not stopping and idle_timeout and now - last_activity >= idle_timeout:
+                            stopping = True
+                            self.log(f"监视文件夹: {idle_timeout:g}s 内没有新文件, 停止监视。", level='INFO')
+                        if stopping and not pending:
+                            break
+
+                        if pending:
+                            done, pending = wait(pending, timeout=watcher.poll_interval, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                batch_id, ok = self._task_result(future)
+                                if batch_id is None:
+                                    failed += 1
+                                    continue
+                                if ok:
+                                    succeeded += 1
+                                else:
+                                    failed += 1
+                                self.log(f"批次 {batch_id} {'成功' if ok else '失败'} (已完成 {succeeded + failed}/{self.payload_count})",
+                                         level='SUCCESS' if ok else 'ERROR')
+                        else:
+                            watcher.wait(watcher.poll_interval)
+                    except KeyboardInterrupt:
+                        if stopping:
+                            aborting = True
+                            cancelled = sum(1 for future in pending if future.cancel())
+                            self.log(f"监视文件夹: 再次中断, 取消 {cancelled} 个排队中的负载, 只等待正在运行的任务。", level='WARNING')
+                        else:
+                            stopping = True
+                            self.log("监视文件夹: 收到中断, 等待已提交的任务结束 (再按一次 Ctrl+C 立即退出)。", level='WARNING')
+            unsubmitted = sum(1 for payloads in backlog for _ in payloads)
+            if unsubmitted:
+                self.log(f"监视文件夹: 停止时还有 {unsubmitted} 个负载未提交, 可在下次运行时重新选择对应文件。", level='WARNING')
+            return succeeded, failed
+        finally:
+            watcher.close()
+            if run is not None:
+                self.end_run(run, succeeded, failed)
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+from key_pool import parse_key_specs
+from multi_config import MultiConfigBatch
+from preprocess import IMAGE_FORMATS
+from runner_core import LOG_FILENAME, RunnerCore, RunSettings, find_mode_option, log_to_file
+
+# --- 命令行入口：无界面运行批量任务 (不导入 tkinter) ---
+
+_print_lock = threading.Lock()
+
+
+def stdout_log(message, level='INFO'):
+    """Same record format as the GUI log pane, streamed to stdout and mirrored to the log file."""
+    log_to_file(message, level)
+    with _print_lock:
+        print(f"{datetime.now().strftime('%H:%M:%S')} [{level}]: {message}", flush=True)
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs or []:
+        if '=' not in pair:
+            raise ValueError(f"--set 参数格式应为 NODE_ID=VALUE: {pair}")
+        node_id, value = pair.split('=', 1)
+        overrides[node_id.strip()] = value
+    return overrides
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="RunningHub 批量任务命令行工具 (与图形界面共用同一核心)")
+    parser.add_argument('--config', required=True, nargs='+',
+                        help="API 配置文件 (JSON 或 curl 命令文本); 指定多个时共用一次扫描/上传, 任务在同一执行池中公平调度")
+    parser.add_argument('--dir', default=os.getcwd(), help="素材目录，默认当前目录")
+    parser.add_argument('--mode', default='M0', help="批量模式代码，如 M1, M4, M7a, M10 (默认 M0)")
+    parser.add_argument('--force-mode', action='store_true', help="不根据输入数量自动推荐模式，严格使用 --mode")
+    parser.add_argument('--images', nargs='*', help="仅使用这些图片 (默认目录中全部图片)")
+    parser.add_argument('--videos', nargs='*', help="仅使用这些视频 (默认目录中全部视频)")
+    parser.add_argument('--jsons', nargs='*', help="仅使用这些提示词 JSON/JSONL (默认目录中全部 JSON/JSONL)")
+    parser.add_argument('--set', dest='overrides', action='append', metavar='NODE_ID=VALUE',
+                        help="覆盖单个节点的值；图片/视频节点填写文件名 (可重复)")
+
+    defaults = RunSettings()
+    parser.add_argument('--concurrency', type=int, default=defaults.max_concurrent_tasks, help="最大并发任务数")
+    parser.add_argument('--upload-concurrency', type=int, default=defaults.upload_concurrency, help="上传并发数")
+    parser.add_argument('--retries', type=int, default=defaults.max_retries, help="最大重试次数")
+    parser.add_argument('--retry-interval', type=int, default=defaults.retry_interval, help="失败重试间隔(s)")
+    parser.add_argument('--success-delay', type=int, default=defaults.upload_delay_on_success, help="成功后间隔(s)")
+    parser.add_argument('--connect-timeout', type=int, default=defaults.upload_timeout, help="连接超时(s)")
+    parser.add_argument('--poll-interval', type=int, default=defaults.task_polling_interval, help="任务轮询间隔(s)")
+    parser.add_argument('--task-timeout', type=int, default=defaults.task_timeout, help="任务超时(s)")
+    parser.add_argument('--cache-ttl', type=int, default=defaults.upload_cache_ttl_hours, help="上传缓存有效期(h, 0=禁用)")
+    parser.add_argument('--result-cache-ttl', type=float, default=defaults.result_cache_ttl_hours,
+                        help="结果缓存有效期(h, 0=禁用): 与之前成功任务完全相同的负载直接复用其输出, 不再提交")
+    parser.add_argument('--force', dest='force_resubmit', action='store_true',
+                        help="本次运行忽略结果缓存, 所有负载都重新提交")
+    parser.add_argument('--log-payloads', type=int, default=defaults.payload_log_limit,
+                        help="记录前 N 个负载的 JSON (-1=全部, 0=不记录)")
+    parser.add_argument('--create-rate', type=float, default=defaults.create_rate, help="创建任务速率上限(次/s, 0=不限)")
+    parser.add_argument('--upload-rate', type=float, default=defaults.upload_rate, help="上传速率上限(次/s, 0=不限)")
+    parser.add_argument('--poll-rate', type=float, default=defaults.poll_rate, help="结果查询速率上限(次/s, 0=不限)")
+    parser.add_argument('--download-dir', default=defaults.download_dir, help="结果下载目录 (相对路径基于 --dir)")
+    parser.add_argument('--download-concurrency', type=int, default=defaults.download_concurrency, help="结果下载并发数")
+    parser.add_argument('--no-download', action='store_true', help="不自动下载任务结果，只输出 fileUrl")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="流水线模式: 批量文件后台上传, 每个任务在自身输入上传完成后立即提交")
+    parser.add_argument('--dedupe-prompts', action='store_true', help="读取提示词文件 (JSON/JSONL) 时去除重复的提示词")
+    # Preprocessing flags default to None so a config's own "preprocess" block applies unless overridden
+    parser.add_argument('--max-edge', type=int,
+                        help=f"上传前把图片缩放到最长边不超过此值 (px, 0=不缩放, 默认 {defaults.preprocess_max_edge}; 需要 Pillow)")
+    parser.add_argument('--image-format', choices=IMAGE_FORMATS,
+                        help=f"预处理输出格式 (keep=保持原格式, 默认 {defaults.preprocess_format})")
+    parser.add_argument('--image-quality', type=int, help=f"JPEG/WEBP 质量 (默认 {defaults.preprocess_quality})")
+    parser.add_argument('--keep-exif', dest='strip_exif', action='store_false', default=None,
+                        help="预处理时保留 EXIF (默认去除)")
+    parser.add_argument('--preprocess-workers', type=int, help="预处理进程数 (默认 0=CPU 核数)")
+    parser.add_argument('--api-key', dest='api_keys', action='append', metavar='KEY[:并发[:创建速率]]',
+                        help="多账号调度: 可重复指定多个 API Key (替代配置中的 apiKey/apiKeys), 任务按各 Key 的并发上限分配")
+    parser.add_argument('--metrics-interval', type=float, default=defaults.metrics_interval,
+                        help="运行指标 (runninghub_metrics.json / .prom) 导出间隔秒数 (0=只在结束时输出统计表)")
+    parser.add_argument('--fixed-polling', action='store_true', help="关闭自适应轮询，按固定间隔查询")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="使用 asyncio 引擎 (需要 aiohttp)")
+    parser.add_argument('--generate-only', action='store_true', help="只上传并生成负载，不提交任务")
+    parser.add_argument('--resume', action='store_true',
+                        help="续跑: 跳过运行日志 (run_journal.db) 中已完成的负载，并重新接管未完成的任务")
+    parser.add_argument('--watch', action='store_true',
+                        help="监视文件夹: 处理完选中的文件后持续监视 --dir, 新写入的图片 (M2/M9 为视频) 按 --mode 自动上传并提交; Ctrl+C 停止")
+    parser.add_argument('--watch-settle', type=float, default=2.0, help="新文件大小/修改时间保持不变多少秒后才视为写入完成 (默认 2)")
+    parser.add_argument('--watch-idle-timeout', type=float, default=0,
+                        help="监视模式下连续多少秒没有新文件和运行中的任务就退出 (默认 0=一直监视)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    settings = RunSettings(
+        upload_timeout=args.connect_timeout, retry_interval=args.retry_interval, max_retries=args.retries,
+        upload_delay_on_success=args.success_delay, max_concurrent_tasks=args.concurrency,
+        upload_concurrency=args.upload_concurrency, upload_cache_ttl_hours=args.cache_ttl,
+        use_async_engine=args.use_async, task_polling_interval=args.poll_interval,
+        task_timeout=args.task_timeout, adaptive_polling=not args.fixed_polling,
+        payload_log_limit=args.log_payloads, create_rate=args.create_rate, upload_rate=args.upload_rate,
+        poll_rate=args.poll_rate, download_results=not args.no_download,
+        download_concurrency=args.download_concurrency, download_dir=args.download_dir, pipelined=args.pipelined,
+        metrics_interval=args.metrics_interval, dedupe_prompts=args.dedupe_prompts,
+        result_cache_ttl_hours=args.result_cache_ttl, force_resubmit=args.force_resubmit,
+    )
+    mode = find_mode_option(args.mode)
+    if not mode:
+        stdout_log(f"未知的批量模式: {args.mode}", level='ERROR')
+        return 2
+
+    if args.watch and (len(args.config) > 1 or args.generate_only or args.resume):
+        stdout_log("--watch 不能与多个 --config、--generate-only 或 --resume 同时使用。", level='ERROR')
+        return 2
+
+    batch = MultiConfigBatch(args.config, settings, log=stdout_log) if len(args.config) > 1 else None
+    try:
+        if batch:
+            cores = [config.core for config in batch.load()]
+        else:
+            core = RunnerCore(settings=settings, log=stdout_log)
+            core.load_config(args.config[0])
+            stdout_log(f"成功加载并解析配置：{os.path.basename(args.config[0])}", level='SUCCESS')
+            cores = [core]
+        for core in cores:
+            for name, value in (('preprocess_max_edge', args.max_edge), ('preprocess_format', args.image_format),
+                                ('preprocess_quality', args.image_quality), ('preprocess_strip_exif', args.strip_exif),
+                                ('preprocess_workers', args.preprocess_workers)):
+                if value is not None:
+                    setattr(core.settings, name, value)
+            if args.api_keys:
+                core.api_key_specs = parse_key_specs(args.api_keys)
+        assets = (batch or core).scan_directory(os.path.abspath(args.dir))
+        overrides = parse_overrides(args.overrides)
+    except (OSError, ValueError) as e:
+        stdout_log(f"加载配置或目录失败: {e}", level='ERROR')
+        return 2
+
+    for core in cores:
+        for node_id, value in overrides.items():
+            target = core.file_overrides if node_id in core.file_overrides else core.value_overrides
+            target[node_id] = value
+
+    stdout_log(f"图片: {len(assets['image'])}, 视频: {len(assets['video'])}, JSON配置: {len(assets['json_config'])}")
+    images = assets['image'] if args.images is None else args.images
+    videos = assets['video'] if args.videos is None else args.videos
+    jsons = assets['json_config'] if args.jsons is None else args.jsons
+
+    if args.watch:
+        # Only files named explicitly are run first; the rest of the folder is the baseline
+        result = core.run_watch(mode, args.images or [], args.videos or [], jsons,
+                                settle_seconds=args.watch_settle, idle_timeout=args.watch_idle_timeout)
+        if result is None:
+            return 2
+        return 0 if result[1] == 0 else 1
+
+    (batch or core).generate_payloads(mode, images, videos, jsons, auto_recommend=not args.force_mode)
+    if args.generate_only:
+        return 0
+
+    _, failed = batch.run(resume=args.resume) if batch else core.run_api_requests(resume=args.resume)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
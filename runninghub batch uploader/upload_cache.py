@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# --- 上传缓存：按文件内容哈希复用服务器端 fileName ---
+
+UPLOAD_CACHE_FILENAME = 'upload_cache.json'
+DEFAULT_MAX_ENTRIES = 5000
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(filepath):
+    """sha256 hex digest of a file's content, read in HASH_CHUNK_SIZE chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """
+    Persistent content-addressed cache of uploaded files.
+
+    Entries map (account, file type, sha256 of content) to the server-side fileName
+    returned by /task/openapi/upload. A secondary path index keyed by absolute path
+    stores (size, mtime_ns, sha256) so unchanged files are not re-hashed on every run.
+    Entries older than ttl_seconds are treated as expired on the server; the least
+    recently used entries are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, cache_path=UPLOAD_CACHE_FILENAME, ttl_seconds=24 * 3600, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.path_index = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.path_index = data.get('path_index', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError):
+            # A corrupt cache file only costs re-uploads; start over.
+            self.entries, self.path_index = {}, {}
+
+    def save(self):
+        """Writes the cache atomically if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            serialized = json.dumps({'entries': self.entries, 'path_index': self.path_index}, ensure_ascii=False)
+            self._dirty = False
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(serialized)
+        os.replace(tmp_path, self.cache_path)
+
+    def content_hash(self, filepath):
+        """Returns the sha256 of the file, using the size/mtime fast path when possible."""
+        abs_path = os.path.abspath(filepath)
+        st = os.stat(abs_path)
+        with self._lock:
+            known = self.path_index.get(abs_path)
+            if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+                return known['sha256']
+
+        sha256 = file_sha256(abs_path)
+
+        with self._lock:
+            self.path_index[abs_path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+            self._dirty = True
+        return sha256
+
+    @staticmethod
+    def make_key(api_key, file_type, sha256):
+        # Uploaded files belong to an account, so the key is scoped by a digest of the apiKey.
+        account = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+        return f"{account}:{file_type}:{sha256}"
+
+    def get(self, key, size=0):
+        """Returns the cached server fileName for key, or None on miss/expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and self.ttl_seconds > 0 and now - entry['uploaded_at'] < self.ttl_seconds:
+                entry['last_used'] = now
+                self.hits += 1
+                self.bytes_saved += size
+                self._dirty = True
+                return entry['fileName']
+            if entry:
+                del self.entries[key]
+                self._dirty = True
+            self.misses += 1
+            return None
+
+    def put(self, key, server_filename, size=0):
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {'fileName': server_filename, 'uploaded_at': now, 'last_used': now, 'size': size}
+            self._dirty = True
+            self._evict_locked()
+
+    def _evict_locked(self):
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used'])[:overflow]:
+                del self.entries[key]
+        if len(self.path_index) > self.max_entries * 2:
+            for path in list(self.path_index)[:len(self.path_index) - self.max_entries * 2]:
+                del self.path_index[path]
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.bytes_saved = 0
+
+    def stats_summary(self):
+        return (f"上传缓存: 命中 {self.hits}, 未命中 {self.misses}, "
+                f"节省上传 {self.bytes_saved / (1024 * 1024):.1f} MB")
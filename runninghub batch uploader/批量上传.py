@@ -1,39 +1,25 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import requests
-import json
 import os
 import logging
 from datetime import datetime
-import re 
-import time 
 import threading
+import queue
+from collections import deque
 
-# --- 日志与错误报告功能 ---
+from multi_config import MultiConfigBatch
+from preprocess import IMAGE_FORMATS
+from runner_core import BATCH_MODE_OPTIONS, LOG_FILENAME, RunnerCore, log_to_file
+
+# --- 日志功能 ---
 
-LOG_FILENAME = 'api_runner_log.txt'
 logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-def log_error_report(message, api_data=None):
-    """记录错误并生成详细的错误报告文件."""
-    error_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_filename = f'ERROR_REPORT_{error_time}.txt'
-    
-    logging.error(message)
-    
-    with open(report_filename, 'w', encoding='utf-8') as f:
-        f.write(f"--- API Runner 错误报告 ---\n")
-        f.write(f"时间戳: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"错误信息: {message}\n")
-        f.write(f"--- 当前 API 配置 ---\n")
-        if api_data:
-            f.write(f"URL: {api_data.get('url', 'N/A')}\n")
-            f.write(f"Webapp ID: {api_data.get('webappId', 'N/A')}\n")
-            f.write(f"API Key: {api_data.get('apiKey', 'N/A')[:4]}...\n")
-        f.write(f"------------------------------\n")
-
-    return f"操作失败。已生成错误报告文件：{report_filename}"
+# The log pane keeps only the most recent lines; the full history is in LOG_FILENAME.
+LOG_PANE_MAX_LINES = 2000
+LOG_DRAIN_INTERVAL_MS = 100
+LOG_DRAIN_MAX_RECORDS = 20000
 
 # --- Tkinter GUI 应用类 ---
 
@@ -42,49 +28,60 @@ class APIRunnerApp:
         self.master = master
         self.master.title("API Runner - 未加载配置")
 
-        self.current_directory = os.getcwd()
-        self.scanned_assets = {'image': [], 'video': [], 'json_config': []}
-        self.request_payloads = []
+        # All config/payload/upload/task logic lives in the GUI-free core;
+        # this class only maps Tk widgets and variables onto it.
+        self.core = RunnerCore(log=self.update_log_display, warn=messagebox.showwarning)
+        self.log_queue = queue.Queue()
         
         self.config_filepath_history = {} 
         self.last_loaded_config_path = None
-        self.prompts = [] 
-
-        self.API_DATA = {}
-        self.INTERFACE_INFO = []
-        self.BASE_HEADERS = {"Content-Type": "application/json"}
         
         self.value_vars = {} 
         self.file_vars = {} 
         self.api_info_labels = {} 
-        
-        self.upload_timeout = tk.IntVar(value=60)
-        self.retry_interval = tk.IntVar(value=60)
-        self.max_retries = tk.IntVar(value=6)
-        self.upload_delay_on_success = tk.IntVar(value=0)
+        self.watch_stop_event = None
+        
+        defaults = self.core.settings
+        self.upload_timeout = tk.IntVar(value=defaults.upload_timeout)
+        self.retry_interval = tk.IntVar(value=defaults.retry_interval)
+        self.max_retries = tk.IntVar(value=defaults.max_retries)
+        self.upload_delay_on_success = tk.IntVar(value=defaults.upload_delay_on_success)
+        self.max_concurrent_tasks = tk.IntVar(value=defaults.max_concurrent_tasks)
+        self.upload_concurrency = tk.IntVar(value=defaults.upload_concurrency)
+        self.upload_cache_ttl_hours = tk.IntVar(value=defaults.upload_cache_ttl_hours)
+        self.result_cache_ttl_hours = tk.IntVar(value=defaults.result_cache_ttl_hours)
+        self.force_resubmit = tk.BooleanVar(value=defaults.force_resubmit)
+        self.use_async_engine = tk.BooleanVar(value=defaults.use_async_engine)
+        self.payload_log_limit = tk.IntVar(value=defaults.payload_log_limit)
         
         # New settings for task polling
-        self.task_polling_interval = tk.IntVar(value=5)
-        self.task_timeout = tk.IntVar(value=300)
-        
-        self.BATCH_MODE_OPTIONS = [
-            "M0: 默认单请求模式",
-            "M1: 多图单提示词/视频",
-            "M2: 多视频单提示词/图片",
-            "M3: 纯多提示词批量",
-            "M4: 多图多提示词 1:1 顺序匹配",
-            "M6: 单图多提示词",
-            "M7a: 多图滑窗 (2图/1步, [001,002],[002,003]...)",
-            "M7b: 多图滑窗 (3图/2步, [001,002,003],[003,004,005]...)",
-            "M8: 纯多图批量",
-            "M9: 纯多视频批量",
-            "M10: 固定单图+多图组合",
-            "M11: 固定双图+多图组合",
-            "M5: (危险) 笛卡尔积/全组合"
-        ]
+        self.task_polling_interval = tk.IntVar(value=defaults.task_polling_interval)
+        self.task_timeout = tk.IntVar(value=defaults.task_timeout)
+        self.adaptive_polling = tk.BooleanVar(value=defaults.adaptive_polling)
+
+        # Requests/second limits (0 = unlimited)
+        self.create_rate = tk.DoubleVar(value=defaults.create_rate)
+        self.upload_rate = tk.DoubleVar(value=defaults.upload_rate)
+        self.poll_rate = tk.DoubleVar(value=defaults.poll_rate)
+        self.rate_status_var = tk.StringVar(value="当前速率: -")
+
+        self.download_results = tk.BooleanVar(value=defaults.download_results)
+        self.download_concurrency = tk.IntVar(value=defaults.download_concurrency)
+        self.pipelined = tk.BooleanVar(value=defaults.pipelined)
+        self.metrics_interval = tk.IntVar(value=defaults.metrics_interval)
+        self.dedupe_prompts = tk.BooleanVar(value=defaults.dedupe_prompts)
+
+        # Image preprocessing before upload
+        self.preprocess_max_edge = tk.IntVar(value=defaults.preprocess_max_edge)
+        self.preprocess_format = tk.StringVar(value=defaults.preprocess_format)
+        self.preprocess_quality = tk.IntVar(value=defaults.preprocess_quality)
+        self.preprocess_strip_exif = tk.BooleanVar(value=defaults.preprocess_strip_exif)
+        
+        self.BATCH_MODE_OPTIONS = BATCH_MODE_OPTIONS
         self.batch_mode_var = tk.StringVar(value=self.BATCH_MODE_OPTIONS[0])
 
         self.create_widgets()
+        self.master.after(LOG_DRAIN_INTERVAL_MS, self._drain_log_queue)
         self.update_log_display("请点击 '导入新配置' 或从下拉菜单选择文件来启动应用。", level='WARNING')
 
     def create_widgets(self):
@@ -114,6 +111,12 @@ class APIRunnerApp:
 
         self.run_btn = ttk.Button(control_area, text="🚀 运行 API 请求", command=self.start_run_api_requests_thread, state='disabled')
         self.run_btn.pack(side='left', padx=(0, 10))
+        self.resume_btn = ttk.Button(control_area, text="⏯ 续跑 (跳过已完成)", command=self.start_resume_api_requests_thread, state='disabled')
+        self.resume_btn.pack(side='left', padx=(0, 10))
+        self.multi_config_btn = ttk.Button(control_area, text="🗂 多配置批量运行", command=self.open_multi_config_dialog)
+        self.multi_config_btn.pack(side='left', padx=(0, 10))
+        self.watch_btn = ttk.Button(control_area, text="👁 监视文件夹", command=self.toggle_watch)
+        self.watch_btn.pack(side='left', padx=(0, 10))
         
         settings_frame = ttk.LabelFrame(control_area, text="运行/重试设置")
         settings_frame.pack(side='left', fill='x', expand=True)
@@ -131,6 +134,21 @@ class APIRunnerApp:
 
         ttk.Label(parent_frame, text="成功上传间隔(s):").pack(side='left', padx=(5, 2))
         ttk.Entry(parent_frame, textvariable=self.upload_delay_on_success, width=5).pack(side='left', padx=(0, 10))
+
+        ttk.Label(parent_frame, text="最大并发任务数:").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.max_concurrent_tasks, width=5).pack(side='left', padx=(0, 10))
+
+        ttk.Label(parent_frame, text="上传并发数:").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.upload_concurrency, width=5).pack(side='left', padx=(0, 10))
+
+        ttk.Label(parent_frame, text="上传缓存有效期(h, 0=禁用):").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.upload_cache_ttl_hours, width=5).pack(side='left', padx=(0, 10))
+        ttk.Label(parent_frame, text="结果缓存有效期(h, 0=禁用):").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.result_cache_ttl_hours, width=5).pack(side='left', padx=(0, 5))
+        ttk.Checkbutton(parent_frame, text="强制重新提交", variable=self.force_resubmit).pack(side='left', padx=(0, 10))
+
+        ttk.Label(parent_frame, text="负载日志样本数(-1=全部):").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.payload_log_limit, width=5).pack(side='left', padx=(0, 10))
         
         ttk.Label(parent_frame, text="任务轮询间隔(s):").pack(side='left', padx=(5, 2))
         ttk.Entry(parent_frame, textvariable=self.task_polling_interval, width=5).pack(side='left', padx=(0, 10))
@@ -138,6 +156,32 @@ class APIRunnerApp:
         ttk.Label(parent_frame, text="任务超时(s):").pack(side='left', padx=(5, 2))
         ttk.Entry(parent_frame, textvariable=self.task_timeout, width=5).pack(side='left', padx=(0, 5))
 
+        ttk.Checkbutton(parent_frame, text="自适应轮询", variable=self.adaptive_polling).pack(side='left', padx=(5, 5))
+        ttk.Checkbutton(parent_frame, text="asyncio 引擎", variable=self.use_async_engine).pack(side='left', padx=(5, 5))
+
+        ttk.Label(parent_frame, text="速率(/s, 0=不限) 创建:").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.create_rate, width=5).pack(side='left', padx=(0, 5))
+        ttk.Label(parent_frame, text="上传:").pack(side='left', padx=(0, 2))
+        ttk.Entry(parent_frame, textvariable=self.upload_rate, width=5).pack(side='left', padx=(0, 5))
+        ttk.Label(parent_frame, text="查询:").pack(side='left', padx=(0, 2))
+        ttk.Entry(parent_frame, textvariable=self.poll_rate, width=5).pack(side='left', padx=(0, 10))
+        ttk.Label(parent_frame, textvariable=self.rate_status_var).pack(side='left', padx=(5, 5))
+
+        ttk.Checkbutton(parent_frame, text="自动下载结果", variable=self.download_results).pack(side='left', padx=(5, 2))
+        ttk.Label(parent_frame, text="下载并发数:").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.download_concurrency, width=5).pack(side='left', padx=(0, 10))
+        ttk.Checkbutton(parent_frame, text="流水线上传", variable=self.pipelined).pack(side='left', padx=(5, 5))
+        ttk.Checkbutton(parent_frame, text="提示词去重", variable=self.dedupe_prompts).pack(side='left', padx=(5, 5))
+        ttk.Label(parent_frame, text="指标导出间隔(s, 0=关闭):").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.metrics_interval, width=5).pack(side='left', padx=(0, 10))
+
+        ttk.Label(parent_frame, text="预处理最长边(px, 0=关闭):").pack(side='left', padx=(5, 2))
+        ttk.Entry(parent_frame, textvariable=self.preprocess_max_edge, width=6).pack(side='left', padx=(0, 5))
+        ttk.Combobox(parent_frame, textvariable=self.preprocess_format, values=IMAGE_FORMATS, state='readonly', width=6).pack(side='left', padx=(0, 5))
+        ttk.Label(parent_frame, text="质量:").pack(side='left', padx=(0, 2))
+        ttk.Entry(parent_frame, textvariable=self.preprocess_quality, width=4).pack(side='left', padx=(0, 5))
+        ttk.Checkbutton(parent_frame, text="去除 EXIF", variable=self.preprocess_strip_exif).pack(side='left', padx=(0, 5))
+
     def _build_unified_ui(self, parent_frame):
         load_frame = ttk.LabelFrame(parent_frame, text="API 配置加载")
         load_frame.pack(fill="x", padx=5, pady=5)
@@ -159,7 +203,7 @@ class APIRunnerApp:
         scan_frame = ttk.LabelFrame(parent_frame, text="本地文件管理")
         scan_frame.pack(fill="x", padx=5, pady=10)
         
-        self.dir_label_var = tk.StringVar(value=self.current_directory)
+        self.dir_label_var = tk.StringVar(value=self.core.current_directory)
         ttk.Label(scan_frame, text="当前目录:").pack(anchor="w", padx=5, pady=2)
         ttk.Label(scan_frame, textvariable=self.dir_label_var, foreground="blue").pack(anchor="w", padx=5)
         
@@ -184,7 +228,7 @@ class APIRunnerApp:
         for widget in self.editor_container_frame.winfo_children():
             widget.destroy()
             
-        if not self.API_DATA:
+        if not self.core.API_DATA:
             ttk.Label(self.editor_container_frame, text="请先加载 API 配置以编辑接口值。").pack(padx=20, pady=20)
             return
 
@@ -206,7 +250,7 @@ class APIRunnerApp:
 
         self.value_vars = {} 
         self.file_vars = {}
-        for info in self.INTERFACE_INFO:
+        for info in self.core.INTERFACE_INFO:
             row_frame = ttk.Frame(self.interface_list_frame)
             row_frame.pack(fill="x", pady=3, padx=5)
             
@@ -240,9 +284,9 @@ class APIRunnerApp:
         listbox_container = ttk.Frame(batch_frame)
         listbox_container.pack(fill="both", expand=True)
         
-        self.image_listbox, _ = self._create_file_listbox(listbox_container, "图片文件", self.scanned_assets['image'], 'extended')
-        self.video_listbox, _ = self._create_file_listbox(listbox_container, "视频文件", self.scanned_assets['video'], 'extended')
-        self.json_listbox, _ = self._create_file_listbox(listbox_container, "JSON 提示词/配置", self.scanned_assets['json_config'], 'extended')
+        self.image_listbox, _ = self._create_file_listbox(listbox_container, "图片文件", self.core.scanned_assets['image'], 'extended')
+        self.video_listbox, _ = self._create_file_listbox(listbox_container, "视频文件", self.core.scanned_assets['video'], 'extended')
+        self.json_listbox, _ = self._create_file_listbox(listbox_container, "JSON 提示词/配置", self.core.scanned_assets['json_config'], 'extended')
 
     def _create_file_listbox(self, parent, title, file_list, selectmode):
         frame = ttk.LabelFrame(parent, text=f"{title} ({len(file_list)}个)")
@@ -318,39 +362,13 @@ class APIRunnerApp:
         self.update_log_display(f"尝试从文件加载配置: {filename}", level='INFO')
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-            
-            config = None
-            try:
-                config = json.loads(file_content)
-            except json.JSONDecodeError:
-                url_match = re.search(r'(?:POST|GET|PUT)\s+[\'"](https?:\/\/[^\'"]+)[\'"]', file_content)
-                api_url = url_match.group(1) if url_match else None
-                json_body_match = re.search(r'(?:--data-raw|--data)\s+[\'"]\s*(\{.*\})\s*[\'"]', file_content, re.DOTALL)
-                if not api_url or not json_body_match:
-                    raise ValueError("未在文件中找到有效的 API URL 和/或 JSON 请求主体。")
-                json_string = json_body_match.group(1)
-                body_data = json.loads(json_string)
-
-                config = {
-                    "url": api_url, "webappId": body_data.get('webappId'), "apiKey": body_data.get('apiKey'), "nodeInfoList": body_data.get('nodeInfoList')
-                }
-            
-            required_keys = ['url', 'webappId', 'apiKey', 'nodeInfoList']
-            if not all(key in config and config[key] for key in required_keys):
-                raise ValueError("解析后的配置信息中缺少必要的字段。")
-
-            self.API_DATA = config
-            self.INTERFACE_INFO = [
-                {
-                    "code": node['nodeId'],
-                    "name": node['description'],
-                    "type": node['fieldName'],
-                    "default_value": node.get('fieldValue', '')
-                }
-                for node in config['nodeInfoList']
-            ]
+            self.core.load_config(filepath)
+            # A config may carry its own preprocessing block; show it in the settings fields
+            settings = self.core.settings
+            self.preprocess_max_edge.set(settings.preprocess_max_edge)
+            self.preprocess_format.set(settings.preprocess_format)
+            self.preprocess_quality.set(settings.preprocess_quality)
+            self.preprocess_strip_exif.set(bool(settings.preprocess_strip_exif))
             
             if add_to_history:
                 self.config_filepath_history[filename] = filepath
@@ -359,9 +377,9 @@ class APIRunnerApp:
 
             self.master.title(f"API Runner - {filename}")
             self.config_file_label.config(text=f"当前文件: {filename}")
-            self.api_info_labels['url'].config(text=f"URL: {self.API_DATA['url']}")
-            self.api_info_labels['webappId'].config(text=f"Webapp ID: {self.API_DATA['webappId']}")
-            key_display = f"{self.API_DATA['apiKey'][:4]}...{self.API_DATA['apiKey'][-4:]}" if self.API_DATA.get('apiKey') else 'N/A'
+            self.api_info_labels['url'].config(text=f"URL: {self.core.API_DATA['url']}")
+            self.api_info_labels['webappId'].config(text=f"Webapp ID: {self.core.API_DATA['webappId']}")
+            key_display = f"{self.core.API_DATA['apiKey'][:4]}...{self.core.API_DATA['apiKey'][-4:]}" if self.core.API_DATA.get('apiKey') else 'N/A'
             self.api_info_labels['apiKey'].config(text=f"API Key: {key_display}")
             
             self._build_editor_ui()
@@ -379,128 +397,21 @@ class APIRunnerApp:
         self.update_log_display("开始扫描当前目录下的文件...")
         
         try:
-            files = os.listdir(self.current_directory)
+            self.core.scan_directory()
         except FileNotFoundError:
             self.update_log_display("错误: 当前目录不存在。", level='ERROR')
             return
-            
-        self.scanned_assets['image'] = sorted([f for f in files if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        self.scanned_assets['video'] = sorted([f for f in files if f.lower().endswith(('.mp4', '.mov', '.avi', '.webm'))]) 
-        self.scanned_assets['json_config'] = sorted([f for f in files if f.lower().endswith('.json')])
         
-        if hasattr(self, 'editor_container_frame'):
+        # Rebuilding resets the editor fields and list selections, so only do it when files changed
+        if hasattr(self, 'editor_container_frame') and (self.core.scan_changed or not hasattr(self, 'image_listbox')):
             self._build_editor_ui()
 
-        status_msg = (f"图片: {len(self.scanned_assets['image'])}, "
-                      f"视频: {len(self.scanned_assets['video'])}, "
-                      f"JSON配置: {len(self.scanned_assets['json_config'])}")
+        status_msg = (f"图片: {len(self.core.scanned_assets['image'])}, "
+                      f"视频: {len(self.core.scanned_assets['video'])}, "
+                      f"JSON配置: {len(self.core.scanned_assets['json_config'])}")
         self.scan_status_label.config(text=f"文件扫描状态: {status_msg}")
         self.update_log_display("文件扫描完成。", level='INFO')
 
-    def extract_prompts_from_json(self, json_filenames):
-        self.prompts = []
-        text_node_info = next((info for info in self.INTERFACE_INFO if info['type'] in ('text', 'prompt')), None)
-        
-        if not text_node_info:
-            if json_filenames:
-                self.update_log_display("当前API配置中未找到 'text' 或 'prompt' 类型的字段，无法加载提示词。", level='WARNING')
-            return
-
-        text_id = text_node_info['code']
-        dynamic_prompt_key = text_node_info['type']
-
-        for filename in json_filenames:
-            filepath = os.path.join(self.current_directory, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                parsed = False
-                # 1. Try to parse based on a list of dictionaries with a dynamic key
-                if isinstance(data, list) and data and isinstance(data[0], dict):
-                    if dynamic_prompt_key in data[0]:
-                        self.prompts.extend([item.get(dynamic_prompt_key) for item in data])
-                        parsed = True
-                    # Backward compatibility for hardcoded "prompt" key
-                    elif 'prompt' in data[0]:
-                        self.prompts.extend([item.get('prompt') for item in data])
-                        self.update_log_display(f"警告: JSON文件 {filename} 使用 'prompt' 键，但当前API配置需要 '{dynamic_prompt_key}'。已作为兼容模式加载。", level='WARNING')
-                        parsed = True
-                
-                if parsed: continue
-
-                # 2. Try to parse a full API payload format
-                temp_data = [data] if isinstance(data, dict) else data
-                if isinstance(temp_data, list) and temp_data and isinstance(temp_data[0], dict) and 'nodeInfoList' in temp_data[0]:
-                    for payload in temp_data:
-                        for node in payload.get('nodeInfoList', []):
-                            if node.get('nodeId') == text_id and node.get('fieldValue'):
-                                self.prompts.append(node['fieldValue'])
-                    parsed = True
-                
-                if parsed: continue
-
-                # 3. Try to parse a simple list of strings
-                if isinstance(data, list) and all(isinstance(item, str) for item in data):
-                     self.prompts.extend(data)
-                     
-            except Exception as e:
-                self.update_log_display(f"错误: 解析 JSON 文件 {filename} 失败: {e}", level='ERROR')
-        
-        self.prompts = list(filter(None, self.prompts))
-        if json_filenames:
-            self.update_log_display(f"从JSON文件中成功提取了 {len(self.prompts)} 个提示词。", level='INFO')
-
-    def _get_base_payload_nodes(self, image_id, video_id, text_id):
-        base_nodes = []
-        for info in self.INTERFACE_INFO:
-            node_id = info['code']
-            field_value = self.value_vars.get(node_id).get() if self.value_vars.get(node_id) and self.value_vars.get(node_id).get() != '' else info['default_value']
-            
-            if node_id not in [image_id, video_id, text_id] and field_value is not None:
-                 base_nodes.append({
-                    "nodeId": node_id, "fieldName": info['type'], "fieldValue": field_value, "description": info['name']
-                })
-        return base_nodes
-    
-    def _create_payload(self, base_nodes, text_id=None, text_val=None, image_id=None, image_val=None, video_id=None, video_val=None):
-        final_nodes = list(base_nodes)
-        
-        default_text_val = self.value_vars.get(text_id).get() if text_id and self.value_vars.get(text_id) else next((info['default_value'] for info in self.INTERFACE_INFO if info['code'] == text_id), None)
-        default_image_val = self.file_vars.get(image_id).get() if image_id and self.file_vars.get(image_id) else next((info['default_value'] for info in self.INTERFACE_INFO if info['code'] == image_id), None)
-        default_video_val = self.file_vars.get(video_id).get() if video_id and self.file_vars.get(video_id) else next((info['default_value'] for info in self.INTERFACE_INFO if info['code'] == video_id), None)
-        
-        def append_node(node_id, node_type, description, value, default_value):
-            if node_id:
-                 final_nodes.append({
-                    "nodeId": node_id, "fieldName": node_type, "fieldValue": value if value is not None else default_value, "description": description
-                })
-
-        text_info = next((info for info in self.INTERFACE_INFO if info['code'] == text_id), None)
-        if text_info: append_node(text_id, text_info['type'], text_info['name'], text_val, default_text_val)
-            
-        image_info = next((info for info in self.INTERFACE_INFO if info['code'] == image_id), None)
-        if image_info: append_node(image_id, image_info['type'], image_info['name'], image_val, default_image_val)
-            
-        video_info = next((info for info in self.INTERFACE_INFO if info['code'] == video_id), None)
-        if video_info: append_node(video_id, video_info['type'], video_info['name'], video_val, default_video_val)
-            
-        return {
-            "webappId": self.API_DATA['webappId'], "apiKey": self.API_DATA['apiKey'], "nodeInfoList": final_nodes
-        }
-    
-    def _create_single_payload(self):
-        node_info_list = []
-        for info in self.INTERFACE_INFO:
-            node_id = info['code']
-            field_value = self.value_vars.get(node_id).get() if self.value_vars.get(node_id) else info['default_value']
-            node_info_list.append({
-                "nodeId": node_id, "fieldName": info['type'], "fieldValue": field_value, "description": info['name']
-            })
-        return {
-            "webappId": self.API_DATA['webappId'], "apiKey": self.API_DATA['apiKey'], "nodeInfoList": node_info_list
-        }
-
     def _browse_file_for_var(self, target_var, file_type='image'):
         """Opens a file dialog to select a single file and updates the target StringVar."""
         if file_type == 'image':
@@ -511,7 +422,7 @@ class APIRunnerApp:
             filetypes = [("All Files", "*.*")]
 
         filepath = filedialog.askopenfilename(
-            initialdir=self.current_directory,
+            initialdir=self.core.current_directory,
             filetypes=filetypes
         )
         if filepath:
@@ -524,340 +435,221 @@ class APIRunnerApp:
         thread = threading.Thread(target=self.generate_payloads, daemon=True)
         thread.start()
 
+    def _sync_core_settings(self):
+        """Copies the Tk run settings into the core. Raises ValueError/TclError on invalid input."""
+        settings = self.core.settings
+        for name in ('upload_timeout', 'retry_interval', 'max_retries', 'upload_delay_on_success',
+                     'max_concurrent_tasks', 'upload_concurrency', 'upload_cache_ttl_hours', 'result_cache_ttl_hours',
+                     'task_polling_interval', 'task_timeout', 'payload_log_limit', 'download_concurrency',
+                     'preprocess_max_edge', 'preprocess_quality', 'metrics_interval'):
+            setattr(settings, name, int(getattr(self, name).get()))
+        settings.use_async_engine = bool(self.use_async_engine.get())
+        settings.adaptive_polling = bool(self.adaptive_polling.get())
+        settings.download_results = bool(self.download_results.get())
+        settings.pipelined = bool(self.pipelined.get())
+        settings.dedupe_prompts = bool(self.dedupe_prompts.get())
+        settings.force_resubmit = bool(self.force_resubmit.get())
+        settings.preprocess_format = self.preprocess_format.get()
+        settings.preprocess_strip_exif = bool(self.preprocess_strip_exif.get())
+        for name in ('create_rate', 'upload_rate', 'poll_rate'):
+            setattr(settings, name, max(0.0, float(getattr(self, name).get())))
+
+    def _sync_core_overrides(self):
+        """Copies the per-node editor values into the core's override maps."""
+        self.core.value_overrides = {node_id: var.get() for node_id, var in self.value_vars.items()}
+        self.core.file_overrides = {node_id: var.get() for node_id, var in self.file_vars.items()}
+
     def generate_payloads(self):
-        if not self.API_DATA:
+        if not self.core.API_DATA:
             messagebox.showerror("错误", "请先加载 API 配置。")
             return
+        try:
+            self._sync_core_settings()
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "运行设置必须是有效的数字。")
+            return
         
         self.generate_btn.config(state='disabled')
         self.run_btn.config(state='disabled')
+        self.resume_btn.config(state='disabled')
         
         try:
-            self.update_log_display("--- 开始生成请求负载 ---", level='INFO')
-
-            # 1. Get selected local filenames
-            selected_images_local = sorted([self.image_listbox.get(i) for i in self.image_listbox.curselection()])
-            selected_videos_local = sorted([self.video_listbox.get(i) for i in self.video_listbox.curselection()])
+            self._sync_core_overrides()
+            selected_images_local = [self.image_listbox.get(i) for i in self.image_listbox.curselection()]
+            selected_videos_local = [self.video_listbox.get(i) for i in self.video_listbox.curselection()]
             selected_jsons = [self.json_listbox.get(i) for i in self.json_listbox.curselection()]
-            
-            # 2. Upload all required files first
-            self.update_log_display("开始上传所有必需的文件...", level='INFO')
-            
-            uploaded_images = [self._upload_file_and_get_url(f) for f in selected_images_local]
-            uploaded_images = [url for url in uploaded_images if url]
-
-            uploaded_videos = [self._upload_file_and_get_url(f) for f in selected_videos_local]
-            uploaded_videos = [url for url in uploaded_videos if url]
-
-            if len(uploaded_images) != len(selected_images_local) or len(uploaded_videos) != len(selected_videos_local):
-                self.update_log_display("一个或多个批量文件上传失败。仅使用上传成功的文件生成任务。", level='WARNING')
-
-            image_id = next((info['code'] for info in self.INTERFACE_INFO if info['type'] == 'image'), None)
-            video_id = next((info['code'] for info in self.INTERFACE_INFO if info['type'] == 'video'), None)
-
-            fixed_image_local = self.file_vars.get(image_id).get() if image_id and self.file_vars.get(image_id) else None
-            fixed_video_local = self.file_vars.get(video_id).get() if video_id and self.file_vars.get(video_id) else None
-
-            uploaded_fixed_image = None
-            if fixed_image_local and ',' in fixed_image_local:
-                fixed_images_parts = [img.strip() for img in fixed_image_local.split(',')]
-                uploaded_fixed_parts = [self._upload_file_and_get_url(p) for p in fixed_images_parts]
-                uploaded_fixed_parts = [url for url in uploaded_fixed_parts if url]
-                if len(uploaded_fixed_parts) == len(fixed_images_parts):
-                     uploaded_fixed_image = ",".join(uploaded_fixed_parts)
-                else:
-                     self.update_log_display("一个或多个固定图片上传失败。", level='ERROR')
-            else:
-                uploaded_fixed_image = self._upload_file_and_get_url(fixed_image_local)
-            
-            uploaded_fixed_video = self._upload_file_and_get_url(fixed_video_local)
-            self.update_log_display("文件上传阶段完成。", level='INFO')
 
-            # 3. Extract prompts
-            self.extract_prompts_from_json(selected_jsons)
-            prompts = self.prompts
-            
-            N_img, N_vid, N_prompt = len(uploaded_images), len(uploaded_videos), len(prompts)
-            
-            # 4. Auto-recommend mode
-            text_id = next((info['code'] for info in self.INTERFACE_INFO if info['type'] in ('text', 'prompt')), None)
-            current_mode = self.batch_mode_var.get()
-            
-            if N_img > 1 and N_prompt > 1 and N_img == N_prompt: self.batch_mode_var.set("M4: 多图多提示词 1:1 顺序匹配")
-            elif N_img == 1 and N_prompt > 1: self.batch_mode_var.set("M6: 单图多提示词")
-            elif N_img > 1 and N_prompt == 0 and N_vid == 0: self.batch_mode_var.set("M8: 纯多图批量")
-            elif N_vid > 1 and N_prompt == 0 and N_img == 0: self.batch_mode_var.set("M9: 纯多视频批量")
-            elif N_img > 1 and N_prompt <= 1:
-                 if "滑窗" not in current_mode and "组合" not in current_mode: self.batch_mode_var.set("M1: 多图单提示词/视频")
-            elif N_vid > 1 and N_prompt <= 1: self.batch_mode_var.set("M2: 多视频单提示词/图片")
-            elif N_prompt > 1 and N_img < 2 and N_vid < 2: self.batch_mode_var.set("M3: 纯多提示词批量")
-            elif "组合" not in current_mode: self.batch_mode_var.set("M0: 默认单请求模式")
-            
-            final_mode = self.batch_mode_var.get()
-            self.update_log_display(f"已根据输入自动推荐模式，当前执行模式: {final_mode}", level='INFO')
+            recommended_mode, final_mode = self.core.generate_payloads(
+                self.batch_mode_var.get(), selected_images_local, selected_videos_local, selected_jsons)
+            self.batch_mode_var.set(recommended_mode)
 
-            # 5. Generate payloads using UPLOADED URLs
-            self.request_payloads = []
-            base_payload_nodes = self._get_base_payload_nodes(image_id, video_id, text_id)
-            
-            prompt_default = prompts[0] if N_prompt == 1 else (self.value_vars.get(text_id).get() if text_id and self.value_vars.get(text_id) else None)
-            image_default = uploaded_fixed_image
-            video_default = uploaded_fixed_video
-            
-            if final_mode.startswith(("M0", "M3", "M6")):
-                items = prompts if N_prompt > 1 else [prompt_default]
-                img_val = uploaded_images[0] if N_img == 1 else image_default
-                for prompt in items:
-                     self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt, image_id, img_val, video_id, video_default))
-                if final_mode.startswith("M0"): self.request_payloads = self.request_payloads[:1]
-
-            elif final_mode.startswith(("M1", "M4", "M7", "M8", "M10", "M11")):
-                if final_mode.startswith("M4"):
-                     for img, prompt in zip(uploaded_images, prompts):
-                        self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt, image_id, img, video_id, video_default))
-                elif "M7" in final_mode:
-                    window_size, step_size = (2, 1) if "M7a" in final_mode else (3, 2)
-                    i = 0
-                    while i + window_size <= N_img:
-                        image_value = ",".join(uploaded_images[i : i + window_size])
-                        self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt_default, image_id, image_value, video_id, video_default))
-                        i += step_size
-                elif final_mode.startswith("M8"):
-                    for img in uploaded_images:
-                        self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, None, image_id, img, video_id, None))
-                elif final_mode.startswith("M10"):
-                    if not image_default or ',' in image_default:
-                        messagebox.showwarning("模式错误", "M10 模式要求在'单个请求参数'中选择一个固定的图片 (且上传成功)。")
-                    else:
-                        for img in uploaded_images:
-                            combined_images = f"{image_default},{img}"
-                            self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt_default, image_id, combined_images, video_id, video_default))
-                elif final_mode.startswith("M11"):
-                    if not image_default or len(image_default.split(',')) != 2:
-                     messagebox.showwarning("模式错误", "M11 模式要求在'单个请求参数'的图片栏中填入两个固定的图片文件名，并用逗号分隔 (且全部上传成功)。")
-                    else:
-                        for img in uploaded_images:
-                            combined_images = f"{image_default},{img}"
-                            self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt_default, image_id, combined_images, video_id, video_default))
-                else: # M1 
-                    for img in uploaded_images:
-                        self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt_default, image_id, img, video_id, video_default))
-
-            elif final_mode.startswith(("M2", "M9")):
-                 if final_mode.startswith("M9"):
-                     for vid in uploaded_videos:
-                         self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, None, image_id, None, video_id, vid))
-                 else:
-                    for vid in uploaded_videos:
-                        self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt_default, image_id, image_default, video_id, vid))
-            elif final_mode.startswith("M5"):
-                if N_img == 0 or N_prompt == 0:
-                     messagebox.showwarning("警告", "笛卡尔积模式要求同时选中多个图片和多个提示词。")
-                     self.request_payloads = [self._create_single_payload()]
-                else:
-                     for img in uploaded_images:
-                         for prompt in prompts:
-                             self.request_payloads.append(self._create_payload(base_payload_nodes, text_id, prompt, image_id, img, video_id, video_default))
-            
-            if not self.request_payloads:
-                 self.request_payloads = [self._create_single_payload()]
-                 final_mode = "M0: 默认单请求模式 (兜底)"
-                
-            num_payloads = len(self.request_payloads)
+            num_payloads = self.core.payload_count
             self.match_status_label.config(text=f"匹配模式: **{final_mode}** ({num_payloads} 个负载)")
-            self.update_log_display(f"成功生成 {num_payloads} 个 API 请求负载。模式: {final_mode}", level='SUCCESS')
-
-            if self.request_payloads:
-                self.update_log_display("--- 生成的请求负载 (JSON) ---", level='INFO')
-                for i, payload in enumerate(self.request_payloads):
-                    payload_str = json.dumps(payload, indent=2, ensure_ascii=False)
-                    self.update_log_display(f"--- 负载 #{i+1} ---\n{payload_str}", level='INFO')
-                self.update_log_display("--- 请求负载日志结束 ---", level='INFO')
         
         finally:
             self.generate_btn.config(state='normal')
-            if self.request_payloads:
+            if self.core.payload_count:
                 self.run_btn.config(state='normal')
-
-    def _upload_file_and_get_url(self, local_filename):
-        """Uploads a single file and returns the server-side filename/URL."""
-        if not local_filename:
-            return None
-
-        filepath = os.path.join(self.current_directory, local_filename)
-        if not os.path.exists(filepath):
-            self.update_log_display(f"Upload Error: File not found at {filepath}", level='ERROR')
-            return None
-
-        file_type = 'video' if local_filename.lower().endswith(('.mp4', '.mov', '.avi', '.webm')) else 'image'
-        upload_url = "https://www.runninghub.cn/task/openapi/upload"
-        
-        files = {'file': (local_filename, open(filepath, 'rb'))}
-        payload = {
-            'apiKey': self.API_DATA['apiKey'],
-            'fileType': file_type
-        }
-
-        self.update_log_display(f"Uploading {file_type}: {local_filename}...", level='INFO')
-
-        try:
-            response = requests.post(upload_url, data=payload, files=files)
-            response.raise_for_status()
-            response_data = response.json()
-
-            if response_data.get('code') == 0 and response_data.get('data', {}).get('fileName'):
-                server_filename = response_data['data']['fileName']
-                self.update_log_display(f"Upload successful: {local_filename} -> {server_filename}", level='SUCCESS')
-                return server_filename
-            else:
-                error_msg = response_data.get('msg', 'Unknown upload error')
-                self.update_log_display(f"Upload failed for {local_filename}: {error_msg}", level='ERROR')
-                return None
-        except requests.exceptions.RequestException as e:
-            self.update_log_display(f"Upload failed for {local_filename} with network error: {e}", level='ERROR')
-            return None
-        except Exception as e:
-            self.update_log_display(f"An unexpected error occurred during upload of {local_filename}: {e}", level='ERROR')
-            return None
-
-    def _handle_single_task(self, payload, batch_id):
-        """
-        Handles the complete lifecycle of a single task: create, poll for status, and get results.
-        Returns True if successful, False otherwise.
-        """
-        api_url = self.API_DATA['url']
-        api_key = self.API_DATA['apiKey']
-        
-        connect_timeout = int(self.upload_timeout.get())
-        polling_interval = int(self.task_polling_interval.get())
-        task_timeout = int(self.task_timeout.get())
-
-        try:
-            # 1. Create the task
-            self.update_log_display(f"批次 {batch_id}: 正在创建任务...", level='INFO')
-            create_response = requests.post(api_url, headers=self.BASE_HEADERS, json=payload, timeout=connect_timeout)
-            create_response.raise_for_status()
-            create_data = create_response.json()
-
-            if create_data.get('code') != 0 or 'data' not in create_data or 'taskId' not in create_data['data']:
-                error_msg = create_data.get('msg', '创建任务时返回了未知错误')
-                self.update_log_display(f"批次 {batch_id}: 创建任务失败: {error_msg}", level='ERROR')
-                return False
-
-            task_id = create_data['data']['taskId']
-            self.update_log_display(f"批次 {batch_id}: 任务创建成功, Task ID: {task_id}", level='INFO')
-
-            # 2. Poll for task completion by checking the outputs endpoint
-            start_time = time.time()
-            outputs_url = "https://www.runninghub.cn/task/openapi/outputs"
-            
-            while True:
-                if time.time() - start_time > task_timeout:
-                    self.update_log_display(f"批次 {batch_id}: 任务超时 ({task_timeout}s)", level='ERROR')
-                    return False
-
-                time.sleep(polling_interval)
-                
-                self.update_log_display(f"批次 {batch_id}: 正在查询任务结果 (Task ID: {task_id})...", level='INFO')
-                outputs_payload = {"apiKey": api_key, "taskId": task_id}
-                
-                try:
-                    outputs_response = requests.post(outputs_url, headers=self.BASE_HEADERS, json=outputs_payload, timeout=connect_timeout)
-                    outputs_response.raise_for_status()
-                    outputs_data = outputs_response.json()
-                except requests.exceptions.RequestException as poll_e:
-                    self.update_log_display(f"批次 {batch_id}: 查询结果时网络错误: {poll_e}, 将在稍后重试查询。", level='WARNING')
-                    continue
-
-                if outputs_data.get('code') == 0:
-                    if isinstance(outputs_data.get('data'), list) and outputs_data['data']:
-                        self.update_log_display(f"批次 {batch_id}: 任务成功完成!", level='SUCCESS')
-                        for i, result in enumerate(outputs_data['data']):
-                            file_url = result.get('fileUrl', 'N/A')
-                            self.update_log_display(f"  结果 {i+1}: {file_url}", level='SUCCESS')
-                        return True
-                    else:
-                        error_msg = outputs_data.get('msg', '任务完成但未返回任何结果或已失败。')
-                        self.update_log_display(f"批次 {batch_id}: {error_msg}", level='ERROR')
-                        return False
-                else:
-                    status_msg = outputs_data.get('msg', '任务仍在处理中...')
-                    self.update_log_display(f"批次 {batch_id}: {status_msg}", level='INFO')
-        
-        except requests.exceptions.RequestException as e:
-            self.update_log_display(f"批次 {batch_id}: 初始网络请求失败: {e}", level='ERROR')
-            return False
-        except Exception as e:
-            log_error_report(f"未知错误在 _handle_single_task: {e}", self.API_DATA)
-            self.update_log_display(f"批次 {batch_id}: 处理时发生未知错误: {e}", level='ERROR')
-            return False
+                self.resume_btn.config(state='normal')
 
     def start_run_api_requests_thread(self):
         """Starts the API request process in a separate thread to keep the UI responsive."""
         thread = threading.Thread(target=self.run_api_requests, daemon=True)
         thread.start()
 
-    def run_api_requests(self):
-        if not self.request_payloads or not self.API_DATA:
+    def start_resume_api_requests_thread(self):
+        """Like a normal run, but payloads finished in an earlier run are skipped via the run journal."""
+        thread = threading.Thread(target=self.run_api_requests, kwargs={'resume': True}, daemon=True)
+        thread.start()
+
+    def run_api_requests(self, resume=False):
+        if not self.core.payload_count or not self.core.API_DATA:
             messagebox.showerror("错误", "请先加载配置并生成请求负载。")
             return
         try:
-            max_retries = int(self.max_retries.get())
-            retry_interval = int(self.retry_interval.get())
-            success_delay = int(self.upload_delay_on_success.get())
-            task_polling_interval = int(self.task_polling_interval.get())
-            task_timeout = int(self.task_timeout.get())
-            connect_timeout = int(self.upload_timeout.get())
-        except ValueError:
-            messagebox.showerror("错误", "运行设置必须是有效的整数。")
+            self._sync_core_settings()
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "运行设置必须是有效的数字。")
             return
         
-        self.update_log_display(f"--- 开始执行 {len(self.request_payloads)} 个 API 请求 ---", level='INFO')
-        settings_log = (f"设置: 连接超时={connect_timeout}s, 失败重试间隔={retry_interval}s, "
-                        f"最大重试={max_retries}次, 成功间隔={success_delay}s, "
-                        f"任务轮询={task_polling_interval}s, 任务超时={task_timeout}s")
-        self.update_log_display(settings_log, level='INFO')
         self.run_btn.config(state='disabled') 
-        
-        for i, payload in enumerate(self.request_payloads):
-            batch_id = i + 1
-            
-            for attempt in range(max_retries + 1):
-                self.update_log_display(f"批次 {batch_id}/{len(self.request_payloads)}: 开始第 {attempt + 1}/{max_retries + 1} 次尝试...", level='INFO')
-                
-                task_successful = self._handle_single_task(payload, batch_id)
-                
-                if task_successful:
-                    is_last_request = (i == len(self.request_payloads) - 1)
-                    if success_delay > 0 and not is_last_request:
-                        self.update_log_display(f"等待 {success_delay} 秒后继续下一个批次...", level='INFO')
-                        time.sleep(success_delay)
-                    break
-                else:
-                    if attempt < max_retries:
-                        self.update_log_display(f"批次 {batch_id} 任务失败，将在 {retry_interval} 秒后重试。", level='WARNING')
-                        time.sleep(retry_interval)
-            else:
-                msg = log_error_report(f"执行批次 {batch_id} 失败，已达到最大重试次数 ({max_retries} 次)。", self.API_DATA)
-                self.update_log_display(msg, level='ERROR')
-
-        self.update_log_display("--- 所有请求执行完毕 ---", level='INFO')
-        self.run_btn.config(state='normal') 
+        self.resume_btn.config(state='disabled')
+        try:
+            self.core.run_api_requests(resume=resume)
+        finally:
+            self.run_btn.config(state='normal') 
+            self.resume_btn.config(state='normal')
+
+    def open_multi_config_dialog(self):
+        """Lets the user pick several imported configs to run together on the current file selection."""
+        if len(self.config_filepath_history) < 2:
+            messagebox.showinfo("多配置批量运行", "请先通过 '导入新配置' 导入至少两个配置文件。")
+            return
+        dialog = tk.Toplevel(self.master)
+        dialog.title("多配置批量运行")
+        ttk.Label(dialog, text="选择要一起运行的配置 (共用当前选中的文件与批量模式, 节点参数使用各配置的默认值):").pack(anchor='w', padx=10, pady=(10, 5))
+        listbox = tk.Listbox(dialog, selectmode='multiple', exportselection=False, width=60,
+                             height=min(12, len(self.config_filepath_history)))
+        for filename in self.config_filepath_history:
+            listbox.insert('end', filename)
+        listbox.pack(fill='both', expand=True, padx=10)
+
+        def start():
+            paths = [self.config_filepath_history[listbox.get(i)] for i in listbox.curselection()]
+            if len(paths) < 2:
+                messagebox.showwarning("多配置批量运行", "请至少选择两个配置。", parent=dialog)
+                return
+            dialog.destroy()
+            threading.Thread(target=self.run_multi_config_batch, args=(paths,), daemon=True).start()
+
+        ttk.Button(dialog, text="🚀 开始运行", command=start).pack(pady=10)
+
+    def run_multi_config_batch(self, config_paths):
+        try:
+            self._sync_core_settings()
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "运行设置必须是有效的数字。")
+            return
+
+        selected_images_local = [self.image_listbox.get(i) for i in self.image_listbox.curselection()]
+        selected_videos_local = [self.video_listbox.get(i) for i in self.video_listbox.curselection()]
+        selected_jsons = [self.json_listbox.get(i) for i in self.json_listbox.curselection()]
+
+        for button in (self.run_btn, self.resume_btn, self.multi_config_btn):
+            button.config(state='disabled')
+        try:
+            batch = MultiConfigBatch(config_paths, self.core.settings, log=self.update_log_display,
+                                     warn=messagebox.showwarning)
+            try:
+                batch.load()
+                batch.scan_directory(self.core.current_directory)
+            except (OSError, ValueError) as e:
+                self.update_log_display(f"多配置批量运行加载失败: {e}", level='ERROR')
+                return
+            batch.generate_payloads(self.batch_mode_var.get(), selected_images_local, selected_videos_local, selected_jsons)
+            batch.run()
+        finally:
+            self.multi_config_btn.config(state='normal')
+            if self.core.API_DATA:
+                self.run_btn.config(state='normal')
+            if self.core.payload_count:
+                self.resume_btn.config(state='normal')
+
+    def toggle_watch(self):
+        """Starts watching the working directory with the current selection and mode, or stops a running watch."""
+        if self.watch_stop_event is not None:
+            self.watch_stop_event.set()
+            self.watch_btn.config(state='disabled')
+            return
+        if not self.core.API_DATA:
+            messagebox.showerror("错误", "请先加载 API 配置。")
+            return
+        try:
+            self._sync_core_settings()
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "运行设置必须是有效的数字。")
+            return
+        self._sync_core_overrides()
+        selected_images_local = [self.image_listbox.get(i) for i in self.image_listbox.curselection()]
+        selected_videos_local = [self.video_listbox.get(i) for i in self.video_listbox.curselection()]
+        selected_jsons = [self.json_listbox.get(i) for i in self.json_listbox.curselection()]
+
+        self.watch_stop_event = threading.Event()
+        self.watch_btn.config(text="⏹ 停止监视")
+        for button in (self.generate_btn, self.run_btn, self.resume_btn, self.multi_config_btn):
+            button.config(state='disabled')
+        threading.Thread(target=self.run_watch, args=(self.batch_mode_var.get(), selected_images_local,
+                                                      selected_videos_local, selected_jsons), daemon=True).start()
+
+    def run_watch(self, mode, selected_images_local, selected_videos_local, selected_jsons):
+        try:
+            self.core.run_watch(mode, selected_images_local, selected_videos_local, selected_jsons,
+                                stop_event=self.watch_stop_event)
+        finally:
+            self.watch_stop_event = None
+            self.watch_btn.config(text="👁 监视文件夹", state='normal')
+            self.generate_btn.config(state='normal')
+            self.multi_config_btn.config(state='normal')
+            if self.core.payload_count:
+                self.run_btn.config(state='normal')
+                self.resume_btn.config(state='normal')
 
     def update_log_display(self, message, level='INFO'):
-        log_method = getattr(logging, level.lower(), logging.info)
-        log_method(message)
-        
-        self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, f"{datetime.now().strftime('%H:%M:%S')} [{level}]: {message}\n", level)
-        self.log_text.config(state='disabled')
-        self.log_text.see(tk.END)
+        """Thread-safe: writes to the file logger and queues the line for the Tk main loop."""
+        log_to_file(message, level)
+        self.log_queue.put((f"{datetime.now().strftime('%H:%M:%S')} [{level}]: {message}\n", level))
+
+    def _drain_log_queue(self):
+        """
+        Runs on the Tk main loop every LOG_DRAIN_INTERVAL_MS. Inserts all queued lines in one
+        batch and trims the widget to LOG_PANE_MAX_LINES, so it acts as a ring buffer.
+        """
+        records = deque(maxlen=LOG_PANE_MAX_LINES)
+        try:
+            for _ in range(LOG_DRAIN_MAX_RECORDS):
+                records.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if records:
+            self.log_text.config(state='normal')
+            for line, level in records:
+                self.log_text.insert(tk.END, line, level)
+            excess_lines = int(self.log_text.index('end-1c').split('.')[0]) - LOG_PANE_MAX_LINES
+            if excess_lines > 0:
+                self.log_text.delete('1.0', f'{excess_lines + 1}.0')
+            self.log_text.config(state='disabled')
+            self.log_text.see(tk.END)
+
+        if self.core.rate_limits:
+            self.rate_status_var.set(f"当前速率: {self.core.rate_limits.describe()}")
+        self.master.after(LOG_DRAIN_INTERVAL_MS, self._drain_log_queue)
         
     def change_directory(self):
-        new_dir = filedialog.askdirectory(initialdir=self.current_directory)
+        new_dir = filedialog.askdirectory(initialdir=self.core.current_directory)
         if new_dir:
-            self.current_directory = new_dir
-            self.dir_label_var.set(self.current_directory)
+            self.core.current_directory = new_dir
+            self.dir_label_var.set(self.core.current_directory)
             self.update_log_display(f"工作目录已更改为: {new_dir}")
             self.scan_files_and_update_status()
 